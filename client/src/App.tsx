@@ -2,7 +2,7 @@ import React, { useState, useEffect, useCallback, useRef } from 'react';
 import { useFlags, useLDClient } from 'launchdarkly-react-client-sdk';
 import { Container, NavBar, NavBrand, NavLinks, NavLink } from './styles';
 import { Provider, User, UserRecommendations } from './types';
-import { getProviders, getUser, getUserRecommendations, loginUser } from './services/api';
+import { getBootstrap, getUser, getUserRecommendations, loginUser } from './services/api';
 import { identifyUser } from './launchdarkly';
 import { getUserContext, startNewSession } from './services/userIdentity';
 
@@ -50,9 +50,11 @@ function App() {
   // Define fetchProviders function to be used in multiple places
   const fetchProviders = useCallback(async () => {
     try {
-      // Pass userId if available (convert null to undefined)
-      const response = await getProviders(userId || undefined);
-      const { providers, imageVariation } = response;
+      // One request for the catalog and the server-evaluated flag variations
+      // (pass userId if available, converting null to undefined)
+      const response = await getBootstrap(userId || undefined);
+      const { providers, imageVariation, variation } = response;
+      setBackendVariation(variation);
       
       // Log the image variation from the backend
       console.log('Backend image variation:', imageVariation);
@@ -230,6 +232,7 @@ function App() {
           <Services 
             providerId={selectedProvider.id} 
             userId={userId || undefined}
+            variation={backendVariation || undefined}
             onServiceClick={(serviceName, serviceCategory) => {
               console.log(`Selected service: ${serviceName} (${serviceCategory})`);
             }}
@@ -149,7 +149,7 @@ const Chatbot: React.FC = () => {
       const response = await chatbotService.sendMessage(currentMessages);
       console.log('Response received from server:', response);
       
-      if (!response) {
+      if (!response.content) {
         console.error('Empty response received from server');
         // Add an error message
         const errorMessage: ChatMessageType = {
@@ -164,9 +164,9 @@ const Chatbot: React.FC = () => {
       
       // Add assistant message
       const assistantMessage: ChatMessageType = {
-        id: `assistant-${Date.now()}`,
+        id: response.messageId || `assistant-${Date.now()}`,
         role: 'assistant',
-        content: response,
+        content: response.content,
         timestamp: new Date()
       };
       
@@ -8,7 +8,8 @@ import {
   UserRegistrationResponse,
   UserRecommendations,
   AnalyticsResults,
-  TimeOfDay
+  TimeOfDay,
+  BootstrapResponse
 } from '../types';
 import { getAnonymousUserId } from './userIdentity';
 
@@ -23,6 +24,20 @@ const api = axios.create({
   }
 });
 
+// Page-load data: catalog plus all client flag variations in one request
+export const getBootstrap = async (
+  userId?: string,
+  providerId?: string,
+  timePeriod?: TimeOfDay
+): Promise<BootstrapResponse> => {
+  // Use userId if provided, otherwise use anonymous ID
+  const contextId = userId || getAnonymousUserId();
+  const response = await api.get('/bootstrap', {
+    params: { userId: contextId, providerId, timePeriod }
+  });
+  return response.data;
+};
+
 // Provider API calls
 export const getProviders = async (userId?: string): Promise<{providers: Provider[], imageVariation: string}> => {
   // Use userId if provided, otherwise use anonymous ID
@@ -111,20 +126,75 @@ export const getUserRecommendations = async (userId: string): Promise<UserRecomm
 };
 
 // Analytics API calls
-export const trackEvent = async (
+// Events are queued and sent to the bulk endpoint together, instead of one request per event
+const ANALYTICS_BATCH_SIZE = 50;
+const ANALYTICS_FLUSH_INTERVAL_MS = 2000;
+
+interface AnalyticsEvent {
+  type: string;
+  userId: string;
+  variation?: string;
+  metadata?: Record<string, any>;
+}
+
+let analyticsQueue: AnalyticsEvent[] = [];
+let analyticsWaiters: Array<{ resolve: () => void; reject: (error: unknown) => void }> = [];
+let analyticsTimer: ReturnType<typeof setTimeout> | null = null;
+
+export const flushEvents = async (): Promise<void> => {
+  if (analyticsTimer) {
+    clearTimeout(analyticsTimer);
+    analyticsTimer = null;
+  }
+  if (analyticsQueue.length === 0) {
+    return;
+  }
+  const events = analyticsQueue;
+  const waiters = analyticsWaiters;
+  analyticsQueue = [];
+  analyticsWaiters = [];
+  try {
+    await api.post('/analytics/track/bulk', events);
+    waiters.forEach(waiter => waiter.resolve());
+  } catch (error) {
+    waiters.forEach(waiter => waiter.reject(error));
+  }
+};
+
+// Resolves once the event's batch has been accepted by the server
+export const trackEvent = (
   type: string,
   userId: string,
   variation?: string,
   metadata?: Record<string, any>
 ): Promise<void> => {
-  await api.post('/analytics/track', {
-    type,
-    userId,
-    variation,
-    metadata
+  return new Promise((resolve, reject) => {
+    analyticsQueue.push({ type, userId, variation, metadata, timestamp: new Date().toISOString() });
+    analyticsWaiters.push({ resolve, reject });
+    if (analyticsQueue.length >= ANALYTICS_BATCH_SIZE) {
+      flushEvents();
+    } else if (!analyticsTimer) {
+      analyticsTimer = setTimeout(flushEvents, ANALYTICS_FLUSH_INTERVAL_MS);
+    }
   });
 };
 
+// Send what is still queued when the page goes away; a beacon outlives the page.
+// NDJSON as text/plain keeps it a simple cross-origin request.
+if (typeof window !== 'undefined') {
+  window.addEventListener('pagehide', () => {
+    if (analyticsQueue.length === 0 || !navigator.sendBeacon) {
+      return;
+    }
+    const body = analyticsQueue.map(event => JSON.stringify(event)).join('\n');
+    if (navigator.sendBeacon(`${API_URL}/analytics/track/bulk`, new Blob([body], { type: 'text/plain' }))) {
+      analyticsWaiters.forEach(waiter => waiter.resolve());
+      analyticsQueue = [];
+      analyticsWaiters = [];
+    }
+  });
+}
+
 export const getAnalyticsResults = async (): Promise<AnalyticsResults> => {
   const response = await api.get('/analytics/results');
   return response.data;
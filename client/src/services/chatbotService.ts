@@ -12,47 +12,59 @@ export interface ChatMessage {
   feedbackPositive?: boolean;
 }
 
+// Reply text plus the server-issued ID used to attribute feedback to it
+export interface ChatReply {
+  content: string;
+  messageId?: string;
+}
+
 export class ChatbotService {
   private ldClient: LDClient;
   private apiUrl: string = 'http://localhost:5003'; // Backend API URL
+  private conversationId?: string; // Server-side conversation, so only new messages are sent
   
   constructor(ldClient: LDClient) {
     this.ldClient = ldClient;
   }
   
   // Send a message to the AI and get a response
-  async sendMessage(messages: ChatMessage[]): Promise<string> {
+  async sendMessage(messages: ChatMessage[]): Promise<ChatReply> {
     try {
       // Use the current session ID
       const userId = getAnonymousUserId();
       console.log('Using session ID for chatbot request:', userId);
       
-      // Format messages for the server
-      const formattedMessages = messages.map(msg => ({
+      // Send only the new user message; the server keeps the conversation history.
+      // The earlier messages seed a new conversation if the server has none for us.
+      const latest = messages[messages.length - 1];
+      const history = messages.slice(0, -1).map(msg => ({
         role: msg.role,
         content: msg.content
       }));
       
       // Call the server endpoint
-      console.log('Sending message to server:', formattedMessages);
+      console.log('Sending message to server:', latest.content);
       const response = await axios.post(`${this.apiUrl}/api/chatbot/message`, {
         userId,
-        messages: formattedMessages
+        message: latest.content,
+        conversationId: this.conversationId,
+        messages: this.conversationId ? undefined : history
       });
       
       console.log('Response from server:', response.data);
       
       // Check if the response is successful
       if (response.data.status === 'success') {
+        this.conversationId = response.data.conversationId || this.conversationId;
         console.log('Successful response, returning message:', response.data.message);
-        return response.data.message;
+        return { content: response.data.message, messageId: response.data.messageId || undefined };
       } else {
         console.error('Error from server:', response.data.message);
-        return `Error: ${response.data.message}`;
+        return { content: `Error: ${response.data.message}` };
       }
     } catch (error) {
       console.error('Error sending message to server:', error);
-      return 'Sorry, there was an error processing your request. Please try again later.';
+      return { content: 'Sorry, there was an error processing your request. Please try again later.' };
     }
   }
   
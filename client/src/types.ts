@@ -34,6 +34,15 @@ export interface ClassScheduleItem {
 
 export type TimeOfDay = 'morning' | 'afternoon' | 'evening';
 
+// Bootstrap types
+export interface BootstrapResponse extends ServicesResponse {
+  providers: Provider[];
+  imageVariation: string;
+  chatbotEnabled: boolean;
+  schedule: ClassScheduleItem[];
+  timePeriod: TimeOfDay;
+}
+
 // User types
 export interface UserPreferences {
   favorite_activities: string[];
@@ -0,0 +1,549 @@
+"""
+Columnar Analytics Event Store
+
+This module provides an append-only store for the analytics events posted
+by the client (service views and clicks) and for chatbot feedback records.
+Per-variation counters are updated as events arrive, so the results
+endpoint answers in constant time however many events have accumulated.
+The raw events are kept in compact columnar chunks with interned
+type/variation/user codes, which also carry their own counters and time
+range so time-windowed queries only scan the chunks on the window edges.
+When an EventLog is attached, every stored event is also appended to it
+and the store is rebuilt from the log at startup.
+
+Events are stored at the time the client sent in their "timestamp" (Unix
+seconds or ISO 8601), clamped to within max_clock_skew of the time they
+were received; events without a usable timestamp get the receive time.
+"""
+
+import logging
+import math
+import queue
+import threading
+import time
+from array import array
+from datetime import datetime
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from event_log import EventLog, decode_event, validate_event
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Variations reported by the results endpoint, matching the sort experiment
+DEFAULT_VARIATIONS = ("variation_1", "variation_2", "variation_3", "variation_4")
+
+# Fields stored in dedicated columns; anything else goes into the sparse extras
+_COLUMN_FIELDS = ("type", "variation", "userId", "timestamp")
+
+
+def parse_timestamp(value: Any) -> Optional[float]:
+    """
+    Read a time given as Unix seconds (a number or numeric string) or an ISO 8601 string.
+
+    Returns:
+        float: Unix timestamp, or None if the value is missing or not a valid time
+    """
+    if isinstance(value, bool):
+        return None
+    if isinstance(value, (int, float)):
+        timestamp = float(value)
+    elif isinstance(value, str):
+        try:
+            timestamp = float(value)
+        except ValueError:
+            try:
+                parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+            except ValueError:
+                return None
+            if parsed.tzinfo is None:
+                # Naive timestamps are UTC, like the ones this API returns
+                timestamp = (parsed - datetime(1970, 1, 1)).total_seconds()
+            else:
+                timestamp = parsed.timestamp()
+    else:
+        return None
+    return timestamp if math.isfinite(timestamp) else None
+
+
+class StringTable:
+    """Interns strings to small integer codes; code 0 stands for a missing value."""
+
+    def __init__(self, max_size: int = 0x10000):
+        """
+        Initialize the table.
+
+        Args:
+            max_size: Number of codes the column type can hold, including the missing value
+        """
+        self.max_size = max_size
+        self.values: List[Optional[str]] = [None]
+        self._codes: Dict[str, int] = {}
+
+    def missing(self, values: Iterable[Optional[Any]]) -> int:
+        """Count the distinct values that are not in the table yet."""
+        return len({str(value) for value in values if value is not None} - self._codes.keys())
+
+    def code(self, value: Optional[Any]) -> int:
+        """
+        Return the code for value, adding it to the table if needed.
+
+        Raises:
+            ValueError: If value is new and the table is full
+        """
+        if value is None:
+            return 0
+        value = str(value)
+        code = self._codes.get(value)
+        if code is None:
+            if len(self.values) >= self.max_size:
+                raise ValueError(f"String table is full ({self.max_size} values)")
+            code = len(self.values)
+            self.values.append(value)
+            self._codes[value] = code
+        return code
+
+    def lookup(self, value: Optional[str]) -> Optional[int]:
+        """Return the existing code for value without adding it, or None."""
+        if value is None:
+            return 0
+        return self._codes.get(value)
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+
+class EventChunk:
+    """A fixed-capacity block of events stored column by column."""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.timestamps = array('d')
+        self.types = array('H')
+        self.variations = array('H')
+        self.users = array('I')
+        # Offset -> dict of the remaining fields, only for events that have any
+        self.extras: Dict[int, Dict[str, Any]] = {}
+        # (variation code, type code) -> count for the events in this chunk
+        self.counters: Counter = Counter()
+        self.min_timestamp = float("inf")
+        self.max_timestamp = float("-inf")
+
+    def __len__(self) -> int:
+        return len(self.timestamps)
+
+    @property
+    def full(self) -> bool:
+        return len(self.timestamps) >= self.capacity
+
+    def append(self, timestamp: float, type_code: int, variation_code: int,
+               user_code: int, extras: Optional[Dict[str, Any]]) -> None:
+        if extras:
+            self.extras[len(self.timestamps)] = extras
+        self.timestamps.append(timestamp)
+        self.types.append(type_code)
+        self.variations.append(variation_code)
+        self.users.append(user_code)
+        self.counters[(variation_code, type_code)] += 1
+        self.min_timestamp = min(self.min_timestamp, timestamp)
+        self.max_timestamp = max(self.max_timestamp, timestamp)
+
+
+class AnalyticsStore:
+    """
+    Append-only analytics store with pre-aggregated per-variation counters.
+
+    Events are dicts like {"type": "view", "variation": "variation_2",
+    "userId": "user1", ...}. The type, variation and user are interned into
+    columns; any other fields are kept as-is alongside the event.
+    """
+
+    def __init__(self, chunk_size: int = 4096, log: Optional[EventLog] = None,
+                 max_clock_skew: float = 300.0):
+        """
+        Initialize the store, replaying the log if one is given.
+
+        Args:
+            chunk_size: Number of events per columnar chunk
+            log: Durable log that every stored event is also appended to
+            max_clock_skew: Seconds a client timestamp may differ from the receive time
+        """
+        self.chunk_size = chunk_size
+        self.log = log
+        self.max_clock_skew = max_clock_skew
+        # Sized to the array type of the matching EventChunk column
+        self.types = StringTable(max_size=0x10000)
+        self.variations = StringTable(max_size=0x10000)
+        self.users = StringTable(max_size=0x100000000)
+        self.chunks: List[EventChunk] = []
+        # (variation code, type code) -> count over every event ever stored
+        self.counters: Counter = Counter()
+        self._lock = threading.Lock()
+        self.replayed = 0
+
+        if log is not None:
+            self._replay()
+
+    def _replay(self) -> None:
+        """Load every event in the log into memory without writing it back."""
+        skipped = 0
+        with self._lock:
+            for record in self.log.scan():
+                try:
+                    timestamp, event = decode_event(record)
+                    self._check_room_locked([event])
+                except ValueError:
+                    # A record we cannot read loses that one event, not the whole replay
+                    skipped += 1
+                    continue
+                self._append_locked(event, timestamp)
+                self.replayed += 1
+        if skipped:
+            logger.warning("Skipped %s unreadable analytics events in %s", skipped, self.log.directory)
+        if self.replayed:
+            logger.info("Replayed %s analytics events from %s", self.replayed, self.log.directory)
+
+    def __len__(self) -> int:
+        return sum(len(chunk) for chunk in self.chunks)
+
+    def _check_room_locked(self, events: List[Dict[str, Any]]) -> None:
+        """Raise ValueError, before anything is stored, if the events would overflow a string table."""
+        for table, field in ((self.types, "type"), (self.variations, "variation"), (self.users, "userId")):
+            if len(table) + table.missing(event.get(field) for event in events) > table.max_size:
+                raise ValueError(f"Too many distinct '{field}' values to store (limit {table.max_size - 1})")
+
+    def _event_time(self, event: Dict[str, Any], received: float) -> float:
+        """The event's client timestamp clamped to max_clock_skew of received, or received."""
+        timestamp = parse_timestamp(event.get("timestamp"))
+        if timestamp is None:
+            return received
+        return min(max(timestamp, received - self.max_clock_skew), received + self.max_clock_skew)
+
+    def _append_locked(self, event: Dict[str, Any], timestamp: float) -> None:
+        # Every code is resolved before any column is touched, so the columns stay aligned
+        type_code = self.types.code(event.get("type"))
+        variation_code = self.variations.code(event.get("variation"))
+        user_code = self.users.code(event.get("userId"))
+        extras = {key: value for key, value in event.items() if key not in _COLUMN_FIELDS}
+
+        if not self.chunks or self.chunks[-1].full:
+            self.chunks.append(EventChunk(self.chunk_size))
+        self.chunks[-1].append(timestamp, type_code, variation_code, user_code, extras)
+        self.counters[(variation_code, type_code)] += 1
+
+    def append(self, event: Dict[str, Any], timestamp: Optional[float] = None) -> None:
+        """
+        Store a single event.
+
+        Args:
+            event: The event fields
+            timestamp: Unix time the event was received, defaults to now
+
+        Raises:
+            ValueError: If a field is too long to log (see event_log.validate_event)
+                or a string table has no room for it; nothing is stored then
+        """
+        validate_event(event)
+        timestamp = self._event_time(event, time.time() if timestamp is None else timestamp)
+        with self._lock:
+            self._check_room_locked([event])
+            self._append_locked(event, timestamp)
+            if self.log is not None:
+                self.log.append(timestamp, event)
+
+    def append_many(self, events: Iterable[Dict[str, Any]], timestamp: Optional[float] = None) -> int:
+        """
+        Store a batch of events under a single lock acquisition.
+
+        Args:
+            events: The events to store
+            timestamp: Unix time the batch was received, defaults to now
+
+        Returns:
+            int: Number of events stored
+        """
+        timestamp = time.time() if timestamp is None else timestamp
+        return self.append_batches([(timestamp, events)])
+    
+    def append_batches(self, batches: Iterable[Tuple[float, Iterable[Dict[str, Any]]]]) -> int:
+        """
+        Store several batches of events under a single lock acquisition.
+
+        Args:
+            batches: (Unix time the batch was received, events) pairs
+
+        Returns:
+            int: Number of events stored
+
+        Raises:
+            ValueError: If any event cannot be stored, in which case none are
+        """
+        timed = []
+        for received, events in batches:
+            for event in events:
+                validate_event(event)
+                timed.append((self._event_time(event, received), event))
+        with self._lock:
+            self._check_room_locked([event for _, event in timed])
+            for timestamp, event in timed:
+                self._append_locked(event, timestamp)
+            if self.log is not None:
+                self.log.append_many(timed)
+        return len(timed)
+
+    def _count_in_window(self, since: Optional[float], until: Optional[float]) -> Counter:
+        """Aggregate counters over [since, until), scanning only partially covered chunks."""
+        since = float("-inf") if since is None else since
+        until = float("inf") if until is None else until
+        counts: Counter = Counter()
+
+        for chunk in self.chunks:
+            if chunk.max_timestamp < since or chunk.min_timestamp >= until:
+                continue
+            if chunk.min_timestamp >= since and chunk.max_timestamp < until:
+                counts.update(chunk.counters)
+                continue
+            for i, timestamp in enumerate(chunk.timestamps):
+                if since <= timestamp < until:
+                    counts[(chunk.variations[i], chunk.types[i])] += 1
+        return counts
+
+    def count(self, event_type: str, variation: Optional[str] = None,
+              since: Optional[float] = None, until: Optional[float] = None) -> int:
+        """
+        Count events of a type, optionally for one variation and time window.
+
+        Args:
+            event_type: The event type, e.g. "view" or "click"
+            variation: Only count events for this variation
+            since: Only count events at or after this Unix timestamp
+            until: Only count events before this Unix timestamp
+
+        Returns:
+            int: Number of matching events
+        """
+        with self._lock:
+            type_code = self.types.lookup(event_type)
+            if type_code is None:
+                return 0
+            counters = self.counters if since is None and until is None else self._count_in_window(since, until)
+            if variation is not None:
+                variation_code = self.variations.lookup(variation)
+                return counters.get((variation_code, type_code), 0) if variation_code is not None else 0
+            return sum(count for (_, code), count in counters.items() if code == type_code)
+
+    def results(self, variations: Iterable[str] = DEFAULT_VARIATIONS,
+                since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Get view/click counts and click-through rates per variation.
+
+        Without a time window this reads the running counters only.
+
+        Args:
+            variations: The variations to report
+            since: Only count events at or after this Unix timestamp
+            until: Only count events before this Unix timestamp
+
+        Returns:
+            dict: {variation: {"clicks": n, "views": n, "ctr": percent}}
+        """
+        with self._lock:
+            counters = self.counters if since is None and until is None else self._count_in_window(since, until)
+            view_code = self.types.lookup("view")
+            click_code = self.types.lookup("click")
+
+            results = {}
+            for variation in variations:
+                variation_code = self.variations.lookup(variation)
+                views = counters.get((variation_code, view_code), 0) if variation_code else 0
+                clicks = counters.get((variation_code, click_code), 0) if variation_code else 0
+                ctr = (clicks / views * 100) if views > 0 else 0
+                results[variation] = {"clicks": clicks, "views": views, "ctr": round(ctr, 2)}
+            return results
+
+    def events(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Rebuild the stored events as dicts, oldest first.
+
+        Args:
+            since: Only return events at or after this Unix timestamp
+            until: Only return events before this Unix timestamp
+
+        Yields:
+            dict: The event fields plus its Unix "timestamp"
+        """
+        since = float("-inf") if since is None else since
+        until = float("inf") if until is None else until
+        with self._lock:
+            chunks = list(self.chunks)
+            sizes = [len(chunk) for chunk in chunks]
+
+        for chunk, size in zip(chunks, sizes):
+            if chunk.max_timestamp < since or chunk.min_timestamp >= until:
+                continue
+            for i in range(size):
+                timestamp = chunk.timestamps[i]
+                if not since <= timestamp < until:
+                    continue
+                event = {
+                    "type": self.types.values[chunk.types[i]],
+                    "variation": self.variations.values[chunk.variations[i]],
+                    "userId": self.users.values[chunk.users[i]],
+                    **chunk.extras.get(i, {}),
+                    "timestamp": timestamp
+                }
+                yield event
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the size of the store, its intern tables and the attached log."""
+        with self._lock:
+            stats = {
+                "events": sum(len(chunk) for chunk in self.chunks),
+                "chunks": len(self.chunks),
+                "chunk_size": self.chunk_size,
+                "event_types": len(self.types) - 1,
+                "variations": len(self.variations) - 1,
+                "users": len(self.users) - 1,
+                "replayed": self.replayed
+            }
+        stats["log"] = self.log.get_stats() if self.log is not None else None
+        return stats
+
+    def close(self) -> None:
+        """Sync and close the attached log, if any."""
+        if self.log is not None:
+            self.log.close()
+
+
+class AnalyticsWriter:
+    """
+    Background writer that batches queued events into an AnalyticsStore.
+
+    Request handlers submit batches of events and return immediately; a
+    single writer thread drains the queue and appends everything that has
+    accumulated in one store write. The number of pending events is bounded,
+    and submissions beyond it are refused so callers can shed load.
+    """
+
+    def __init__(self, store: AnalyticsStore, max_pending: int = 100000,
+                 batch_size: int = 5000, flush_interval: float = 0.05):
+        """
+        Initialize the writer and start its thread.
+
+        Args:
+            store: The store to write into
+            max_pending: Maximum number of queued events not yet written
+            batch_size: Target number of events per store write
+            flush_interval: Seconds to wait for more events before writing a partial batch
+        """
+        self.store = store
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self._queue: "queue.Queue[Optional[Tuple[float, List[Dict[str, Any]]]]]" = queue.Queue()
+        self._lock = threading.Lock()
+        self._pending = 0
+        self.accepted = 0
+        self.rejected = 0
+        self.written = 0
+        self.writes = 0
+        self._closed = False
+
+        self._thread = threading.Thread(target=self._run, name="analytics-writer", daemon=True)
+        self._thread.start()
+
+    def submit(self, events: List[Dict[str, Any]]) -> bool:
+        """
+        Queue a batch of events, received now.
+
+        Args:
+            events: The events to store
+
+        Returns:
+            bool: False if the writer is closed or the queue has no room for the batch
+        """
+        with self._lock:
+            if self._closed or self._pending + len(events) > self.max_pending:
+                self.rejected += len(events)
+                return False
+            self._pending += len(events)
+            self.accepted += len(events)
+        self._queue.put((time.time(), events))
+        return True
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            if item is None:
+                self._queue.task_done()
+                return
+
+            # Gather whatever else arrives shortly after, up to the batch size
+            batches = [item]
+            size = len(item[1])
+            deadline = time.monotonic() + self.flush_interval
+            stop = False
+            while size < self.batch_size:
+                remaining = deadline - time.monotonic()
+                try:
+                    next_item = self._queue.get(timeout=max(0.0, remaining)) if remaining > 0 else self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if next_item is None:
+                    stop = True
+                    break
+                batches.append(next_item)
+                size += len(next_item[1])
+
+            try:
+                written = self.store.append_batches(batches)
+            except ValueError:
+                # The store rejected the merged write as a whole; keep the batches it can take
+                written = 0
+                for batch in batches:
+                    try:
+                        written += self.store.append_batches([batch])
+                    except ValueError as e:
+                        logger.error("Dropped %s analytics events: %s", len(batch[1]), e)
+            except Exception as e:
+                written = 0
+                logger.error("Error writing %s analytics events: %s", size, e)
+
+            with self._lock:
+                self._pending -= size
+                self.written += written
+                self.writes += 1
+            for _ in batches:
+                self._queue.task_done()
+
+            if stop:
+                self._queue.task_done()
+                return
+
+    def flush(self) -> None:
+        """Block until every queued event has been written."""
+        self._queue.join()
+
+    def close(self) -> None:
+        """Stop accepting events, write what is queued and stop the thread."""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        self._queue.put(None)
+        self._thread.join()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and write counters."""
+        with self._lock:
+            return {
+                "pending": self._pending,
+                "max_pending": self.max_pending,
+                "accepted": self.accepted,
+                "rejected": self.rejected,
+                "written": self.written,
+                "writes": self.writes,
+                "avg_events_per_write": round(self.written / self.writes, 1) if self.writes else 0
+            }
@@ -1,26 +1,46 @@
-from flask import Flask, jsonify, request
+from flask import Flask, Response, jsonify, request, stream_with_context
 from flask_cors import CORS
 from datetime import datetime
 import random
 import os
 import json
-import time
+import atexit
+import logging
+import uuid
 from dotenv import load_dotenv
 from metrics_tracker import BedrockMetricsTracker
+from analytics_store import AnalyticsStore, AnalyticsWriter, parse_timestamp
+from event_log import EventLog, validate_event
+from user_store import create_user_repository
+from catalog_cache import CatalogResponseCache
+from event_dispatcher import EventDispatcher
+from ttl_cache import TTLCache
+from conversation_store import ConversationStore
+from context_window import ContextWindowBuilder
+from log_config import LazyJson, configure_logging, init_request_ids
 from mock_data import (
     MOCK_PROVIDERS, 
     MOCK_SERVICES, 
     MOCK_SCHEDULE, 
     SORT_VARIATIONS, 
-    MOCK_USER_SEGMENTS,
-    MOCK_USERS
+    MOCK_USER_SEGMENTS
 )
 from ldclient import LDClient, Config, Context
-from ldai.client import LDAIClient, AIConfig, ModelConfig, LDMessage
 
 # Import our new client classes
 from ld_client import LaunchDarklyClient
-from bedrock_client import BedrockClient, create_bedrock_message, create_claude_message
+from bedrock_client import BedrockClient
+from bedrock_engine import EngineSaturatedError
+from aws_clients import bedrock_transport_from_env, get_pool_stats
+from chat_pipeline import ChatPipeline, ChatTurn, describe_error
+from circuit_breaker import CircuitOpenError
+
+# Load environment variables
+load_dotenv()
+
+# Set up logging levels and format from the environment (see log_config)
+configure_logging()
+logger = logging.getLogger("app")
 
 # Try to import boto3, but don't fail if it's not available
 try:
@@ -28,16 +48,13 @@ try:
     BOTO3_AVAILABLE = True
 except ImportError:
     BOTO3_AVAILABLE = False
-    print("Warning: boto3 is not available. AWS Bedrock integration will be disabled.")
-
-# Load environment variables
-load_dotenv()
+    logger.warning("boto3 is not available. AWS Bedrock integration will be disabled.")
 
 # Keep the original LaunchDarklyManager for backward compatibility
 # This will be gradually phased out as we migrate to the new LaunchDarklyClient
 class LaunchDarklyManager:
-    def __init__(self, sdk_key):
-        config = Config(sdk_key)
+    def __init__(self, sdk_key, offline=False):
+        config = Config(sdk_key, offline=offline)
         self.client = LDClient(config=config)
         
         # Set up flag change listeners
@@ -45,7 +62,7 @@ class LaunchDarklyManager:
 
     def setup_flag_listeners(self):
         """Set up listeners for flag changes"""
-        print("Setting up LaunchDarkly flag change listeners")
+        logger.debug("Setting up LaunchDarkly flag change listeners")
         
         # For the Python SDK, we need to use a different approach
         # The Python SDK uses a different method for flag change listeners
@@ -54,7 +71,7 @@ class LaunchDarklyManager:
         # Note: In a production app, you would use the SDK's built-in
         # data source status listeners or implement a webhook endpoint
         # This is a simplified approach for the demo
-        print("Flag change listeners set up (using polling approach)")
+        logger.debug("Flag change listeners set up (using polling approach)")
 
     def get_sort_variation(self, user_context):
         return self.client.variation(
@@ -79,6 +96,15 @@ class LaunchDarklyManager:
             True  # default to enabled for testing
         )
         
+    def get_client_variations(self, user_context):
+        # Evaluate each flag the client uses with variation(), not all_flags_state(),
+        # so LaunchDarkly receives the evaluation events that record experiment exposures
+        return {
+            "imageVariation": self.get_image_variation(user_context),
+            "variation": self.get_sort_variation(user_context),
+            "chatbotEnabled": self.get_chatbot_enabled(user_context)
+        }
+        
     def get_ai_config(self, user_context):
         # Get the AI Config from LaunchDarkly
         return self.client.variation(
@@ -126,9 +152,10 @@ def create_user_context(user_id, provider_id=None, user_data=None):
     }
     
     # Add user segment if we have user data and it's not an anonymous user
-    if not is_anonymous and user_id in MOCK_USERS:
-        custom_attributes["segment"] = MOCK_USERS[user_id]["segment"]
-        custom_attributes["preferences"] = MOCK_USERS[user_id]["preferences"]["favorite_activities"]
+    user = None if is_anonymous else user_repository.get(user_id)
+    if user:
+        custom_attributes["segment"] = user["segment"]
+        custom_attributes["preferences"] = user["preferences"]["favorite_activities"]
     
     # Return the context
     return context
@@ -142,19 +169,75 @@ def get_current_time_period():
     else:
         return 'evening'
 
+def get_requested_time_period():
+    """
+    Get the timePeriod query parameter, or the current period if it is not given.
+    Returns None for a period that has no schedule, so unknown values share one cache entry.
+    """
+    time_period = request.args.get('timePeriod')
+    if time_period is None:
+        return get_current_time_period()
+    return time_period if time_period in MOCK_SCHEDULE else None
+
+def wants_event_stream(data):
+    """
+    Check whether the client asked for a Server-Sent Events response, either
+    with "stream": true in the request body or an Accept: text/event-stream header.
+    Older clients send neither and keep getting the buffered JSON response.
+    """
+    if data.get('stream'):
+        return True
+    return 'text/event-stream' in request.headers.get('Accept', '')
+
+def format_sse(data, event=None):
+    """Format a JSON payload as a single Server-Sent Events message."""
+    message = f"data: {json.dumps(data, default=str)}\n\n"
+    if event:
+        message = f"event: {event}\n" + message
+    return message
+
+def event_stream_response(events):
+    """Wrap a generator of SSE messages in a response that proxies won't buffer."""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def single_message_events(message, conversation_id=None):
+    """Emit a complete reply as one chunk followed by the final done event."""
+    yield format_sse({"text": message}, event="chunk")
+    yield format_sse({
+        "status": "success",
+        "messageId": None,
+        "conversationId": conversation_id,
+        "length": len(message),
+        "usage": None,
+        "metrics": {}
+    }, event="done")
+
 # Initialize Flask app and CORS
 app = Flask(__name__)
-CORS(app)
+CORS(app, expose_headers=["X-Request-ID"])
+init_request_ids(app)
 
 # Get LaunchDarkly SDK key from environment
 sdk_key = os.getenv('LAUNCHDARKLY_SDK_KEY')
 if not sdk_key:
-    print("Warning: LAUNCHDARKLY_SDK_KEY environment variable not found. Using dummy key.")
+    logger.warning("LAUNCHDARKLY_SDK_KEY environment variable not found. Using dummy key.")
     sdk_key = "sdk-key-123456789"  # Dummy key for development
 
+# Offline mode serves every flag's default without contacting LaunchDarkly (benchmarks, load tests)
+ld_offline = os.getenv('LAUNCHDARKLY_OFFLINE', 'false').lower() == 'true'
+if ld_offline:
+    logger.info("LaunchDarkly is offline; flags use their default values")
+
 # Initialize LaunchDarkly clients - both old and new
-ld_manager = LaunchDarklyManager(sdk_key)
-ld_client = LaunchDarklyClient(sdk_key, ai_config_id="guru-guide-ai")
+ld_manager = LaunchDarklyManager(sdk_key, offline=ld_offline)
+ld_client = LaunchDarklyClient(sdk_key, ai_config_id="guru-guide-ai", offline=ld_offline)
 
 # Initialize AWS Bedrock client using our new BedrockClient class
 bedrock_client = None
@@ -163,45 +246,101 @@ if BOTO3_AVAILABLE:
     aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
     aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
 
-    if aws_access_key and aws_secret_key:
+    if bedrock_transport_from_env() == "fake":
+        # The local stand-in needs no credentials
+        bedrock_client = BedrockClient(region_name=aws_region)
+        logger.info("Bedrock client initialized with the local fake transport")
+    elif aws_access_key and aws_secret_key:
         bedrock_client = BedrockClient(
             region_name=aws_region,
             access_key_id=aws_access_key,
             secret_access_key=aws_secret_key
         )
-        print("AWS Bedrock client initialized successfully")
+        logger.info("AWS Bedrock client initialized successfully")
     else:
-        print("Warning: AWS credentials not found. Chatbot will use mock responses.")
+        logger.warning("AWS credentials not found. Chatbot will use mock responses.")
 else:
-    print("Warning: boto3 is not available. Chatbot will use mock responses.")
+    logger.warning("boto3 is not available. Chatbot will use mock responses.")
 
-# Keep the original bedrock_runtime for backward compatibility
-bedrock_runtime = None
-if BOTO3_AVAILABLE:
-    aws_access_key = os.getenv('AWS_ACCESS_KEY_ID')
-    aws_secret_key = os.getenv('AWS_SECRET_ACCESS_KEY')
-    aws_region = os.getenv('AWS_REGION', 'us-east-1')  # Default to us-east-1 if not specified
+# Initialize metrics tracker for Bedrock with LaunchDarkly client (for backward compatibility)
+metrics_tracker = BedrockMetricsTracker(ld_client=ld_manager.client)
 
-    if aws_access_key and aws_secret_key:
-        bedrock_runtime = boto3.client(
-            service_name='bedrock-runtime',
-            region_name=aws_region,
-            aws_access_key_id=aws_access_key,
-            aws_secret_access_key=aws_secret_key
-        )
-        print("Original AWS Bedrock client initialized for backward compatibility")
+# Durable on-disk log for analytics events; set ANALYTICS_LOG_ENABLED=false to keep them in memory only
+analytics_log = None
+if os.getenv('ANALYTICS_LOG_ENABLED', 'true').lower() == 'true':
+    retention_days = float(os.getenv('ANALYTICS_LOG_RETENTION_DAYS', '0'))
+    analytics_log = EventLog(
+        os.getenv('ANALYTICS_LOG_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'analytics')),
+        segment_max_bytes=int(float(os.getenv('ANALYTICS_LOG_SEGMENT_MB', '64')) * 1024 * 1024),
+        fsync_interval=float(os.getenv('ANALYTICS_LOG_FSYNC_INTERVAL_SECONDS', '1.0')),
+        retention_seconds=retention_days * 86400 if retention_days > 0 else None
+    )
 
-# Initialize LaunchDarkly AI client
-ldai_client = LDAIClient(ld_manager.client)
+# Analytics storage with per-variation counters, rebuilt from the log on startup
+analytics_store = AnalyticsStore(
+    log=analytics_log,
+    max_clock_skew=float(os.getenv('ANALYTICS_MAX_CLOCK_SKEW_SECONDS', '300'))
+)
+atexit.register(analytics_store.close)
 
-# Initialize metrics tracker for Bedrock with LaunchDarkly client (for backward compatibility)
-metrics_tracker = BedrockMetricsTracker(ld_client=ld_manager.client)
+# Background writer used by the bulk ingestion endpoint; flushed on shutdown before the log is closed
+analytics_writer = AnalyticsWriter(
+    analytics_store,
+    max_pending=int(os.getenv('ANALYTICS_MAX_PENDING_EVENTS', '100000')),
+    batch_size=int(os.getenv('ANALYTICS_WRITE_BATCH_SIZE', '5000'))
+)
+atexit.register(analytics_writer.close)
 
-# In-memory analytics storage (replace with proper database in production)
-analytics_data = []
+# User storage indexed by ID and email; persisted in SQLite when DATABASE_URL is set
+user_repository = create_user_repository(os.getenv('DATABASE_URL'))
+
+# Delivers LaunchDarkly track and feedback calls off the request path; drained on shutdown
+event_dispatcher = EventDispatcher(
+    max_queue=int(os.getenv('EVENT_QUEUE_SIZE', '10000')),
+    batch_size=int(os.getenv('EVENT_BATCH_SIZE', '100'))
+)
+atexit.register(event_dispatcher.close)
+
+# AI Config trackers of recent chatbot responses by messageId, so feedback is sent
+# with the tracker (and variation) that produced the response
+tracker_registry = TTLCache(
+    maxsize=int(os.getenv('TRACKER_REGISTRY_SIZE', '10000')),
+    ttl=float(os.getenv('TRACKER_REGISTRY_TTL_SECONDS', '3600'))
+)
+
+def register_tracker(tracker):
+    """Issue a messageId for a chatbot response and remember its tracker."""
+    if tracker is None:
+        return None
+    message_id = uuid.uuid4().hex
+    tracker_registry.set(message_id, tracker)
+    return message_id
+
+# Server-side chatbot conversations, so clients can send only the new message each turn
+conversation_store = ConversationStore(
+    max_conversations=int(os.getenv('CONVERSATION_MAX_SESSIONS', '10000')),
+    ttl=float(os.getenv('CONVERSATION_TTL_SECONDS', '1800')),
+    max_bytes=int(float(os.getenv('CONVERSATION_MAX_MB', '64')) * 1024 * 1024),
+    max_messages=int(os.getenv('CONVERSATION_MAX_MESSAGES', '50'))
+)
+
+# How much chat history is sent to the model: an input-token budget filled from the
+# newest message back, with older turns dropped or folded into a short summary
+context_builder = ContextWindowBuilder(
+    input_token_budget=int(os.getenv('CHAT_INPUT_TOKEN_BUDGET', '4000')),
+    policy=os.getenv('CHAT_CONTEXT_POLICY', 'drop'),
+    summary_token_budget=int(os.getenv('CHAT_SUMMARY_TOKEN_BUDGET', '200'))
+)
+
+# Runs chatbot turns: context, config, prompt build, invoke (with retries and
+# per-model circuit breakers), parse and track
+chat_pipeline = ChatPipeline(
+    ld_client, bedrock_client, conversation_store, context_builder, metrics_tracker,
+    create_context=create_user_context
+)
 
-# In-memory user storage (replace with proper database in production)
-registered_users = {}
+# Serialized catalog responses per endpoint and variation; call invalidate() if the catalog data changes
+catalog_cache = CatalogResponseCache()
 
 @app.route('/api/providers', methods=['GET'])
 def get_providers():
@@ -213,14 +352,35 @@ def get_providers():
     
     # Get image variation from LaunchDarkly
     image_variation = ld_manager.get_image_variation(user_context)
-    print(f"Using image variation from LaunchDarkly: {image_variation}")
+    logger.debug("Using image variation from LaunchDarkly: %s", image_variation)
     
     # Return all providers with the image variation
-    return jsonify({
+    return catalog_cache.respond("providers", image_variation, lambda: {
         "providers": MOCK_PROVIDERS,
         "imageVariation": image_variation
     })
 
+@app.route('/api/bootstrap', methods=['GET'])
+def get_bootstrap():
+    # Get user context and optional provider/time period from query params
+    user_id = request.args.get('userId', 'default-user')
+    provider_id = request.args.get('providerId')
+    time_period = get_requested_time_period()
+    
+    # Create the context once and evaluate all client flags together
+    user_context = create_user_context(user_id, provider_id)
+    variations = ld_manager.get_client_variations(user_context)
+    
+    # Catalog and variations in one response, cached per combination of variations
+    key = (variations["imageVariation"], variations["variation"], variations["chatbotEnabled"], time_period)
+    return catalog_cache.respond("bootstrap", key, lambda: {
+        "providers": MOCK_PROVIDERS,
+        **build_services_response(variations["variation"]),
+        "schedule": MOCK_SCHEDULE.get(time_period, []),
+        "timePeriod": time_period,
+        **variations
+    })
+
 @app.route('/api/provider/<provider_id>', methods=['GET'])
 def get_provider(provider_id):
     # Find the provider by ID
@@ -240,8 +400,22 @@ def get_services(provider_id):
     
     # Always get variation from LaunchDarkly
     variation = ld_manager.get_sort_variation(user_context)
-    print(f"Using variation from LaunchDarkly: {variation}")
+    logger.debug("Using variation from LaunchDarkly: %s", variation)
     
+    # Track the page view event
+    event_dispatcher.dispatch(
+        ld_manager.track_page_view,
+        user_context,
+        {
+            "variation": variation,
+            "providerId": provider_id,
+            "event": "services_page_view"
+        }
+    )
+    
+    return catalog_cache.respond("services", variation, lambda: build_services_response(variation))
+
+def build_services_response(variation):
     # Get the sort order for this variation
     sort_order = SORT_VARIATIONS.get(variation, SORT_VARIATIONS["variation_1"])
     
@@ -250,33 +424,18 @@ def get_services(provider_id):
     for category in sort_order:
         sorted_services[category] = MOCK_SERVICES.get(category, [])
     
-    response = {
+    return {
         "services": sorted_services,
         "variation": variation
     }
-    
-    # Track the page view event
-    ld_manager.track_page_view(
-        user_context,
-        {
-            "variation": variation,
-            "providerId": provider_id,
-            "event": "services_page_view"
-        }
-    )
-    
-    return jsonify(response)
 
 @app.route('/api/schedule/<provider_id>', methods=['GET'])
 def get_schedule(provider_id):
     # Get time period from query params or use current time
-    time_period = request.args.get('timePeriod', get_current_time_period())
+    time_period = get_requested_time_period()
     
-    # Return schedule for the requested time period
-    if time_period in MOCK_SCHEDULE:
-        return jsonify(MOCK_SCHEDULE[time_period])
-    else:
-        return jsonify([])
+    # Return schedule for the requested time period, or none for an unknown period
+    return catalog_cache.respond("schedule", time_period, lambda: MOCK_SCHEDULE.get(time_period, []))
 
 @app.route('/api/service/select', methods=['POST'])
 def select_service():
@@ -290,7 +449,8 @@ def select_service():
     user_context = create_user_context(user_id, provider_id)
     
     # Track the service click event
-    ld_manager.track_service_click(
+    event_dispatcher.dispatch(
+        ld_manager.track_service_click,
         user_context,
         {
             "providerId": provider_id,
@@ -305,11 +465,9 @@ def select_service():
 @app.route('/api/user/register', methods=['POST'])
 def register_user():
     data = request.json
-    user_id = f"user{len(registered_users) + 5}"  # Generate a new user ID
     
-    # Store user data
-    registered_users[user_id] = {
-        "id": user_id,
+    # Store user data under a newly allocated user ID
+    user = user_repository.create({
         "name": data.get('name', ''),
         "email": data.get('email', ''),
         "segment": determine_user_segment(data),
@@ -318,11 +476,11 @@ def register_user():
             "preferred_times": data.get('preferredTimes', []),
             "notifications": data.get('notifications', True)
         }
-    }
+    })
     
     return jsonify({
         "status": "success",
-        "userId": user_id
+        "userId": user["id"]
     })
 
 def determine_user_segment(user_data):
@@ -344,51 +502,32 @@ def login_user():
     username = data.get('username', '')
     
     # Find user by username (in a real app, would check password too)
-    for user_id, user in MOCK_USERS.items():
-        if user['email'] == username:
-            return jsonify({
-                "status": "success",
-                "userId": user_id,
-                "user": user
-            })
-    
-    # If user not found in mock data, check registered users
-    for user_id, user in registered_users.items():
-        if user['email'] == username:
-            return jsonify({
-                "status": "success",
-                "userId": user_id,
-                "user": user
-            })
+    user = user_repository.get_by_email(username)
     
     # Return mock user if not found (for demo purposes)
+    if user is None:
+        user = user_repository.get("user2")
+    
     return jsonify({
         "status": "success",
-        "userId": "user2",
-        "user": MOCK_USERS["user2"]
+        "userId": user["id"],
+        "user": user
     })
 
 @app.route('/api/user/<user_id>', methods=['GET'])
 def get_user(user_id):
     # Return user data if exists
-    if user_id in MOCK_USERS:
-        return jsonify(MOCK_USERS[user_id])
-    elif user_id in registered_users:
-        return jsonify(registered_users[user_id])
+    user = user_repository.get(user_id)
+    if user:
+        return jsonify(user)
     else:
         return jsonify({"error": "User not found"}), 404
 
 @app.route('/api/user/<user_id>/recommendations', methods=['GET'])
 def get_recommendations(user_id):
-    # Get user segment
-    user_segment = None
-    if user_id in MOCK_USERS:
-        user_segment = MOCK_USERS[user_id]["segment"]
-    elif user_id in registered_users:
-        user_segment = registered_users[user_id]["segment"]
-    else:
-        # Default to new_to_wellness if user not found
-        user_segment = "new_to_wellness"
+    # Get user segment, defaulting to new_to_wellness if user not found
+    user = user_repository.get(user_id)
+    user_segment = user["segment"] if user else "new_to_wellness"
     
     # Get recommendations for the user segment
     if user_segment in MOCK_USER_SEGMENTS:
@@ -396,47 +535,96 @@ def get_recommendations(user_id):
     else:
         return jsonify({"error": "No recommendations available"}), 404
 
+def parse_time_param(value):
+    """Parse a query parameter given as Unix seconds or an ISO 8601 timestamp."""
+    if value is None:
+        return None
+    timestamp = parse_timestamp(value)
+    if timestamp is None:
+        raise ValueError(f"Not a valid time: {value}")
+    return timestamp
+
 @app.route('/api/analytics/track', methods=['POST'])
 def track_event():
     data = request.json
+    if not isinstance(data, dict):
+        return jsonify({"status": "error", "message": "Expected a JSON object"}), 400
     
-    # Add timestamp to the event data
-    event_data = {
-        **data,
-        "timestamp": datetime.utcnow().isoformat()
-    }
-    
-    # In production, you'd want to store this in a proper database
-    analytics_data.append(event_data)
+    # The store keeps the client's timestamp within the allowed clock skew, or uses the receive time
+    try:
+        analytics_store.append(data)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     
     return jsonify({"status": "success"})
 
+def parse_bulk_events():
+    """
+    Parse the body of a bulk analytics request.
+    
+    Accepts a JSON array of events, a JSON object with an "events" array, or
+    newline-delimited JSON (one event per line) sent as application/x-ndjson.
+    
+    Raises:
+        ValueError: If the body is not valid, an event is not a JSON object
+            or an event has a field too long to store
+    """
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'text/plain'):
+        body = request.get_data(as_text=True)
+        events = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        payload = request.get_json(silent=True)
+        events = payload.get('events') if isinstance(payload, dict) else payload
+    
+    if not isinstance(events, list):
+        raise ValueError("Expected a JSON array of events, an object with an 'events' array, or NDJSON")
+    if not all(isinstance(event, dict) for event in events):
+        raise ValueError("Every event must be a JSON object")
+    for index, event in enumerate(events):
+        try:
+            validate_event(event)
+        except ValueError as e:
+            raise ValueError(f"Event {index}: {e}")
+    return events
+
+@app.route('/api/analytics/track/bulk', methods=['POST'])
+def track_events_bulk():
+    try:
+        events = parse_bulk_events()
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    
+    # A batch that could never fit in the queue is not worth retrying as-is
+    if len(events) > analytics_writer.max_pending:
+        return jsonify({
+            "status": "error",
+            "message": f"Too many events in one request; send at most {analytics_writer.max_pending} at a time",
+            "maxEvents": analytics_writer.max_pending
+        }), 413
+    
+    # Events are queued for the background writer, which appends them in batches
+    if not analytics_writer.submit(events):
+        response = jsonify({
+            "status": "error",
+            "message": "Analytics queue is full. Please retry shortly."
+        })
+        response.status_code = 503
+        response.headers["Retry-After"] = "1"
+        return response
+    
+    return jsonify({"status": "accepted", "accepted": len(events)}), 202
+
 @app.route('/api/analytics/results', methods=['GET'])
 def get_analytics():
-    # Simple analytics aggregation
-    results = {
-        "variation_1": {"clicks": 0, "views": 0},
-        "variation_2": {"clicks": 0, "views": 0},
-        "variation_3": {"clicks": 0, "views": 0},
-        "variation_4": {"clicks": 0, "views": 0}
-    }
+    # Optional time window, e.g. ?since=2024-05-01T00:00:00&until=1714608000
+    try:
+        since = parse_time_param(request.args.get('since'))
+        until = parse_time_param(request.args.get('until'))
+    except ValueError:
+        return jsonify({"error": "since/until must be Unix seconds or ISO 8601 timestamps"}), 400
     
-    for event in analytics_data:
-        variation = event.get("variation")
-        event_type = event.get("type")
-        
-        if variation and variation in results:
-            if event_type == "view":
-                results[variation]["views"] += 1
-            elif event_type == "click":
-                results[variation]["clicks"] += 1
-    
-    # Calculate click-through rates
-    for variation in results:
-        views = results[variation]["views"]
-        clicks = results[variation]["clicks"]
-        ctr = (clicks / views * 100) if views > 0 else 0
-        results[variation]["ctr"] = round(ctr, 2)
+    # Counters are aggregated on ingest, so this does not scan the events
+    results = analytics_store.results(since=since, until=until)
     
     return jsonify(results)
 
@@ -494,7 +682,8 @@ def debug_ai_config():
 def get_chatbot_metrics():
     """
     Endpoint to retrieve metrics for the chatbot.
-    This includes metrics like latency, token usage, etc.
+    This includes metrics like latency, token usage, etc., plus latency and
+    time-to-first-token percentiles and histogram buckets per model and API type.
     """
     # Get all metrics
     all_metrics = metrics_tracker.get_metrics()
@@ -504,14 +693,32 @@ def get_chatbot_metrics():
     
     return jsonify({
         "summary": summary,
-        "metrics": all_metrics
+        "metrics": all_metrics,
+        "histograms": metrics_tracker.get_histograms(),
+        "engine": bedrock_client.engine.get_stats() if bedrock_client else None,
+        "response_cache": bedrock_client.response_cache.get_stats() if bedrock_client else None,
+        "single_flight": bedrock_client.single_flight.get_stats() if bedrock_client else None,
+        "connection_pool": get_pool_stats(),
+        "chat_pipeline": chat_pipeline.get_stats(),
+        "ai_config_cache": ld_client.get_cache_stats(),
+        "tracker_registry": tracker_registry.get_stats(),
+        "conversations": conversation_store.get_stats(),
+        "context_window": context_builder.get_stats(),
+        "event_dispatcher": event_dispatcher.get_stats()
     })
 
+def send_feedback_event(user_context, variables, is_positive):
+    """Get the AI Config tracker for the context and send feedback (runs on the event dispatcher)."""
+    config, tracker = ld_client.get_ai_config(user_context, variables)
+    ld_client.send_feedback(tracker, is_positive)
+
 @app.route('/api/chatbot/feedback', methods=['POST'])
 def submit_chatbot_feedback():
     """
     Endpoint for submitting feedback on chatbot responses.
     This allows users to rate responses as helpful or not helpful.
+    Pass the messageId returned with the response to attribute the
+    feedback to the AI Config variation that produced it.
     """
     try:
         data = request.json
@@ -519,6 +726,18 @@ def submit_chatbot_feedback():
         is_positive = data.get('isPositive', True)  # Default to positive if not specified
         message_id = data.get('messageId')  # Optional message ID for tracking specific messages
         
+        # Checked up front so an overlong userId is rejected before any feedback is sent
+        feedback_event = {
+            "type": "chatbot_feedback",
+            "userId": user_id,
+            "isPositive": is_positive,
+            "messageId": message_id
+        }
+        try:
+            validate_event(feedback_event)
+        except ValueError as e:
+            return jsonify({"status": "error", "message": str(e)}), 400
+        
         # Create user context for LaunchDarkly
         user_context = create_user_context(user_id)
         
@@ -531,34 +750,29 @@ def submit_chatbot_feedback():
             }
         }
         
-        # Get AI Config and tracker from LaunchDarkly
-        config, tracker = ld_client.get_ai_config(user_context, variables)
-        
-        # Send feedback using our LaunchDarklyClient
-        if tracker:
-            ld_client.send_feedback(tracker, is_positive)
-            
-            # Store feedback in analytics data for reporting
-            analytics_data.append({
-                "type": "chatbot_feedback",
-                "userId": user_id,
-                "isPositive": is_positive,
-                "messageId": message_id,
-                "timestamp": datetime.utcnow().isoformat()
-            })
-            
-            return jsonify({
-                "status": "success",
-                "message": f"Feedback {'positive' if is_positive else 'negative'} recorded successfully"
-            })
+        # Send feedback to LaunchDarkly in the background, with the tracker of the
+        # response if we issued its messageId, otherwise with a freshly evaluated one
+        tracker = tracker_registry.get(message_id) if message_id else None
+        if tracker is not None:
+            queued = event_dispatcher.dispatch(ld_client.send_feedback, tracker, is_positive)
         else:
+            queued = event_dispatcher.dispatch(send_feedback_event, user_context, variables, is_positive)
+        if not queued:
             return jsonify({
                 "status": "error",
-                "message": "Could not send feedback: tracker is None"
-            }), 400
+                "message": "Could not send feedback: event queue is full"
+            }), 503
+        
+        # Store feedback in analytics data for reporting
+        analytics_store.append(feedback_event)
+        
+        return jsonify({
+            "status": "success",
+            "message": f"Feedback {'positive' if is_positive else 'negative'} recorded successfully"
+        })
             
     except Exception as e:
-        print(f"Error submitting feedback: {str(e)}")
+        logger.error("Error submitting feedback: %s", e)
         return jsonify({
             "status": "error",
             "message": f"Error submitting feedback: {str(e)}"
@@ -567,443 +781,149 @@ def submit_chatbot_feedback():
 @app.route('/api/chatbot/message', methods=['POST'])
 def chatbot_message():
     """
-    Endpoint for the chatbot that uses LaunchDarkly flag with enhanced logging
+    Endpoint for the chatbot, running each turn through the chat pipeline
+    (see chat_pipeline for its stages, retries and circuit breakers)
+    
+    Every response, including errors, carries the conversationId to send
+    with the next message.
     """
+    conversation_id = None
     try:
         data = request.json
-        user_id = data.get('userId', 'default-user')
-        messages = data.get('messages', [])
-        
-        print(f"Chatbot request received for user: {user_id}")
-        print(f"Messages received: {json.dumps(messages, default=str)}")
+        conversation_id = data.get('conversationId')
+        turn = ChatTurn(
+            data.get('userId', 'default-user'),
+            data.get('messages', []),
+            message=data.get('message'),
+            conversation_id=data.get('conversationId')
+        )
+        stream_response = wants_event_stream(data)
         
-        # Create user context for LaunchDarkly
-        user_context = create_user_context(user_id)
-        print(f"Created user context: {user_context.key}, anonymous: {user_context.anonymous}")
+        logger.info("Chatbot request received for user: %s (streaming: %s)", turn.user_id, stream_response)
+        logger.debug("Messages received: %s", LazyJson(turn.messages))
         
-        # Check if the chatbot is enabled via LaunchDarkly
-        # Use the new client for consistency
-        chatbot_enabled = ld_client.ld_client.variation('guru-guide-ai-enabled', user_context, True)
-        print(f"Chatbot enabled: {chatbot_enabled}")
+        chat_pipeline.context(turn)
+        if turn.conversation is not None:
+            conversation_id = turn.conversation.id
         
         # If the chatbot is disabled, return an error
-        if not chatbot_enabled:
-            print("Chatbot is disabled. Returning error.")
+        if not turn.enabled:
+            logger.info("Chatbot is disabled. Returning error.")
             return jsonify({
                 "status": "error",
-                "message": "Chatbot is currently disabled."
+                "message": "Chatbot is currently disabled.",
+                "conversationId": conversation_id
             }), 400
         
-        # Extract the user message
-        user_message = "No user message found"
-        for msg in messages:
-            if msg.get("role") == "user":
-                user_message = msg.get("content")
-                break
+        # If AWS Bedrock is not configured, use a mock response
+        if not (BOTO3_AVAILABLE and chat_pipeline.bedrock_client):
+            mock_message = f"This is a mock response to: '{turn.user_message}'. AWS Bedrock integration will be implemented when credentials are available."
+            chat_pipeline.remember_reply(turn, mock_message)
+            if stream_response:
+                return event_stream_response(single_message_events(mock_message, conversation_id))
+            return jsonify({
+                "status": "success",
+                "message": mock_message,
+                "conversationId": conversation_id
+            })
         
-        print(f"Extracted user message: {user_message}")
+        # Get the AI Config, build the prompt and start the stream; errors starting
+        # the stream surface here, before committing to a response
+        try:
+            chat_pipeline.prepare(turn)
+        except EngineSaturatedError as e:
+            # Shed load instead of queueing more work behind a saturated model
+            logger.warning("Rejecting chatbot request: %s (retry after %ss)", e, e.retry_after)
+            response = jsonify({
+                "status": "error",
+                "message": "The assistant is busy right now. Please try again shortly.",
+                "conversationId": conversation_id
+            })
+            response.status_code = 429
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+        except CircuitOpenError as e:
+            # The model keeps failing; fail fast instead of waiting on it
+            logger.warning("Rejecting chatbot request: %s (retry after %ss)", e, e.retry_after)
+            response = jsonify({
+                "status": "error",
+                "message": "The assistant is unavailable right now. Please try again shortly.",
+                "conversationId": conversation_id
+            })
+            response.status_code = 503
+            response.headers["Retry-After"] = str(e.retry_after)
+            return response
+        except Exception as e:
+            logger.error("Error starting the model stream after %s attempt(s): %s", turn.attempts, e, exc_info=True)
+            return jsonify({
+                "status": "error",
+                "message": describe_error(e),
+                "conversationId": conversation_id
+            }), 500
         
-        # If AWS Bedrock is configured, use it with our new client classes
-        if BOTO3_AVAILABLE and bedrock_client:
-            try:
-                # Create variables for LaunchDarkly AI Config
-                variables = {
-                    "user_input": user_message,
-                    "conversation_history": messages
-                }
-                
-                print(f"Getting AI config from LaunchDarkly with variables: {json.dumps(variables, default=str)}")
-                
-                # Get AI Config from LaunchDarkly using our new client
-                config, tracker = ld_client.get_ai_config(user_context, variables)
-                
-                print(f"AI Config received. Enabled: {config.enabled}")
-                print(f"Model: {config.model.name}")
-                
-                # Log all messages in the config for verification
-                if config.messages:
-                    print(f"Number of messages in config: {len(config.messages)}")
-                    for i, msg in enumerate(config.messages):
-                        print(f"Message {i+1}: Role={msg.role}, Content={msg.content[:100]}...")
-                else:
-                    print("No messages in config")
-                
-                # Extract model configuration
-                model_id = config.model.name
-                print(f"Using model ID: {model_id}")
+        message_id = register_tracker(turn.tracker)
+        
+        # Forward each chunk to the browser as soon as Bedrock yields it
+        if stream_response:
+            def generate():
+                for chunk in chat_pipeline.parse(turn):
+                    yield format_sse({"text": chunk}, event="chunk")
+                chat_pipeline.track(turn)
                 
-                # Extract parameters from model config
-                params = config.model._parameters
-                inference_config = {
-                    "temperature": params.get("temperature", 0.7),
-                    "maxTokens": params.get("max_tokens", 1000),
-                    "topP": params.get("top_p", 0.9)
+                # Final event carries usage and time-to-first-token metrics
+                done = {
+                    "status": "error" if turn.error else "success",
+                    "messageId": message_id,
+                    "conversationId": conversation_id,
+                    "length": len(turn.reply),
+                    "usage": turn.metrics.get("usage"),
+                    "metrics": turn.metrics.get("metrics", {}),
+                    "cached": turn.metrics.get("cache") == "hit"
                 }
-                
-                print(f"Inference config: {json.dumps(inference_config, default=str)}")
-                
-                # Extract system prompt from messages
-                system_prompts = []
-                if config.messages and len(config.messages) > 0:
-                    for msg in config.messages:
-                        if msg.role == "system":
-                            system_prompts.append({"text": msg.content})
-                            print(f"Found system prompt: {msg.content[:100]}...")
-                
-                # If no system prompt found, use a default
-                if not system_prompts:
-                    default_prompt = "You are a wellness assistant for a health and wellness platform. Provide helpful, friendly advice about wellness services, fitness, meditation, and healthy living. Keep responses concise and positive."
-                    system_prompts = [{"text": default_prompt}]
-                    print(f"No system prompt found. Using default: {default_prompt}")
-                
-                # Format messages based on model type
-                if "amazon" in model_id.lower():
-                    # Use Bedrock format for Amazon models
-                    bedrock_messages = create_bedrock_message(messages, user_message)
-                    print(f"Using Amazon format for messages. Count: {len(bedrock_messages)}")
-                else:
-                    # Use Claude format for Claude models
-                    bedrock_messages = create_claude_message(messages, user_message)
-                    print(f"Using Claude format for messages. Count: {len(bedrock_messages)}")
-                
-                # Stream the conversation using our new client
-                print(f"Streaming conversation with model: {model_id}")
-                stream = bedrock_client.stream_conversation(
-                    model_id=model_id,
-                    messages=bedrock_messages,
-                    system_prompts=system_prompts,
-                    inference_config=inference_config
-                )
-                
-                # Parse the stream and get the full response
-                print("Parsing response stream...")
-                full_response = ""
-                for chunk in bedrock_client.parse_stream(stream, tracker):
-                    full_response += chunk
-                
-                print(f"Full response received. Length: {len(full_response)}")
-                print(f"Response preview: {full_response[:200]}...")
-                
-                return jsonify({
-                    "status": "success",
-                    "message": full_response
-                })
-                
-            except Exception as e:
-                error_str = str(e)
-                print(f"Error using Bedrock client: {error_str}")
-                print(f"Traceback: {traceback.format_exc()}")
-                print(f"Falling back to original implementation...")
-                
-                # Fall back to the original implementation
-                # Get AI Config from LaunchDarkly
-                ai_config = ld_manager.get_ai_config(user_context)
-                print(f"Using AI Config from LaunchDarkly: {ai_config}")
-                
-                # Format messages for Claude
-                claude_messages = []
-                
-                # Get persona message from AI Config or use default
-                persona_message = "You are a wellness assistant for a health and wellness platform. Provide helpful, friendly advice about wellness services, fitness, meditation, and healthy living. Keep responses concise and positive."
-                
-                if ai_config and ai_config.get('messages'):
-                    # Find persona message in AI Config - could be in 'system' or 'user' role
-                    print(f"Looking for persona message in AI Config messages: {ai_config.get('messages')}")
-                    for msg in ai_config.get('messages', []):
-                        # Check for both 'system' and 'user' roles since the config might use either
-                        if msg.get('role') in ['system', 'user']:
-                            persona_message = msg.get('content', persona_message)
-                            print(f"Found persona message with role '{msg.get('role')}': {persona_message[:100]}...")
-                            break
-                
-                # Add user messages
-                for msg in messages:
-                    if msg.get("role") != "system":
-                        claude_messages.append({
-                            "role": msg.get("role", "user"),
-                            "content": msg.get("content", "")
-                        })
-                
-                # Get model settings from AI Config or use defaults
-                model_id = "anthropic.claude-3-sonnet-20240229-v1:0"  # Default model ID
-                print(f"Persona message to use: {persona_message[:100]}...")
-                max_tokens = 1000
-                temperature = 0.7
-                
-                if ai_config:
-                    # Override with values from AI Config if available
-                    if ai_config.get('model') and ai_config['model'].get('name'):
-                        model_id = ai_config['model']['name']
-                    elif ai_config.get('modelId'):
-                        model_id = ai_config.get('modelId')
-                        
-                    # Get parameters from AI Config
-                    if ai_config.get('model') and ai_config['model'].get('parameters'):
-                        params = ai_config['model']['parameters']
-                        if 'max_tokens' in params:
-                            try:
-                                max_tokens = int(params['max_tokens'])
-                            except (ValueError, TypeError):
-                                print(f"Warning: Invalid max_tokens value: {params['max_tokens']}. Using default: {max_tokens}")
-                        if 'temperature' in params:
-                            try:
-                                temperature = float(params['temperature'])
-                            except (ValueError, TypeError):
-                                print(f"Warning: Invalid temperature value: {params['temperature']}. Using default: {temperature}")
-
-                    else:
-                        # Legacy format
-                        max_tokens = ai_config.get('maxTokens', max_tokens)
-                        temperature = ai_config.get('temperature', temperature)
-                
-                print(f"Using model ID from LaunchDarkly: {model_id}")
-                
-                # Create the request body based on the model type
-                if "amazon" in model_id.lower():
-                    # Amazon Nova Pro format for Converse API
-                    # Convert messages to the format expected by Amazon Nova Pro Converse API
-                    nova_messages = []
-                    
-                    # For Amazon Nova Pro, we need to handle the system message differently
-                    # since it doesn't support the "system" role
-                    
-                    # Debug: Log the messages we're working with
-                    print(f"Original messages for Amazon model: {claude_messages}")
-                    print(f"Persona message: {persona_message}")
-                    
-                    # Create a new array for Amazon model messages
-                    nova_messages = []
-                    
-                    # First, check if we have a persona message
-                    if persona_message:
-                        # Create a first user message that includes the persona instructions
-                        # Format it in a way that clearly instructs the model to adopt the persona
-                        persona_instruction = f"You must act as the following persona in all your responses: {persona_message}"
-                        
-                        # Add this as the first message
-                        nova_messages.append({
-                            "role": "user",
-                            "content": [
-                                {
-                                    "text": persona_instruction
-                                }
-                            ]
-                        })
-                        
-                        # Add a confirmation message from the assistant to establish the persona
-                        nova_messages.append({
-                            "role": "assistant",
-                            "content": [
-                                {
-                                    "text": "I understand. I'll respond as the persona you described."
-                                }
-                            ]
-                        })
-                    
-                    # Now add all the actual conversation messages
-                    for msg in claude_messages:
-                        # Only include user and assistant roles, as these are the only ones supported
-                        if msg["role"] in ["user", "assistant"]:
-                            nova_messages.append({
-                                "role": msg["role"],
-                                "content": [
-                                    {
-                                        "text": msg["content"]
-                                    }
-                                ]
-                            })
-                    
-                    # Debug: Log the final messages we're sending
-                    print(f"Final Amazon model messages: {nova_messages}")
-                    
-                    print(f"Sending messages to Amazon Nova Pro: {json.dumps(nova_messages, indent=2)}")
-                    
-                    # For Converse API
-                    request_body = {
-                        "modelId": model_id,
-                        "inferenceConfig": {
-                            "maxTokens": int(max_tokens),
-                            "temperature": float(temperature),
-                            "topP": 0.9
-                        },
-                        "messages": nova_messages
-                    }
-                else:
-                    # Claude format
-                    request_body = {
-                        "anthropic_version": "bedrock-2023-05-31",
-                        "max_tokens": max_tokens,
-                        "temperature": temperature,
-                        "messages": claude_messages,
-                        "system": persona_message
-                    }
-                
-                try:
-                    # Create a default AIConfig
-                    default_value = AIConfig(
-                        enabled=True,
-                        model=ModelConfig(name=model_id),
-                        messages=[],
-                    )
-                    
-                    # Get the config and tracker from LaunchDarkly
-                    config_value, tracker = ldai_client.config(
-                        "guru-guide-ai",  # This should match the flag key used in get_ai_config
-                        user_context,
-                        default_value
-                    )
-                    
-                    # Use the appropriate API call based on the model type
-                    if "amazon" in model_id.lower():
-                        # Use converse API for Amazon Nova Pro
-                        # Make the API call
-                        response = bedrock_runtime.converse(
-                            modelId=model_id,
-                            messages=request_body["messages"],
-                            inferenceConfig=request_body["inferenceConfig"]
-                        )
-                        
-                        # Track metrics using the tracker from LaunchDarkly
-                        response_body = tracker.track_bedrock_converse_metrics(response)
-                        
-                        # Also track metrics using our local metrics tracker for backward compatibility
-                        metrics_tracker.track_bedrock_converse_metrics(
-                            model_id=model_id,
-                            request_body=request_body,
-                            response=response,
-                            user_context=user_context
-                        )
-                    else:
-                        # Use invoke_model for Claude and other models
-                        # Make the API call
-                        response = bedrock_runtime.invoke_model(
-                            modelId=model_id,
-                            body=json.dumps(request_body)
-                        )
-                        
-                        # Track metrics using the tracker from LaunchDarkly
-                        response_body = tracker.track_bedrock_invoke_metrics(response)
-                        
-                        # Also track metrics using our local metrics tracker for backward compatibility
-                        metrics_tracker.track_bedrock_invoke_metrics(
-                            model_id=model_id,
-                            request_body=request_body,
-                            response=response,
-                            user_context=user_context
-                        )
-                    
-                    print(f"Raw response from model: {response_body}")
-                    
-                    if "amazon" in model_id.lower():
-                        # Amazon Nova Pro response format
-                        if 'output' in response_body and 'message' in response_body['output'] and 'content' in response_body['output']['message']:
-                            # New format with nested content
-                            response_content = response_body['output']['message']['content'][0]['text']
-                            print(f"Successfully parsed response from Amazon Nova Pro: {response_content[:100]}...")
-                        elif 'output' in response_body:
-                            # Alternative format
-                            response_content = response_body.get('output', {}).get('text', '')
-                        elif 'results' in response_body:
-                            # Previous format attempt
-                            response_content = response_body.get('results', [{}])[0].get('outputText', '')
-                        else:
-                            # Fallback to mock response if we can't parse the response
-                            print(f"Unable to parse response from Amazon Nova Pro: {response_body}")
-                            response_content = f"""
-As a wellness assistant, I'd be happy to suggest some yoga poses for beginners!
-
-Here are some great poses to start with:
-
-1. Mountain Pose (Tadasana) - Helps with posture and balance
-2. Child's Pose (Balasana) - A restful pose that gently stretches the back
-3. Downward-Facing Dog (Adho Mukha Svanasana) - Stretches the entire body
-4. Cat-Cow Stretch (Marjaryasana-Bitilasana) - Great for spine flexibility
-5. Warrior I (Virabhadrasana I) - Builds strength and focus
-
-Remember to breathe deeply and move slowly. It's not about how far you can stretch, but about being mindful of your body's limits.
-
-(Note: This is a mock response because we couldn't parse the model response.)
-"""
-                    else:
-                        # Claude format
-                        response_content = response_body['content'][0]['text']
-                    
-                    return jsonify({
-                        "status": "success",
-                        "message": response_content
-                    })
-                except Exception as e:
-                    error_str = str(e)
-                    # Handle various AWS Bedrock errors gracefully
-                    if "AccessDeniedException" in error_str or "ValidationException" in error_str:
-                        print(f"AWS Bedrock error: {error_str}")
-                        print(f"Model ID: {model_id}")
-                        print(f"AWS Region: {aws_region}")
-                        print(f"AWS Access Key ID: {aws_access_key[:5]}...{aws_access_key[-4:] if aws_access_key else ''}")
-                        print("Request body:", json.dumps(request_body, indent=2))
-                        print("Falling back to mock response.")
-                        
-                        error_message = ""
-                        if "AccessDeniedException" in error_str:
-                            error_message = f"You don't have access to this model (ID: {model_id}). Please complete Step 2 in AWS_BEDROCK_SETUP.md to request access."
-                        elif "inference profile" in error_str:
-                            error_message = "This model requires an inference profile. Please create an inference profile in the AWS Bedrock console."
-                        else:
-                            error_message = "There was an issue with the AWS Bedrock configuration."
-                        
-                        # Create a friendly mock response based on the user's question
-                        mock_response = f"""
-As a wellness assistant, I'd be happy to suggest some yoga poses for beginners!
-
-Here are some great poses to start with:
-
-1. Mountain Pose (Tadasana) - Helps with posture and balance
-2. Child's Pose (Balasana) - A restful pose that gently stretches the back
-3. Downward-Facing Dog (Adho Mukha Svanasana) - Stretches the entire body
-4. Cat-Cow Stretch (Marjaryasana-Bitilasana) - Great for spine flexibility
-5. Warrior I (Virabhadrasana I) - Builds strength and focus
-
-Remember to breathe deeply and move slowly. It's not about how far you can stretch, but about being mindful of your body's limits.
-
-(Note: This is a mock response. {error_message})
-"""
-                        
-                        return jsonify({
-                            "status": "success",
-                            "message": mock_response
-                        })
-                    else:
-                        # For other errors, return an error
-                        print(f"Error: {error_str}")
-                        return jsonify({
-                            "status": "error",
-                            "message": f"Error generating response: {error_str}"
-                        }), 500
-            except Exception as e:
-                # For non-AWS errors, return an error
-                print(f"General error: {str(e)}")
-                return jsonify({
-                    "status": "error",
-                    "message": f"Error generating response: {str(e)}"
-                }), 500
+                if turn.error:
+                    done["message"] = f"Error generating response: {turn.error}"
+                yield format_sse(done, event="done")
+            
+            logger.debug("Streaming response to client as Server-Sent Events")
+            response = event_stream_response(generate())
+            # Runs even if the client disconnects before the stream starts
+            response.call_on_close(lambda: chat_pipeline.release(turn))
+            return response
+        
+        for _ in chat_pipeline.parse(turn):
+            pass
+        chat_pipeline.track(turn)
+        if turn.error:
+            # The stream broke after it started; don't pass the partial reply off as an answer
+            return jsonify({
+                "status": "error",
+                "message": f"Error generating response: {turn.error}",
+                "conversationId": conversation_id
+            }), 500
+        logger.debug("Response preview: %s...", turn.reply[:200])
         
-        # If AWS Bedrock is not configured, use a mock response
         return jsonify({
             "status": "success",
-            "message": f"This is a mock response to: '{user_message}'. AWS Bedrock integration will be implemented when credentials are available."
+            "message": turn.reply,
+            "messageId": message_id,
+            "conversationId": conversation_id
         })
             
     except Exception as e:
-        print(f"Error in chatbot endpoint: {str(e)}")
+        logger.error("Error in chatbot endpoint: %s", e, exc_info=True)
         return jsonify({
             "status": "error",
-            "message": f"Server error: {str(e)}"
+            "message": f"Server error: {str(e)}",
+            "conversationId": conversation_id
         }), 500
 
 if __name__ == '__main__':
     try:
         app.run(debug=True, port=5003)
     finally:
-        # Ensure LaunchDarkly clients are closed properly
+        # Deliver queued events, then ensure LaunchDarkly clients are closed properly
+        event_dispatcher.close()
         ld_manager.close()
         ld_client.close()
+        if bedrock_client:
+            bedrock_client.engine.shutdown(wait=False)
@@ -0,0 +1,208 @@
+"""
+Shared AWS Clients
+
+This module creates the bedrock-runtime clients BedrockClient uses, one
+per region and access key, so every user of the same account shares one
+connection pool instead of each opening their own. The client is tuned for streaming on
+the execution engine: its pool is sized for the number of concurrent
+streams, connect and read timeouts are explicit, retries use botocore's
+adaptive mode (which also rate-limits the client when Bedrock throttles),
+and TCP keepalive stops idle pooled connections from being dropped
+silently. Pool utilization is sampled on every request so the pool size
+can be checked against real concurrency.
+
+With BEDROCK_TRANSPORT=fake, BedrockClient talks to a local
+FakeBedrockRuntime (see fake_bedrock) instead, so the chat path can be
+load-tested without AWS credentials.
+
+Environment variables:
+    BEDROCK_TRANSPORT: "aws" for Bedrock, "fake" for the local stand-in (default "aws")
+    BEDROCK_MAX_POOL_CONNECTIONS: Connections kept per endpoint (default 64, the engine's worker count)
+    BEDROCK_CONNECT_TIMEOUT_SECONDS: Timeout for opening a connection (default 5)
+    BEDROCK_READ_TIMEOUT_SECONDS: Timeout between reads, including stream chunks (default 60)
+    BEDROCK_MAX_ATTEMPTS: Attempts per call, including the first (default 3)
+    BEDROCK_TCP_KEEPALIVE: "false" to turn TCP keepalive off (default "true")
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import boto3
+from botocore.config import Config
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def bedrock_config_from_env() -> Config:
+    """Build the botocore config for bedrock-runtime from the environment."""
+    return Config(
+        max_pool_connections=int(os.getenv("BEDROCK_MAX_POOL_CONNECTIONS", "64")),
+        connect_timeout=float(os.getenv("BEDROCK_CONNECT_TIMEOUT_SECONDS", "5")),
+        read_timeout=float(os.getenv("BEDROCK_READ_TIMEOUT_SECONDS", "60")),
+        retries={
+            "mode": "adaptive",
+            "total_max_attempts": int(os.getenv("BEDROCK_MAX_ATTEMPTS", "3"))
+        },
+        tcp_keepalive=os.getenv("BEDROCK_TCP_KEEPALIVE", "true").lower() == "true"
+    )
+
+
+class PoolMonitor:
+    """
+    Samples a client's connection pool usage before every request it sends.
+
+    botocore does not expose its urllib3 pools, so they are found through
+    private attributes of the client. If a botocore or urllib3 release
+    changes those, the monitor falls back to counting requests only and
+    reports the connection counts as None.
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self.max_pool_connections = client.meta.config.max_pool_connections
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.peak_in_use = 0
+        self.available = self._usage() is not None
+        if not self.available:
+            logger.warning("Connection pool stats are unavailable with this botocore version; "
+                           "counting requests only")
+        client.meta.events.register("before-send.bedrock-runtime", self._before_send)
+
+    def _pools(self) -> Optional[List[Any]]:
+        # Private botocore and urllib3 internals; None if they are not where we expect them
+        try:
+            manager = self.client._endpoint.http_session._manager
+            pools = []
+            for key in manager.pools.keys():
+                try:
+                    pools.append(manager.pools[key])
+                except KeyError:
+                    # Evicted since keys() was read
+                    continue
+            return pools
+        except Exception:
+            return None
+
+    def _usage(self) -> Optional[Tuple[int, int]]:
+        pools = self._pools()
+        if pools is None:
+            return None
+        in_use = idle = 0
+        try:
+            for pool in pools:
+                # The queue starts with maxsize empty slots; connections are taken from it while in use
+                queue = pool.pool
+                in_use += queue.maxsize - queue.qsize()
+                idle += sum(1 for conn in list(queue.queue) if conn is not None)
+        except Exception:
+            return None
+        return in_use, idle
+
+    def _before_send(self, **kwargs) -> None:
+        usage = self._usage() if self.available else None
+        with self._lock:
+            self.requests += 1
+            if usage is not None:
+                # Count the connection this request is about to take
+                self.peak_in_use = max(self.peak_in_use, usage[0] + 1)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get pool size, current and peak connections in use, and per-host counters."""
+        usage = self._usage() if self.available else None
+        pools = self._pools() if usage is not None else None
+        with self._lock:
+            stats = {"max_pool_connections": self.max_pool_connections, "requests": self.requests}
+            peak_in_use = self.peak_in_use
+        if usage is None or pools is None:
+            unavailable = ("in_use", "idle", "peak_in_use", "utilization", "connections_opened", "hosts")
+            stats.update(dict.fromkeys(unavailable))
+            return stats
+        in_use, idle = usage
+        stats.update({
+            "in_use": in_use,
+            "idle": idle,
+            "peak_in_use": peak_in_use,
+            "utilization": round(in_use / self.max_pool_connections * 100, 2) if self.max_pool_connections else 0,
+            "connections_opened": sum(getattr(pool, "num_connections", 0) for pool in pools),
+            "hosts": len(pools)
+        })
+        return stats
+
+
+_clients: Dict[Tuple[Optional[str], Optional[str]], Tuple[Any, PoolMonitor]] = {}
+_fake_runtime = None
+_lock = threading.Lock()
+
+
+def bedrock_transport_from_env() -> str:
+    """Return the configured Bedrock transport, "aws" or "fake"."""
+    transport = os.getenv("BEDROCK_TRANSPORT", "aws").lower()
+    if transport not in ("aws", "fake"):
+        raise ValueError(f"Unknown BEDROCK_TRANSPORT {transport!r}, expected 'aws' or 'fake'")
+    return transport
+
+
+def get_bedrock_runtime(region_name: Optional[str] = None, access_key_id: Optional[str] = None,
+                        secret_access_key: Optional[str] = None):
+    """
+    Return the shared bedrock-runtime client for a region and credentials.
+
+    The client is created on first use with bedrock_config_from_env() and
+    reused by every later caller with the same region and access key. With
+    BEDROCK_TRANSPORT=fake every caller gets the same FakeBedrockRuntime.
+
+    Args:
+        region_name: AWS region name
+        access_key_id: AWS access key ID, or None for the default credential chain
+        secret_access_key: AWS secret access key
+
+    Returns:
+        The boto3 bedrock-runtime client, or the FakeBedrockRuntime
+    """
+    global _fake_runtime
+    if bedrock_transport_from_env() == "fake":
+        from fake_bedrock import FakeBedrockRuntime
+        with _lock:
+            if _fake_runtime is None:
+                _fake_runtime = FakeBedrockRuntime.from_env()
+                logger.info(
+                    "Using the local fake Bedrock runtime: TTFT %sms, %s tokens/s, error rate %s",
+                    _fake_runtime.ttft_ms, _fake_runtime.tokens_per_second, _fake_runtime.error_rate
+                )
+            return _fake_runtime
+
+    key = (region_name, access_key_id)
+    with _lock:
+        entry = _clients.get(key)
+        if entry is None:
+            config = bedrock_config_from_env()
+            client = boto3.client(
+                service_name="bedrock-runtime",
+                region_name=region_name,
+                aws_access_key_id=access_key_id,
+                aws_secret_access_key=secret_access_key,
+                config=config
+            )
+            entry = (client, PoolMonitor(client))
+            _clients[key] = entry
+            logger.info(
+                "Created bedrock-runtime client for %s: %s pooled connections, timeouts %ss/%ss, retries %s",
+                region_name, config.max_pool_connections, config.connect_timeout, config.read_timeout,
+                config.retries
+            )
+        return entry[0]
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Get connection pool stats for every shared client, by region, and the fake runtime's stats."""
+    with _lock:
+        monitors = [(region_name, monitor) for (region_name, _), (_, monitor) in _clients.items()]
+        fake_runtime = _fake_runtime
+    stats = {str(region_name): monitor.get_stats() for region_name, monitor in monitors}
+    if fake_runtime is not None:
+        stats["fake"] = fake_runtime.get_stats()
+    return stats
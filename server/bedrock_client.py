@@ -10,18 +10,25 @@ import os
 import json
 import logging
 import time
-import traceback
-import boto3
 from botocore.exceptions import ClientError
 from typing import Dict, List, Any, Generator, Tuple, Optional, Union
 
+from aws_clients import get_bedrock_runtime
+from bedrock_engine import BedrockExecutionEngine, EngineStream
+from response_cache import ReplayStream, ResponseCache, request_key
+from single_flight import FlightStream, SingleFlight, close_with
+from log_config import LazyJson, sample_chunk
+from context_window import ContextWindowBuilder
+
 # Set up logging
 logger = logging.getLogger(__name__)
 
 class BedrockClient:
     """Client for AWS Bedrock service with generative AI capabilities."""
     
-    def __init__(self, region_name: str = None, access_key_id: str = None, secret_access_key: str = None):
+    def __init__(self, region_name: str = None, access_key_id: str = None, secret_access_key: str = None,
+                 engine: BedrockExecutionEngine = None, response_cache: ResponseCache = None,
+                 single_flight: SingleFlight = None, transport=None):
         """
         Initialize the Bedrock client.
         
@@ -29,20 +36,126 @@ class BedrockClient:
             region_name: AWS region name, defaults to environment variable
             access_key_id: AWS access key ID, defaults to environment variable
             secret_access_key: AWS secret access key, defaults to environment variable
+            engine: Execution engine that runs streams, defaults to one configured from the environment
+            response_cache: Cache of complete answers, defaults to one configured from the environment
+            single_flight: Coalescing layer for identical concurrent requests, defaults to one
+                configured from the environment
+            transport: Object with the bedrock-runtime converse_stream and
+                invoke_model_with_response_stream methods, defaults to the shared client for
+                BEDROCK_TRANSPORT (boto3, or the local FakeBedrockRuntime)
         """
         self.region_name = region_name or os.getenv("AWS_REGION")
         self.access_key_id = access_key_id or os.getenv("AWS_ACCESS_KEY_ID")
         self.secret_access_key = secret_access_key or os.getenv("AWS_SECRET_ACCESS_KEY")
         
-        # Add timeouts to prevent hanging requests
-        self.client = boto3.client(
-            service_name='bedrock-runtime', 
-            region_name=self.region_name,
-            aws_access_key_id=self.access_key_id,
-            aws_secret_access_key=self.secret_access_key
-        )
+        # Shared client with a pool sized for the engine, explicit timeouts and adaptive retries
+        self.client = transport or get_bedrock_runtime(self.region_name, self.access_key_id, self.secret_access_key)
+        
+        # Streams run on a bounded thread pool instead of the request thread
+        self.engine = engine or BedrockExecutionEngine.from_env()
+        
+        # Repeated questions are answered from recorded streams instead of the model
+        self.response_cache = response_cache or ResponseCache.from_env()
         
-        logger.info(f"Initialized Bedrock client for region {self.region_name}")
+        # Identical requests that arrive while one is streaming share its stream
+        self.single_flight = single_flight or SingleFlight.from_env()
+        
+        logger.info("Initialized Bedrock client for region %s", self.region_name)
+    
+    def submit_conversation(self,
+                    model_id: str,
+                    messages: List[Dict[str, Any]],
+                    system_prompts: List[Dict[str, str]],
+                    inference_config: Dict[str, Any],
+                    tracker=None,
+                    metrics: Optional[Dict[str, Any]] = None,
+                    additional_model_fields: Dict[str, Any] = None,
+                    use_cache: bool = True) -> Union[EngineStream, ReplayStream]:
+        """
+        Stream a conversation on the execution engine.
+        
+        Runs stream_conversation and parse_stream on an engine worker, subject
+        to the model's concurrency limit and wait queue. If the response cache
+        has an answer for the request, it is replayed instead without calling
+        the model; metrics["cache"] is then "hit" (or "miss" when the cache
+        was consulted but had no answer), and the tracker is not sent token
+        usage for the replayed answer. Likewise, a request identical to one
+        that is already streaming attaches to that stream (see single_flight)
+        and gets metrics["coalesced"] set; its tracker gets the same metrics
+        as a cache hit, since only the leader's tokens were paid for.
+        
+        Args:
+            model_id: The model ID to use
+            messages: The messages to send
+            system_prompts: The system prompts to send
+            inference_config: The inference configuration to use
+            tracker: LaunchDarkly tracker for metrics
+            metrics: Optional dict that receives usage and timing metrics
+            additional_model_fields: Additional model fields to use
+            use_cache: Whether the response cache may answer or record this request
+            
+        Returns:
+            EngineStream (or ReplayStream for cached and coalesced answers) yielding message chunks
+            
+        Raises:
+            EngineSaturatedError: If the model has no free slot and its queue is full
+        """
+        request_params = self._convert_numeric_params(inference_config)
+        
+        cache_key = None
+        if use_cache and self.response_cache.enabled:
+            cache_key = self.response_cache.make_key(
+                model_id, system_prompts, messages, request_params, additional_model_fields
+            )
+            cached = self.response_cache.get(cache_key)
+            if metrics is not None:
+                metrics["cache"] = "hit" if cached else "miss"
+            if cached:
+                logger.info("Answering from the response cache for model %s", model_id)
+                return self.response_cache.replay(
+                    cached, lambda events: self.parse_stream(events, tracker, metrics=metrics, track_usage=False)
+                )
+        
+        flight = None
+        if self.single_flight.enabled:
+            flight, leader = self.single_flight.join(request_key(
+                model_id, system_prompts, messages, request_params, additional_model_fields
+            ))
+            if not leader:
+                if metrics is not None:
+                    metrics["coalesced"] = True
+                logger.info("Attaching to an identical in-flight request for model %s", model_id)
+                return FlightStream(
+                    flight, lambda events: self.parse_stream(events, tracker, metrics=metrics, track_usage=False)
+                )
+        
+        def produce():
+            try:
+                stream = self.stream_conversation(
+                    model_id=model_id,
+                    messages=messages,
+                    system_prompts=system_prompts,
+                    inference_config=inference_config,
+                    additional_model_fields=additional_model_fields
+                )
+            except Exception as e:
+                if flight is not None:
+                    self.single_flight.fail(flight, e)
+                raise
+            if cache_key is not None:
+                stream = self.response_cache.record(cache_key, stream)
+            if flight is not None:
+                led = self.single_flight.lead(flight, stream)
+                return close_with(self.parse_stream(led, tracker, metrics=metrics), led)
+            return self.parse_stream(stream, tracker, metrics=metrics)
+        
+        try:
+            return self.engine.submit(model_id, produce)
+        except Exception as e:
+            # Followers must not wait for a leader that was never admitted
+            if flight is not None:
+                self.single_flight.fail(flight, e)
+            raise
     
     def stream_conversation(self,
                     model_id: str,
@@ -63,40 +176,41 @@ class BedrockClient:
         Returns:
             Stream object for processing response chunks
         """
-        logger.info(f"Streaming messages with model {model_id}")
+        logger.info("Streaming messages with model %s", model_id)
         
         # Log the full request details
-        logger.info(f"Inference config: {json.dumps(inference_config, default=str)}")
+        logger.debug("Inference config: %s", LazyJson(inference_config))
         
         # Log the system prompts in full
         if system_prompts and len(system_prompts) > 0:
             for i, prompt in enumerate(system_prompts):
-                logger.info(f"System prompt {i+1}: {json.dumps(prompt, default=str)}")
+                logger.debug("System prompt %s: %s", i + 1, LazyJson(prompt))
         else:
             logger.warning("No system prompts provided")
         
         # Log the messages being sent (truncate long messages for readability)
-        formatted_messages = []
-        for i, msg in enumerate(messages):
-            content = msg.get('content', '')
-            if isinstance(content, str) and len(content) > 200:
-                content_preview = content[:200] + "..."
-            elif isinstance(content, list):
-                content_preview = [
-                    {k: (v[:200] + "..." if isinstance(v, str) and len(v) > 200 else v) 
-                     for k, v in item.items()}
-                    for item in content
-                ]
-            else:
-                content_preview = content
-                
-            formatted_messages.append({
-                "index": i,
-                "role": msg.get('role', 'unknown'),
-                "content": content_preview
-            })
-        
-        logger.info(f"Messages being sent: {json.dumps(formatted_messages, default=str)}")
+        if logger.isEnabledFor(logging.DEBUG):
+            formatted_messages = []
+            for i, msg in enumerate(messages):
+                content = msg.get('content', '')
+                if isinstance(content, str) and len(content) > 200:
+                    content_preview = content[:200] + "..."
+                elif isinstance(content, list):
+                    content_preview = [
+                        {k: (v[:200] + "..." if isinstance(v, str) and len(v) > 200 else v) 
+                         for k, v in item.items()}
+                        for item in content
+                    ]
+                else:
+                    content_preview = content
+                    
+                formatted_messages.append({
+                    "index": i,
+                    "role": msg.get('role', 'unknown'),
+                    "content": content_preview
+                })
+            
+            logger.debug("Messages being sent: %s", LazyJson(formatted_messages))
         
         # Ensure numeric parameters are properly converted to their respective types
         inference_config = self._convert_numeric_params(inference_config)
@@ -116,14 +230,14 @@ class BedrockClient:
                 formatted_system_prompts = self._format_system_prompts(system_prompts)
                 if formatted_system_prompts:
                     params['system'] = formatted_system_prompts
-                    logger.info(f"Formatted system prompts for Amazon: {json.dumps(formatted_system_prompts, default=str)}")
+                    logger.debug("Formatted system prompts for Amazon: %s", LazyJson(formatted_system_prompts))
             
             # Add additional fields if provided
             if additional_model_fields:
                 params['additionalModelRequestFields'] = additional_model_fields
             
             # Log the final parameters for debugging
-            logger.info(f"Amazon model final parameters: {json.dumps(params, default=str)}")
+            logger.debug("Amazon model final parameters: %s", LazyJson(params))
             
             # Call the converse_stream API
             response = self.client.converse_stream(**params)
@@ -143,7 +257,7 @@ class BedrockClient:
                 system_text = system_prompts[0].get('text', '')
                 if system_text:
                     request_body["system"] = system_text
-                    logger.info(f"Using system prompt for Claude: {system_text}")
+                    logger.debug("Using system prompt for Claude: %s", system_text)
             
             # Add top_p if provided
             if "topP" in inference_config:
@@ -154,7 +268,7 @@ class BedrockClient:
                 request_body.update(additional_model_fields)
             
             # Log the final request body for debugging
-            logger.info(f"Claude model final request body: {json.dumps(request_body, default=str)}")
+            logger.debug("Claude model final request body: %s", LazyJson(request_body))
             
             # Call the invoke_model_with_response_stream API
             response = self.client.invoke_model_with_response_stream(
@@ -182,7 +296,7 @@ class BedrockClient:
                 try:
                     config["temperature"] = float(config["temperature"])
                 except (ValueError, TypeError):
-                    logger.warning(f"Invalid temperature value: {config['temperature']}. Using default: 0.7")
+                    logger.warning("Invalid temperature value: %s. Using default: 0.7", config['temperature'])
                     config["temperature"] = 0.7
         
         # Convert maxTokens to int
@@ -191,7 +305,7 @@ class BedrockClient:
                 try:
                     config["maxTokens"] = int(config["maxTokens"])
                 except (ValueError, TypeError):
-                    logger.warning(f"Invalid maxTokens value: {config['maxTokens']}. Using default: 1000")
+                    logger.warning("Invalid maxTokens value: %s. Using default: 1000", config['maxTokens'])
                     config["maxTokens"] = 1000
         
         # Convert topP to float
@@ -200,7 +314,7 @@ class BedrockClient:
                 try:
                     config["topP"] = float(config["topP"])
                 except (ValueError, TypeError):
-                    logger.warning(f"Invalid topP value: {config['topP']}. Using default: 0.9")
+                    logger.warning("Invalid topP value: %s. Using default: 0.9", config['topP'])
                     config["topP"] = 0.9
         
         return config
@@ -241,13 +355,19 @@ class BedrockClient:
         
         return formatted_prompts
 
-    def parse_stream(self, stream, tracker=None) -> Generator[str, None, str]:
+    def parse_stream(self, stream, tracker=None, metrics: Optional[Dict[str, Any]] = None,
+                     track_usage: bool = True) -> Generator[str, None, str]:
         """
         Process streaming response from Bedrock with enhanced logging.
         
         Args:
             stream: Bedrock stream response
             tracker: LaunchDarkly tracker for metrics
+            metrics: Optional dict that receives the usage and timing metrics
+                (``usage``, ``metrics.timeToFirstToken``, ``metrics.latencyMs``)
+                once the stream has been fully consumed
+            track_usage: Whether the tracker is sent the token usage; False for
+                replayed and coalesced answers, which did not call the model
             
         Yields:
             Message chunks for streaming display
@@ -265,13 +385,14 @@ class BedrockClient:
         start_time = time.time()
         first_token_time = None
         
-        logger.info("Starting to parse response stream")
+        logger.debug("Starting to parse response stream")
+        chunk_index = 0
         
         try:
             for event in stream:
                 # Handle different event types
                 if 'messageStart' in event:
-                    logger.info(f"Role: {event['messageStart']['role']}")
+                    logger.debug("Role: %s", event['messageStart']['role'])
 
                 if 'contentBlockDelta' in event:            
                     message = event['contentBlockDelta']['delta']['text']
@@ -279,15 +400,17 @@ class BedrockClient:
                     if first_token_time is None:
                         first_token_time = time.time()
                         time_to_first_token = (first_token_time - start_time) * 1000
-                        logger.info(f"Time to first token: {time_to_first_token} ms")
+                        logger.info("Time to first token: %.1f ms", time_to_first_token)
                         
                         # Add to metrics
                         if "metrics" not in metric_response:
                             metric_response["metrics"] = {}
                         metric_response["metrics"]["timeToFirstToken"] = time_to_first_token
                     
-                    # Log the message chunk (first 50 chars)
-                    logger.info(f"Received message chunk: {message[:50]}..." if len(message) > 50 else message)
+                    # Log a sample of the message chunks (first 50 chars)
+                    if sample_chunk(chunk_index) and logger.isEnabledFor(logging.DEBUG):
+                        logger.debug("Received message chunk %s: %s", chunk_index, message[:50])
+                    chunk_index += 1
                     
                     full_response += message
                     yield message  # return output so it can be rendered immediately
@@ -295,51 +418,82 @@ class BedrockClient:
                 # Handle Claude-style chunks
                 elif 'chunk' in event:
                     chunk_obj = json.loads(event['chunk']['bytes'].decode())
+                    # Messages API streams text as content_block_delta events,
+                    # the legacy text completion API as 'completion'
+                    message = None
                     if 'completion' in chunk_obj:
                         message = chunk_obj['completion']
+                    elif chunk_obj.get('type') == 'content_block_delta':
+                        message = chunk_obj.get('delta', {}).get('text')
+                    
+                    # Bedrock appends invocation metrics to the final Claude chunk
+                    invocation_metrics = chunk_obj.get('amazon-bedrock-invocationMetrics')
+                    if invocation_metrics:
+                        input_tokens = invocation_metrics.get('inputTokenCount', 0)
+                        output_tokens = invocation_metrics.get('outputTokenCount', 0)
+                        metric_response["usage"] = {
+                            "inputTokens": input_tokens,
+                            "outputTokens": output_tokens,
+                            "totalTokens": input_tokens + output_tokens
+                        }
+                        if "invocationLatency" in invocation_metrics:
+                            if "metrics" not in metric_response:
+                                metric_response["metrics"] = {}
+                            metric_response["metrics"]["latencyMs"] = invocation_metrics["invocationLatency"]
+                    
+                    if message:
                         # Record time of first token if not already set
                         if first_token_time is None:
                             first_token_time = time.time()
                             time_to_first_token = (first_token_time - start_time) * 1000
-                            logger.info(f"Time to first token: {time_to_first_token} ms")
+                            logger.info("Time to first token: %.1f ms", time_to_first_token)
                             
                             # Add to metrics
                             if "metrics" not in metric_response:
                                 metric_response["metrics"] = {}
                             metric_response["metrics"]["timeToFirstToken"] = time_to_first_token
                         
-                        # Log the message chunk (first 50 chars)
-                        logger.info(f"Received Claude chunk: {message[:50]}..." if len(message) > 50 else message)
+                        # Log a sample of the message chunks (first 50 chars)
+                        if sample_chunk(chunk_index) and logger.isEnabledFor(logging.DEBUG):
+                            logger.debug("Received Claude chunk %s: %s", chunk_index, message[:50])
+                        chunk_index += 1
                         
                         full_response += message
                         yield message  # return output so it can be rendered immediately
 
                 if 'messageStop' in event:
-                    logger.info(f"Stop reason: {event['messageStop']['stopReason']}")
+                    logger.debug("Stop reason: %s", event['messageStop']['stopReason'])
 
                 if 'metadata' in event:
                     metadata = event['metadata']
                     if 'usage' in metadata:
-                        logger.info("Token usage")
-                        logger.info(f"Input tokens: {metadata['usage']['inputTokens']}")
-                        logger.info(f"Output tokens: {metadata['usage']['outputTokens']}")
-                        logger.info(f"Total tokens: {metadata['usage']['totalTokens']}")
+                        logger.info("Token usage: input %s, output %s, total %s",
+                                    metadata['usage']['inputTokens'], metadata['usage']['outputTokens'],
+                                    metadata['usage']['totalTokens'])
                         metric_response["usage"] = metadata['usage']
                     if 'metrics' in event['metadata']:
-                        logger.info(f"Latency (Total Time for Response): {metadata['metrics']['latencyMs']} milliseconds")
+                        logger.info("Latency (Total Time for Response): %s milliseconds", metadata['metrics']['latencyMs'])
                         if "metrics" not in metric_response:
                             metric_response["metrics"] = {}
                         metric_response["metrics"]["latencyMs"] = metadata['metrics']['latencyMs']
             
             # Log the full response
-            logger.info(f"Full response length: {len(full_response)}")
-            logger.info(f"Full response preview: {full_response[:200]}...")
+            logger.info("Full response length: %s", len(full_response))
+            logger.debug("Full response preview: %s...", full_response[:200])
+            
+            if metrics is not None:
+                metrics.update(metric_response)
             
             # Send metrics to tracker if provided
             if tracker:
                 # Track AWS converse metrics
-                logger.info("Tracking metrics with LaunchDarkly tracker")
-                tracker.track_bedrock_converse_metrics(metric_response)
+                logger.debug("Tracking metrics with LaunchDarkly tracker")
+                if track_usage:
+                    tracker.track_bedrock_converse_metrics(metric_response)
+                else:
+                    tracker.track_bedrock_converse_metrics(
+                        {key: value for key, value in metric_response.items() if key != "usage"}
+                    )
                 
                 # Track success response
                 tracker.track_success()
@@ -352,8 +506,11 @@ class BedrockClient:
             
         except Exception as e:
             error_str = str(e)
-            logger.error(f"Error parsing stream: {error_str}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.error("Error parsing stream: %s", error_str, exc_info=True)
+            
+            if metrics is not None:
+                metrics.update(metric_response)
+                metrics["error"] = error_str
             
             # Return what we have so far
             if full_response:
@@ -361,62 +518,38 @@ class BedrockClient:
             else:
                 return f"Error generating response: {error_str}"
 
-def create_bedrock_message(message_history: List[Dict[str, str]], current_prompt: str) -> List[Dict[str, Any]]:
+def create_bedrock_message(message_history: List[Dict[str, str]], current_prompt: str,
+                           context: Optional[ContextWindowBuilder] = None) -> List[Dict[str, Any]]:
     """
     Create a message array for Bedrock API that includes conversation history.
     
     Args:
         message_history: Previous messages in the conversation
         current_prompt: The current user input text
+        context: Decides how much history fits the input-token budget
+            (defaults to a ContextWindowBuilder with its default budget)
         
     Returns:
         Message array formatted for Bedrock
     """
-    # Convert the conversation history to Bedrock format
-    bedrock_messages = []
-    
-    # Add historical messages first (limited to last 10 to avoid context length issues)
-    for msg in message_history[-10:]:
-        role = "user" if msg["role"] == "user" else "assistant"
-        bedrock_messages.append({
-            "role": role,
-            "content": [{"text": msg["content"]}]
-        })
-    
-    # Add the current user message
-    bedrock_messages.append({
-        "role": "user",
-        "content": [{"text": current_prompt}]
-    })
-    
-    return bedrock_messages
+    # Add as much history as fits the token budget, newest first, then the current user message
+    history = list(message_history) + [{"role": "user", "content": current_prompt}]
+    return (context or ContextWindowBuilder()).build(history, "bedrock")
 
-def create_claude_message(message_history: List[Dict[str, str]], current_prompt: str) -> List[Dict[str, Any]]:
+def create_claude_message(message_history: List[Dict[str, str]], current_prompt: str,
+                          context: Optional[ContextWindowBuilder] = None) -> List[Dict[str, Any]]:
     """
     Create a message array for Claude models that includes conversation history.
     
     Args:
         message_history: Previous messages in the conversation
         current_prompt: The current user input text
+        context: Decides how much history fits the input-token budget
+            (defaults to a ContextWindowBuilder with its default budget)
         
     Returns:
         Message array formatted for Claude
     """
-    # Convert the conversation history to Claude format
-    claude_messages = []
-    
-    # Add historical messages first (limited to last 10 to avoid context length issues)
-    for msg in message_history[-10:]:
-        role = "user" if msg["role"] == "user" else "assistant"
-        claude_messages.append({
-            "role": role,
-            "content": msg["content"]
-        })
-    
-    # Add the current user message
-    claude_messages.append({
-        "role": "user",
-        "content": current_prompt
-    })
-    
-    return claude_messages
+    # Add as much history as fits the token budget, newest first, then the current user message
+    history = list(message_history) + [{"role": "user", "content": current_prompt}]
+    return (context or ContextWindowBuilder()).build(history, "claude")
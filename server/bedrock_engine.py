@@ -0,0 +1,363 @@
+"""
+Execution Engine for AWS Bedrock Streams
+
+This module provides a bounded thread-pool engine that runs Bedrock streaming
+calls off the Flask request threads. Each model gets its own concurrency limit
+and a wait queue in front of it; when that queue is full, new requests are
+rejected right away so the API can answer with 429 and a Retry-After hint
+instead of piling up blocked worker threads.
+"""
+
+import contextvars
+import math
+import os
+import queue
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, Optional
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Marker placed on a stream queue once the producer has finished
+_DONE = object()
+
+
+class EngineSaturatedError(Exception):
+    """Raised when a model's wait queue is full or the wait timed out."""
+
+    def __init__(self, model_id: str, retry_after: int):
+        super().__init__(f"Too many concurrent requests for model {model_id}")
+        self.model_id = model_id
+        self.retry_after = retry_after
+
+
+class EngineStream:
+    """
+    Consumer side of a stream that runs on the engine.
+
+    The worker thread pushes chunks into a bounded queue, and the request
+    thread iterates over them. Abandoning the iteration (for example when
+    the browser disconnects from an SSE response) cancels the worker.
+    """
+
+    def __init__(self, buffer_size: int = 256):
+        self._queue = queue.Queue(maxsize=buffer_size)
+        self._ready = threading.Event()
+        self._first = threading.Event()
+        self._cancelled = threading.Event()
+        self._error = None
+
+    # Worker side
+
+    def _mark_ready(self) -> None:
+        self._ready.set()
+
+    def _put(self, item) -> bool:
+        """Queue an item for the consumer, returning False once cancelled."""
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                self._first.set()
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _fail(self, error: Exception) -> None:
+        self._error = error
+        self._ready.set()
+        self._first.set()
+
+    def _finish(self) -> None:
+        self._ready.set()
+        self._put(_DONE)
+        self._first.set()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled.is_set()
+
+    # Consumer side
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the Bedrock call has returned its stream.
+
+        Errors raised while starting the call (access denied, validation
+        errors, throttling) are re-raised here so callers can still handle
+        them before committing to a response.
+
+        Returns:
+            bool: False if the timeout expired before the stream was ready
+        """
+        ready = self._ready.wait(timeout)
+        if self._error is not None:
+            raise self._error
+        return ready
+
+    def wait_for_first_chunk(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until the first chunk is queued or the stream has ended.
+
+        Returns:
+            bool: False if the timeout expired first
+        """
+        return self._first.wait(timeout)
+
+    def cancel(self) -> None:
+        self._cancelled.set()
+
+    def __iter__(self) -> Iterator[Any]:
+        try:
+            while True:
+                item = self._queue.get()
+                if item is _DONE:
+                    break
+                yield item
+            if self._error is not None:
+                raise self._error
+        finally:
+            self.cancel()
+
+
+class _ModelSlot:
+    """Concurrency bookkeeping for a single model ID."""
+
+    def __init__(self, limit: int, lock: threading.Lock):
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self.condition = threading.Condition(lock)
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait_ms = 0.0
+        self.max_wait_ms = 0.0
+        self.max_queue_depth = 0
+        # Exponentially weighted average run time, used for Retry-After hints
+        self.avg_duration_s = 1.0
+
+
+class BedrockExecutionEngine:
+    """
+    Runs Bedrock streams on a dedicated thread pool with per-model limits.
+
+    Callers submit a producer function that starts the Bedrock call and
+    returns an iterator of chunks. The engine admits it when the model has
+    a free slot, queues it (blocking the caller) while the model is at its
+    limit, and rejects it with EngineSaturatedError once the queue is full.
+    """
+
+    def __init__(self,
+                 max_concurrency_per_model: int = 8,
+                 max_queue_depth: int = 32,
+                 queue_timeout: float = 10.0,
+                 max_workers: int = 64,
+                 model_limits: Optional[Dict[str, int]] = None):
+        """
+        Initialize the execution engine.
+
+        Args:
+            max_concurrency_per_model: Default number of in-flight streams per model
+            max_queue_depth: Maximum number of requests waiting per model
+            queue_timeout: Seconds a request may wait for a slot before it is rejected
+            max_workers: Size of the thread pool that drives the streams
+            model_limits: Per-model overrides for the concurrency limit
+        """
+        self.max_concurrency_per_model = max_concurrency_per_model
+        self.max_queue_depth = max_queue_depth
+        self.queue_timeout = queue_timeout
+        self.max_workers = max_workers
+        self.model_limits = dict(model_limits or {})
+
+        self._lock = threading.Lock()
+        self._slots: Dict[str, _ModelSlot] = {}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers,
+            thread_name_prefix="bedrock-engine"
+        )
+
+        logger.info(
+            "Initialized Bedrock execution engine: %s streams per model, queue depth %s, %s workers",
+            max_concurrency_per_model, max_queue_depth, max_workers
+        )
+
+    @classmethod
+    def from_env(cls) -> "BedrockExecutionEngine":
+        """
+        Create an engine configured from environment variables.
+
+        BEDROCK_MODEL_CONCURRENCY takes comma-separated model_id=limit pairs
+        that override BEDROCK_MAX_CONCURRENCY_PER_MODEL for specific models.
+        """
+        model_limits = {}
+        for item in os.getenv("BEDROCK_MODEL_CONCURRENCY", "").split(","):
+            if "=" in item:
+                model_id, limit = item.rsplit("=", 1)
+                try:
+                    model_limits[model_id.strip()] = int(limit)
+                except ValueError:
+                    logger.warning("Ignoring invalid model concurrency limit: %s", item)
+
+        return cls(
+            max_concurrency_per_model=int(os.getenv("BEDROCK_MAX_CONCURRENCY_PER_MODEL", "8")),
+            max_queue_depth=int(os.getenv("BEDROCK_MAX_QUEUE_DEPTH", "32")),
+            queue_timeout=float(os.getenv("BEDROCK_QUEUE_TIMEOUT_SECONDS", "10")),
+            max_workers=int(os.getenv("BEDROCK_ENGINE_WORKERS", "64")),
+            model_limits=model_limits
+        )
+
+    def submit(self, model_id: str, producer: Callable[[], Iterator[Any]]) -> EngineStream:
+        """
+        Run a producer on the engine once the model has a free slot.
+
+        Args:
+            model_id: The model the producer calls, used for the concurrency limit
+            producer: Function that starts the Bedrock call and returns an iterator of chunks
+
+        Returns:
+            EngineStream the caller iterates to receive the chunks
+
+        Raises:
+            EngineSaturatedError: If the model's wait queue is full or the wait timed out
+        """
+        wait_ms = self._acquire(model_id)
+        logger.debug("Admitted stream for %s after waiting %.1f ms", model_id, wait_ms)
+
+        stream = EngineStream()
+        try:
+            # Run in a copy of the caller's context so logs keep the request ID
+            self._executor.submit(contextvars.copy_context().run, self._run, model_id, producer, stream)
+        except RuntimeError:
+            # The executor has been shut down
+            self._release(model_id, 0.0, failed=True)
+            raise
+        return stream
+
+    def _slot(self, model_id: str) -> _ModelSlot:
+        # Callers must hold self._lock
+        slot = self._slots.get(model_id)
+        if slot is None:
+            limit = self.model_limits.get(model_id, self.max_concurrency_per_model)
+            slot = _ModelSlot(max(1, limit), self._lock)
+            self._slots[model_id] = slot
+        return slot
+
+    def _retry_after(self, slot: _ModelSlot) -> int:
+        # Time for the requests ahead of us to drain through the model's slots
+        return max(1, math.ceil(slot.avg_duration_s * (slot.waiting + 1) / slot.limit))
+
+    def _acquire(self, model_id: str) -> float:
+        with self._lock:
+            slot = self._slot(model_id)
+
+            if slot.active < slot.limit and slot.waiting == 0:
+                slot.active += 1
+                slot.admitted += 1
+                return 0.0
+
+            if slot.waiting >= self.max_queue_depth:
+                slot.rejected += 1
+                raise EngineSaturatedError(model_id, self._retry_after(slot))
+
+            slot.waiting += 1
+            slot.max_queue_depth = max(slot.max_queue_depth, slot.waiting)
+            start = time.perf_counter()
+            deadline = start + self.queue_timeout
+            try:
+                while slot.active >= slot.limit:
+                    remaining = deadline - time.perf_counter()
+                    if remaining <= 0:
+                        slot.rejected += 1
+                        raise EngineSaturatedError(model_id, self._retry_after(slot))
+                    slot.condition.wait(remaining)
+
+                slot.active += 1
+                slot.admitted += 1
+            finally:
+                slot.waiting -= 1
+
+            wait_ms = (time.perf_counter() - start) * 1000
+            slot.total_wait_ms += wait_ms
+            slot.max_wait_ms = max(slot.max_wait_ms, wait_ms)
+            return wait_ms
+
+    def _release(self, model_id: str, duration_s: float, failed: bool = False) -> None:
+        with self._lock:
+            slot = self._slots[model_id]
+            slot.active -= 1
+            if failed:
+                slot.failed += 1
+            else:
+                slot.completed += 1
+                slot.avg_duration_s = 0.8 * slot.avg_duration_s + 0.2 * duration_s
+            slot.condition.notify()
+
+    def _run(self, model_id: str, producer: Callable[[], Iterator[Any]], stream: EngineStream) -> None:
+        start = time.perf_counter()
+        failed = False
+        try:
+            chunks = producer()
+            stream._mark_ready()
+            try:
+                for chunk in chunks:
+                    if not stream._put(chunk):
+                        logger.info("Stream for %s cancelled by consumer", model_id)
+                        break
+            finally:
+                # Closes parse_stream early if the consumer went away
+                close = getattr(chunks, "close", None)
+                if close:
+                    close()
+        except Exception as e:
+            failed = True
+            logger.error("Error running stream for %s: %s", model_id, e)
+            stream._fail(e)
+        finally:
+            stream._finish()
+            self._release(model_id, time.perf_counter() - start, failed=failed)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Get queue depth, wait time and throughput counters.
+
+        Returns:
+            dict: Totals across all models plus a per-model breakdown
+        """
+        with self._lock:
+            total_wait_ms = sum(slot.total_wait_ms for slot in self._slots.values())
+            models = {}
+            for model_id, slot in self._slots.items():
+                models[model_id] = {
+                    "limit": slot.limit,
+                    "active": slot.active,
+                    "queue_depth": slot.waiting,
+                    "max_queue_depth": slot.max_queue_depth,
+                    "admitted": slot.admitted,
+                    "rejected": slot.rejected,
+                    "completed": slot.completed,
+                    "failed": slot.failed,
+                    "avg_wait_ms": round(slot.total_wait_ms / slot.admitted, 2) if slot.admitted else 0,
+                    "max_wait_ms": round(slot.max_wait_ms, 2)
+                }
+
+        admitted = sum(m["admitted"] for m in models.values())
+        return {
+            "active": sum(m["active"] for m in models.values()),
+            "queue_depth": sum(m["queue_depth"] for m in models.values()),
+            "admitted": admitted,
+            "rejected": sum(m["rejected"] for m in models.values()),
+            "avg_wait_ms": round(total_wait_ms / admitted, 2) if admitted else 0,
+            "max_wait_ms": max((m["max_wait_ms"] for m in models.values()), default=0),
+            "queue_limit": self.max_queue_depth,
+            "max_workers": self.max_workers,
+            "models": models
+        }
+
+    def shutdown(self, wait: bool = True) -> None:
+        """Stop accepting work and optionally wait for in-flight streams."""
+        self._executor.shutdown(wait=wait)
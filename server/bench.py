@@ -0,0 +1,369 @@
+"""
+Server Benchmarks
+
+This module benchmarks the server's hot paths in-process: individual
+components (user contexts, service sorting, analytics aggregation, stream
+parsing, metrics summaries, Claude message building) and the Flask
+endpoints that use them, through app.test_client(). LaunchDarkly runs
+offline (LAUNCHDARKLY_OFFLINE) and Bedrock is the local FakeBedrockRuntime
+(BEDROCK_TRANSPORT=fake) with no simulated latency, so the numbers measure
+the server's own work and need no network or credentials.
+
+Each benchmark reports operations per second, p50 and p99 time per
+operation, and items per second where an operation handles many items
+(stream chunks, for instance). Results can be saved as a JSON baseline;
+a later run given that baseline fails (exit status 1) when a benchmark's
+throughput drops, or its p99 rises, by more than the threshold percent.
+
+Usage:
+    python bench.py
+    python bench.py --only parse_stream_converse,metrics_summary
+    python bench.py --save-baseline bench_baseline.json
+    python bench.py --baseline bench_baseline.json --threshold 15
+
+Environment variables:
+    BENCH_REGRESSION_PERCENT: Default for --threshold (default 20)
+"""
+
+import argparse
+import itertools
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+# Settings for the stand-ins, applied before the app is imported unless already set
+BENCH_ENV = {
+    "LAUNCHDARKLY_OFFLINE": "true",
+    "BEDROCK_TRANSPORT": "fake",
+    "FAKE_BEDROCK_TTFT_MS": "0",
+    "FAKE_BEDROCK_TOKENS_PER_SECOND": "0",
+    "FAKE_BEDROCK_JITTER": "0",
+    "ANALYTICS_LOG_ENABLED": "false",
+    "LOG_LEVEL": "ERROR"
+}
+
+# name -> (factory, description); a factory takes the options and returns (operation, items per operation)
+BENCHMARKS: Dict[str, Tuple[Callable[[argparse.Namespace], Tuple[Callable[[], Any], int]], str]] = {}
+
+
+def benchmark(name: str, description: str):
+    """Register a benchmark factory under a name."""
+    def register(factory):
+        BENCHMARKS[name] = (factory, description)
+        return factory
+    return register
+
+
+def load_app():
+    """Import the Flask app with the offline LaunchDarkly and fake Bedrock stand-ins."""
+    for key, value in BENCH_ENV.items():
+        os.environ.setdefault(key, value)
+    import app
+    return app
+
+
+@benchmark("create_user_context", "Build a LaunchDarkly context for a user")
+def bench_create_user_context(options):
+    app = load_app()
+    counter = itertools.count()
+    return lambda: app.create_user_context(f"user{next(counter) % 1000}", "1"), 1
+
+
+@benchmark("services_sort", "Sort the service catalog for a variation")
+def bench_services_sort(options):
+    app = load_app()
+    variations = itertools.cycle(sorted(app.SORT_VARIATIONS))
+    return lambda: app.build_services_response(next(variations)), 1
+
+
+@benchmark("services_endpoint", "GET /api/services/<provider_id>")
+def bench_services_endpoint(options):
+    app = load_app()
+    client = app.app.test_client()
+    counter = itertools.count()
+
+    def op():
+        response = client.get(f"/api/services/1?userId=user{next(counter) % 1000}")
+        assert response.status_code == 200, response.status_code
+    return op, 1
+
+
+def _filled_analytics_store(events: int):
+    # Views and clicks spread over the last hour, across every variation and 1000 users
+    from analytics_store import AnalyticsStore, DEFAULT_VARIATIONS
+    store = AnalyticsStore()
+    now = time.time()
+    batch_size = 10000
+
+    def batches():
+        for start in range(0, events, batch_size):
+            timestamp = now - 3600 + 3600 * start / events
+            yield timestamp, (
+                {
+                    "type": "click" if i % 10 == 0 else "view",
+                    "variation": DEFAULT_VARIATIONS[i % len(DEFAULT_VARIATIONS)],
+                    "userId": f"user{i % 1000}"
+                }
+                for i in range(start, min(start + batch_size, events))
+            )
+    store.append_batches(batches())
+    return store, now - 1800
+
+
+@benchmark("analytics_results", "Aggregate per-variation results over the last half hour of events")
+def bench_analytics_results(options):
+    app = load_app()
+    store, since = _filled_analytics_store(options.analytics_events)
+    return lambda: store.results(since=since), 1
+
+
+@benchmark("analytics_endpoint", "GET /api/analytics/results?since=... over the stored events")
+def bench_analytics_endpoint(options):
+    app = load_app()
+    app.analytics_store, since = _filled_analytics_store(options.analytics_events)
+    client = app.app.test_client()
+
+    def op():
+        response = client.get(f"/api/analytics/results?since={since}")
+        assert response.status_code == 200, response.status_code
+    return op, 1
+
+
+def _recorded_stream(model_id: str, tokens: int) -> List[Dict[str, Any]]:
+    from fake_bedrock import FakeBedrockRuntime
+    fake = FakeBedrockRuntime(ttft_ms=0, tokens_per_second=0, output_tokens=tokens, jitter=0, seed=0)
+    messages = [{"role": "user", "content": [{"text": "Which cleaning services do you offer?"}]}]
+    if "amazon" in model_id:
+        return list(fake.converse_stream(modelId=model_id, messages=messages)["stream"])
+    body = json.dumps({"messages": messages, "max_tokens": tokens})
+    return list(fake.invoke_model_with_response_stream(modelId=model_id, body=body)["body"])
+
+
+def _parse_stream_benchmark(model_id: str, options):
+    app = load_app()
+    events = _recorded_stream(model_id, options.stream_tokens)
+
+    def op():
+        for _ in app.bedrock_client.parse_stream(iter(events), metrics={}):
+            pass
+    return op, options.stream_tokens
+
+
+@benchmark("parse_stream_converse", "Parse a recorded Converse stream (items: chunks)")
+def bench_parse_stream_converse(options):
+    return _parse_stream_benchmark("amazon.nova-pro-v1:0", options)
+
+
+@benchmark("parse_stream_claude", "Parse a recorded Claude stream (items: chunks)")
+def bench_parse_stream_claude(options):
+    return _parse_stream_benchmark("anthropic.claude-3-sonnet-20240229-v1:0", options)
+
+
+@benchmark("metrics_summary", "BedrockMetricsTracker.get_summary_metrics after many tracked calls")
+def bench_metrics_summary(options):
+    load_app()
+    from metrics_tracker import BedrockMetricsTracker, RequestTimer
+    tracker = BedrockMetricsTracker()
+    models = [("amazon.nova-pro-v1:0", "converse"), ("anthropic.claude-3-sonnet-20240229-v1:0", "invoke")]
+    for i in range(options.metrics_samples):
+        model_id, api_type = models[i % len(models)]
+        stream_metrics = {
+            "usage": {"inputTokens": 100 + i % 50, "outputTokens": 200 + i % 80, "totalTokens": 300 + i % 130},
+            "metrics": {"timeToFirstToken": 200 + i % 300, "latencyMs": 1000 + i % 2000}
+        }
+        tracker.track_stream_metrics(model_id, api_type, time.time(), 1000 + i % 2000, stream_metrics,
+                                     messages=[{"role": "user", "content": "hello"}], response_length=800)
+        timer = RequestTimer()
+        timer.mark("context")
+        timer.mark("invoke")
+        tracker.track_phases(model_id, api_type, timer)
+    return tracker.get_summary_metrics, 1
+
+
+@benchmark("create_claude_message", "Build a Claude message list from a 20-message history")
+def bench_create_claude_message(options):
+    load_app()
+    from bedrock_client import create_claude_message
+    from context_window import ContextWindowBuilder
+    builder = ContextWindowBuilder()
+    history = [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"Message {i} about booking a home cleaning service next week. " * 4
+        }
+        for i in range(20)
+    ]
+    return lambda: create_claude_message(history, "What about weekends?", builder), 1
+
+
+@benchmark("chat_message", "POST /api/chatbot/message through the chat pipeline and the fake Bedrock")
+def bench_chat_message(options):
+    app = load_app()
+    client = app.app.test_client()
+    counter = itertools.count()
+
+    def op():
+        # A new question every time, so answers are not served from the response cache
+        i = next(counter)
+        response = client.post("/api/chatbot/message", json={"userId": f"user{i % 1000}", "message": f"Question {i}"})
+        assert response.status_code == 200, response.get_json()
+    return op, 1
+
+
+def percentile(sorted_values: List[int], percent: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    index = max(0, min(len(sorted_values) - 1, int(round(percent / 100 * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+def measure(op: Callable[[], Any], items: int, min_time: float, min_ops: int, warmup: int) -> Dict[str, Any]:
+    """
+    Run an operation repeatedly and summarize its timings.
+
+    Args:
+        op: The operation to time
+        items: Items handled per operation
+        min_time: Keep running for at least this many seconds
+        min_ops: Run at least this many timed operations
+        warmup: Untimed operations run first
+
+    Returns:
+        dict: ops, ops_per_sec, items_per_sec, mean_us, p50_us and p99_us
+    """
+    for _ in range(warmup):
+        op()
+    samples = []
+    deadline = time.perf_counter() + min_time
+    while len(samples) < min_ops or time.perf_counter() < deadline:
+        started = time.perf_counter_ns()
+        op()
+        samples.append(time.perf_counter_ns() - started)
+    total_seconds = sum(samples) / 1e9
+    samples.sort()
+    ops_per_sec = len(samples) / total_seconds if total_seconds else float("inf")
+    return {
+        "ops": len(samples),
+        "ops_per_sec": round(ops_per_sec, 2),
+        "items_per_sec": round(ops_per_sec * items, 2),
+        "mean_us": round(total_seconds / len(samples) * 1e6, 2),
+        "p50_us": round(percentile(samples, 50) / 1000, 2),
+        "p99_us": round(percentile(samples, 99) / 1000, 2)
+    }
+
+
+def compare(results: Dict[str, Dict[str, Any]], baseline: Dict[str, Any], threshold: float) -> List[str]:
+    """
+    Compare results with a baseline.
+
+    Returns:
+        list: A description of every benchmark that regressed by more than threshold percent
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get("results", {}).get(name)
+        if not base:
+            continue
+        throughput_change = (result["ops_per_sec"] / base["ops_per_sec"] - 1) * 100 if base["ops_per_sec"] else 0
+        p99_change = (result["p99_us"] / base["p99_us"] - 1) * 100 if base["p99_us"] else 0
+        result["ops_per_sec_change"] = round(throughput_change, 1)
+        result["p99_change"] = round(p99_change, 1)
+        if throughput_change < -threshold:
+            regressions.append(f"{name}: throughput {throughput_change:+.1f}% "
+                               f"({base['ops_per_sec']} -> {result['ops_per_sec']} ops/s)")
+        if p99_change > threshold:
+            regressions.append(f"{name}: p99 {p99_change:+.1f}% ({base['p99_us']} -> {result['p99_us']} us)")
+    return regressions
+
+
+def print_table(results: Dict[str, Dict[str, Any]]) -> None:
+    print(f"{'benchmark':<24}{'ops/s':>12}{'items/s':>14}{'p50 us':>11}{'p99 us':>11}{'vs baseline':>22}")
+    for name, result in results.items():
+        change = ""
+        if "ops_per_sec_change" in result:
+            change = f"{result['ops_per_sec_change']:+.1f}% / p99 {result['p99_change']:+.1f}%"
+        print(f"{name:<24}{result['ops_per_sec']:>12,.0f}{result['items_per_sec']:>14,.0f}"
+              f"{result['p50_us']:>11,.1f}{result['p99_us']:>11,.1f}{change:>22}")
+
+
+def parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Benchmark the server's hot paths against offline stand-ins.")
+    parser.add_argument("--only", help="Comma-separated benchmarks to run (default: all)")
+    parser.add_argument("--list", action="store_true", help="List the benchmarks and exit")
+    parser.add_argument("--min-time", type=float, default=1.0, help="Seconds to run each benchmark (default 1)")
+    parser.add_argument("--min-ops", type=int, default=20, help="Timed operations per benchmark at least (default 20)")
+    parser.add_argument("--warmup", type=int, default=5, help="Untimed operations per benchmark (default 5)")
+    parser.add_argument("--analytics-events", type=int, default=1000000,
+                        help="Events in the analytics store (default 1000000)")
+    parser.add_argument("--stream-tokens", type=int, default=500, help="Chunks per parsed stream (default 500)")
+    parser.add_argument("--metrics-samples", type=int, default=10000,
+                        help="Calls tracked before summarizing metrics (default 10000)")
+    parser.add_argument("--baseline", help="Baseline JSON to compare with; regressions fail the run")
+    parser.add_argument("--save-baseline", help="Write the results to this JSON file as the new baseline")
+    parser.add_argument("--threshold", type=float, default=float(os.getenv("BENCH_REGRESSION_PERCENT", "20")),
+                        help="Allowed throughput drop or p99 rise in percent (default 20)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON instead of a table")
+    return parser.parse_args(argv)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    options = parse_args(argv)
+    if options.list:
+        for name, (_, description) in BENCHMARKS.items():
+            print(f"{name:<24}{description}")
+        return 0
+
+    names = options.only.split(",") if options.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        print(f"Unknown benchmarks: {', '.join(unknown)}", file=sys.stderr)
+        return 2
+
+    results = {}
+    for name in names:
+        factory, _ = BENCHMARKS[name]
+        op, items = factory(options)
+        results[name] = measure(op, items, options.min_time, options.min_ops, options.warmup)
+        if not options.json:
+            print(f"{name}: {results[name]['ops_per_sec']:,.0f} ops/s", file=sys.stderr)
+
+    regressions = []
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("settings", {}).get("analytics_events") not in (None, options.analytics_events):
+            print("Baseline was recorded with different benchmark settings", file=sys.stderr)
+        regressions = compare(results, baseline, options.threshold)
+
+    if options.json:
+        print(json.dumps({"results": results, "regressions": regressions}, indent=2))
+    else:
+        print_table(results)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+
+    if options.save_baseline:
+        with open(options.save_baseline, "w") as f:
+            json.dump({
+                "created": datetime.now(timezone.utc).isoformat(),
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "settings": {
+                    "analytics_events": options.analytics_events,
+                    "stream_tokens": options.stream_tokens,
+                    "metrics_samples": options.metrics_samples
+                },
+                "results": {
+                    name: {key: value for key, value in result.items() if not key.endswith("_change")}
+                    for name, result in results.items()
+                }
+            }, f, indent=2)
+
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,114 @@
+"""
+Catalog Response Cache
+
+This module caches the serialized JSON bodies of the catalog endpoints
+(providers, services and schedule). Their payloads depend only on the
+endpoint and the flag variation (or time period) that applies, so each
+body is built once per (endpoint, variation) pair and reused, together
+with a strong ETag that lets clients revalidate with If-None-Match and
+get a 304 instead of the full body. Call invalidate() when the catalog
+data changes to have the bodies rebuilt on the next request. The number
+of bodies is bounded, evicting the least recently used.
+"""
+
+import hashlib
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+from flask import current_app, json, request
+
+from ttl_cache import TTLCache
+
+# (endpoint, variation) identifying one cached body
+CacheKey = Tuple[str, Hashable]
+
+
+class CatalogResponseCache:
+    """Pre-serialized JSON bodies with strong ETags, keyed by (endpoint, variation)."""
+
+    def __init__(self, maxsize: int = 256):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of bodies kept before the least recently used is dropped
+        """
+        # CacheKey -> (body, ETag); bodies only change through invalidate(), so they never expire
+        self._bodies = TTLCache(maxsize=maxsize, ttl=None)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.not_modified = 0
+
+    def _get_body(self, endpoint: str, variation: Hashable,
+                  build: Callable[[], Any]) -> Tuple[bytes, str]:
+        key = (endpoint, variation)
+        entry = self._bodies.get(key)
+        if entry is not None:
+            with self._lock:
+                self.hits += 1
+            return entry
+
+        with self._lock:
+            entry = self._bodies.get(key)
+            if entry is None:
+                # Serialize with the app's JSON settings, as jsonify would
+                body = (json.dumps(build()) + "\n").encode("utf-8")
+                entry = (body, hashlib.blake2b(body, digest_size=16).hexdigest())
+                self._bodies.set(key, entry)
+                self.misses += 1
+            else:
+                self.hits += 1
+        return entry
+
+    def respond(self, endpoint: str, variation: Hashable, build: Callable[[], Any]):
+        """
+        Return the cached JSON response for an endpoint and variation.
+
+        Must be called while handling a request. If the request's
+        If-None-Match matches the body's ETag, an empty 304 is returned.
+
+        Args:
+            endpoint: Name of the endpoint, e.g. "providers"
+            variation: The flag variation or other value the payload depends on
+            build: Returns the payload to serialize when it is not cached yet
+
+        Returns:
+            Response: The JSON response or a 304 Not Modified
+        """
+        body, etag = self._get_body(endpoint, variation, build)
+
+        if request.if_none_match.contains(etag):
+            with self._lock:
+                self.not_modified += 1
+            response = current_app.response_class(status=304)
+        else:
+            response = current_app.response_class(body, mimetype="application/json")
+        response.set_etag(etag)
+        response.headers["Cache-Control"] = "no-cache"
+        return response
+
+    def invalidate(self, endpoint: Optional[str] = None) -> None:
+        """
+        Drop cached bodies so they are rebuilt from the catalog data.
+
+        Args:
+            endpoint: Only drop the bodies of this endpoint, or all if None
+        """
+        with self._lock:
+            if endpoint is None:
+                self._bodies.clear()
+            else:
+                for key in [key for key in self._bodies.keys() if key[0] == endpoint]:
+                    self._bodies.pop(key)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the number of cached bodies and hit/miss/304 counters."""
+        with self._lock:
+            return {
+                "bodies": len(self._bodies),
+                "maxsize": self._bodies.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "not_modified": self.not_modified
+            }
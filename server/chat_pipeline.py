@@ -0,0 +1,552 @@
+"""
+Chatbot Pipeline
+
+This module handles a chatbot turn as one pipeline of explicit stages:
+
+    context  - LaunchDarkly user context, chatbot flags and the conversation history
+    config   - the AI Config (model, parameters, system prompt) and its tracker
+    build    - system prompts, inference parameters and the formatted messages
+    invoke   - start the Bedrock stream, retrying transient errors within a deadline
+    parse    - stream the reply's chunks to the caller
+    track    - record metrics and the circuit breaker outcome, and remember the reply
+
+Each stage is timed with a RequestTimer and reported as a request phase.
+The AI Config is evaluated once per turn and a failing model is called at
+most CHAT_MAX_ATTEMPTS times within CHAT_DEADLINE_SECONDS. Each model has
+a circuit breaker (see circuit_breaker) that opens when too many of its
+recent calls fail or are slow; turns for a model whose circuit is open go
+straight to the fallback AI Config's model instead of waiting on it.
+
+Optionally, a turn whose model has not streamed its first chunk within
+CHAT_HEDGE_AFTER_MS is hedged: the same prompt is sent to an alternate
+model and whichever stream produces its first chunk first is used, while
+the other is cancelled.
+
+Environment variables:
+    CHAT_MAX_ATTEMPTS: Attempts to start a model stream, including the first (default 2)
+    CHAT_DEADLINE_SECONDS: Time budget for starting the stream, retries included (default 20)
+    CHAT_RETRY_BACKOFF_SECONDS: Base delay before a retry, doubled per attempt with jitter (default 0.25)
+    CHAT_HEDGE_AFTER_MS: Time to first chunk after which a hedge request is sent (default 0, off)
+    CHAT_HEDGE_MODEL_ID: Model for hedge requests (default: the fallback AI Config's model)
+    CIRCUIT_*: Circuit breaker window and thresholds (see CircuitBreakerRegistry.from_env)
+"""
+
+import logging
+import os
+import random
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError, ConnectionError as BotocoreConnectionError, ReadTimeoutError
+
+from bedrock_client import create_bedrock_message, create_claude_message
+from bedrock_engine import EngineSaturatedError
+from circuit_breaker import CircuitBreaker, CircuitBreakerRegistry, CircuitOpenError
+from log_config import LazyJson
+from metrics_tracker import RequestTimer
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+DEFAULT_SYSTEM_PROMPT = (
+    "You are a wellness assistant for a health and wellness platform. Provide helpful, friendly "
+    "advice about wellness services, fitness, meditation, and healthy living. Keep responses "
+    "concise and positive."
+)
+
+# How often the two streams of a hedged turn are checked for their first chunk
+HEDGE_POLL_SECONDS = 0.005
+
+# Bedrock error codes worth another attempt
+RETRYABLE_ERROR_CODES = {
+    "ThrottlingException",
+    "ServiceUnavailableException",
+    "InternalServerException",
+    "ModelNotReadyException",
+    "ModelTimeoutException"
+}
+
+
+class DeadlineExceededError(Exception):
+    """Raised when a model stream could not be started within the turn's deadline."""
+
+
+class RetryPolicy:
+    """How often and how long a turn may try to start a model stream."""
+
+    def __init__(self, max_attempts: int = 2, deadline: float = 20.0, backoff: float = 0.25,
+                 max_backoff: float = 2.0):
+        """
+        Initialize the policy.
+
+        Args:
+            max_attempts: Attempts to start the stream, including the first
+            deadline: Seconds from the first attempt after which no attempt is started or waited on
+            backoff: Base delay before a retry; doubled for each further attempt
+            max_backoff: Upper bound for the delay before a retry
+        """
+        self.max_attempts = max(1, max_attempts)
+        self.deadline = deadline
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_env(cls) -> "RetryPolicy":
+        """Create a policy configured from the CHAT_* environment variables."""
+        return cls(
+            max_attempts=int(os.getenv("CHAT_MAX_ATTEMPTS", "2")),
+            deadline=float(os.getenv("CHAT_DEADLINE_SECONDS", "20")),
+            backoff=float(os.getenv("CHAT_RETRY_BACKOFF_SECONDS", "0.25"))
+        )
+
+    def is_retryable(self, error: Exception) -> bool:
+        """Whether an error from starting a stream is transient."""
+        if isinstance(error, ClientError):
+            return error.response.get("Error", {}).get("Code") in RETRYABLE_ERROR_CODES
+        return isinstance(error, (BotocoreConnectionError, ReadTimeoutError))
+
+    def delay(self, attempt: int) -> float:
+        """Seconds to wait after failed attempt number `attempt` (full jitter)."""
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** (attempt - 1)))
+
+
+def describe_error(error: Exception) -> str:
+    """A message for the user about a model error."""
+    error_str = str(error)
+    if "AccessDeniedException" in error_str:
+        return "You don't have access to this model. Please complete Step 2 in AWS_BEDROCK_SETUP.md to request access."
+    if "inference profile" in error_str:
+        return "This model requires an inference profile. Please create an inference profile in the AWS Bedrock console."
+    return f"Error generating response: {error_str}"
+
+
+class ChatTurn:
+    """The state of one chatbot request as it moves through the pipeline."""
+
+    def __init__(self, user_id: str, messages: List[Dict[str, Any]], message: Optional[str] = None,
+                 conversation_id: Optional[str] = None):
+        self.user_id = user_id
+        self.messages = messages
+        self.message = message
+        self.conversation_id = conversation_id
+        self.timer = RequestTimer()
+
+        # context
+        self.user_context = None
+        self.enabled = True
+        self.use_cache = True
+        self.conversation = None
+        self.user_message = "No user message found"
+        # config
+        self.config = None
+        self.tracker = None
+        self.model_id = None
+        # True once the turn moved to the fallback model because its own model's circuit was open
+        self.fallback = False
+        # build
+        self.api_type = None
+        self.system_prompts: List[Dict[str, str]] = []
+        self.inference_config: Dict[str, Any] = {}
+        self.model_messages: List[Dict[str, Any]] = []
+        # invoke
+        self.chunks = None
+        self.attempts = 0
+        self.invoke_started = 0.0
+        self.metrics: Dict[str, Any] = {}
+        # The breaker whose half-open trial permit the turn holds until it records an outcome or releases it
+        self.trial_breaker: Optional[CircuitBreaker] = None
+        # True if a hedge request was sent (see ChatPipeline._hedge)
+        self.hedged = False
+        # parse
+        self.reply = ""
+        self.first_chunk_ms: Optional[float] = None
+
+    @property
+    def error(self) -> Optional[str]:
+        return self.metrics.get("error")
+
+
+class ChatPipeline:
+    """Runs chatbot turns through the context, config, build, invoke, parse and track stages."""
+
+    def __init__(self, ld_client, bedrock_client, conversation_store, context_builder, metrics_tracker,
+                 create_context: Callable[[str], Any], retry_policy: Optional[RetryPolicy] = None,
+                 breakers: Optional[CircuitBreakerRegistry] = None, hedge_after_ms: Optional[float] = None,
+                 hedge_model_id: Optional[str] = None):
+        """
+        Initialize the pipeline.
+
+        Args:
+            ld_client: LaunchDarklyClient used for flags and the AI Config
+            bedrock_client: BedrockClient that streams the model's reply, or None without AWS
+            conversation_store: ConversationStore for server-side conversations
+            context_builder: ContextWindowBuilder that fits the history into the token budget
+            metrics_tracker: BedrockMetricsTracker for stream metrics and request phases
+            create_context: Builds the LaunchDarkly context for a user ID
+            retry_policy: Retry and deadline policy, defaults to one configured from the environment
+            breakers: Per-model circuit breakers, defaults to ones configured from the environment
+            hedge_after_ms: Time to first chunk after which a hedge request is sent; defaults to
+                CHAT_HEDGE_AFTER_MS, and 0 turns hedging off
+            hedge_model_id: Model for hedge requests, defaults to CHAT_HEDGE_MODEL_ID or the
+                fallback AI Config's model
+        """
+        self.ld_client = ld_client
+        self.bedrock_client = bedrock_client
+        self.conversation_store = conversation_store
+        self.context_builder = context_builder
+        self.metrics_tracker = metrics_tracker
+        self.create_context = create_context
+        self.retry_policy = retry_policy or RetryPolicy.from_env()
+        self.breakers = breakers or CircuitBreakerRegistry.from_env()
+        if hedge_after_ms is None:
+            hedge_after_ms = float(os.getenv("CHAT_HEDGE_AFTER_MS", "0"))
+        self.hedge_after_ms = hedge_after_ms
+        self.hedge_model_id = hedge_model_id or os.getenv("CHAT_HEDGE_MODEL_ID") or None
+        self.turns = 0
+        self.retries = 0
+        self.deadline_exceeded = 0
+        self.fallbacks = 0
+        self.hedges = 0
+        self.hedge_wins = 0
+
+    # Stages
+
+    def context(self, turn: ChatTurn) -> None:
+        """
+        Build the user context and evaluate the chatbot flags; if the chatbot
+        is enabled, resolve the conversation and the message being answered.
+
+        Clients that send just the new message (with the conversationId from
+        the previous reply) keep their history on the server; clients that
+        send the whole messages array are handled statelessly.
+        """
+        self.turns += 1
+        turn.user_context = self.create_context(turn.user_id)
+        logger.debug("Created user context: %s, anonymous: %s", turn.user_context.key, turn.user_context.anonymous)
+
+        ld = self.ld_client.ld_client
+        turn.enabled = ld.variation('guru-guide-ai-enabled', turn.user_context, True)
+        logger.debug("Chatbot enabled: %s", turn.enabled)
+        if not turn.enabled:
+            turn.timer.mark("context")
+            return
+        # Repeated questions may be answered from the response cache unless the flag opts out
+        turn.use_cache = ld.variation('chatbot-response-cache', turn.user_context, True)
+
+        if turn.message:
+            turn.conversation = self.conversation_store.get_or_create(turn.conversation_id, turn.messages)
+            turn.user_message = str(turn.message)
+            # The message is stored together with its reply (see remember_reply)
+            turn.messages = self.context_builder.build_from_conversation(
+                turn.conversation, pending=turn.user_message
+            )
+        else:
+            for msg in turn.messages:
+                if msg.get("role") == "user":
+                    turn.user_message = msg.get("content")
+                    break
+        logger.debug("Extracted user message: %s", turn.user_message)
+        turn.timer.mark("context")
+
+    def config(self, turn: ChatTurn) -> None:
+        """Evaluate the AI Config once for the turn."""
+        variables = {
+            "user_input": turn.user_message,
+            "conversation_history": turn.messages
+        }
+        logger.debug("Getting AI config from LaunchDarkly with variables: %s", LazyJson(variables))
+        turn.config, turn.tracker = self.ld_client.get_ai_config(turn.user_context, variables)
+        turn.model_id = turn.config.model.name
+        logger.info("Using model ID: %s", turn.model_id)
+        turn.timer.mark("config")
+
+    def build(self, turn: ChatTurn) -> None:
+        """Build the system prompts, inference parameters and model-specific messages."""
+        turn.inference_config = self._inference_config(turn.config)
+        logger.debug("Inference config: %s", LazyJson(turn.inference_config))
+
+        turn.system_prompts = [
+            {"text": msg.content} for msg in turn.config.messages or [] if msg.role == "system"
+        ]
+        if not turn.system_prompts:
+            turn.system_prompts = [{"text": DEFAULT_SYSTEM_PROMPT}]
+            logger.debug("No system prompt found. Using the default")
+
+        turn.api_type, turn.model_messages = self._format_messages(turn, turn.model_id)
+        logger.debug("Formatted %s messages for %s", len(turn.model_messages), turn.model_id)
+        turn.timer.mark("build")
+
+    def invoke(self, turn: ChatTurn) -> None:
+        """
+        Start the model stream, retrying transient errors within the deadline.
+
+        Only starting the stream is retried; once chunks flow the reply is
+        committed, so errors after that end the stream (see track).
+
+        If the model's circuit is open the turn moves to the fallback model,
+        and if hedging is on a slow first chunk is raced against the hedge
+        model (see _hedge).
+
+        Raises:
+            CircuitOpenError: If the circuit of both the model and the fallback model is open
+            EngineSaturatedError: If the model's wait queue is full
+            DeadlineExceededError: If the stream did not start within the deadline
+            Exception: The model's error, once it is not retryable or the attempts are used up
+        """
+        policy = self.retry_policy
+        breaker = self.breakers.get(turn.model_id)
+        turn.invoke_started = time.time()
+        deadline = time.monotonic() + policy.deadline
+
+        with turn.timer.phase("invoke"):
+            while True:
+                try:
+                    if breaker.before_call():
+                        turn.trial_breaker = breaker
+                except CircuitOpenError:
+                    if not self._use_fallback(turn):
+                        raise
+                    breaker = self.breakers.get(turn.model_id)
+                    continue
+                turn.attempts += 1
+                turn.metrics = {}
+                chunks = None
+                try:
+                    chunks = self.bedrock_client.submit_conversation(
+                        model_id=turn.model_id,
+                        messages=turn.model_messages,
+                        system_prompts=turn.system_prompts,
+                        inference_config=turn.inference_config,
+                        # Usage of another model is not reported to the AI Config's variation
+                        tracker=None if turn.fallback else turn.tracker,
+                        metrics=turn.metrics,
+                        use_cache=turn.use_cache
+                    )
+                    if not chunks.wait_until_ready(max(0.0, deadline - time.monotonic())):
+                        chunks.cancel()
+                        self.deadline_exceeded += 1
+                        raise DeadlineExceededError(
+                            f"Model {turn.model_id} did not start streaming within {policy.deadline}s"
+                        )
+                    turn.chunks = chunks
+                    break
+                except EngineSaturatedError:
+                    # Load shedding is not a model failure
+                    self.release(turn)
+                    raise
+                except Exception as e:
+                    if self._called_model(turn):
+                        self._record(turn, breaker, True)
+                    else:
+                        self.release(turn)
+                    if isinstance(e, DeadlineExceededError):
+                        raise
+                    delay = policy.delay(turn.attempts)
+                    if (not policy.is_retryable(e) or turn.attempts >= policy.max_attempts
+                            or time.monotonic() + delay >= deadline):
+                        raise
+                    self.retries += 1
+                    logger.warning("Attempt %s for %s failed (%s); retrying in %.2fs",
+                                   turn.attempts, turn.model_id, e, delay)
+                    time.sleep(delay)
+
+            if self.hedge_after_ms:
+                self._hedge(turn, deadline)
+
+    def parse(self, turn: ChatTurn) -> Iterator[str]:
+        """Yield the reply's chunks as the model streams them."""
+        completed = False
+        try:
+            with turn.timer.phase("parse"):
+                for chunk in turn.chunks:
+                    if turn.first_chunk_ms is None:
+                        turn.first_chunk_ms = (time.time() - turn.invoke_started) * 1000
+                    turn.reply += chunk
+                    yield chunk
+            completed = True
+        finally:
+            if not completed:
+                # The client went away; the reply says nothing about the model either way
+                self.release(turn)
+
+    def track(self, turn: ChatTurn) -> None:
+        """Record the turn's metrics and breaker outcome, and remember the reply."""
+        self.metrics_tracker.track_stream_metrics(
+            turn.model_id, turn.api_type, turn.invoke_started, (time.time() - turn.invoke_started) * 1000,
+            turn.metrics, messages=turn.model_messages, response_length=len(turn.reply)
+        )
+        if self._called_model(turn):
+            # The breaker judges latency by the time the user waited for the first chunk
+            self._record(turn, self.breakers.get(turn.model_id), bool(turn.error), turn.first_chunk_ms)
+        else:
+            self.release(turn)
+        if not turn.error:
+            self.remember_reply(turn, turn.reply)
+        logger.info("Response complete. Length: %s", len(turn.reply))
+        turn.timer.mark("track")
+        self.metrics_tracker.track_phases(turn.model_id, turn.api_type, turn.timer)
+
+    # Helpers
+
+    def prepare(self, turn: ChatTurn) -> None:
+        """Run the config, build and invoke stages, leaving the turn ready to parse."""
+        self.config(turn)
+        self.build(turn)
+        self.invoke(turn)
+
+    def release(self, turn: ChatTurn) -> None:
+        """
+        Give back the turn's half-open trial permit if no outcome was recorded for it.
+
+        Safe to call more than once; callers that may never reach track (a
+        streamed response the client closes before it starts, for instance)
+        call it when they are done with the turn.
+        """
+        if turn.trial_breaker is not None:
+            turn.trial_breaker.release()
+            turn.trial_breaker = None
+
+    def _record(self, turn: ChatTurn, breaker: CircuitBreaker, failed: bool,
+                latency_ms: Optional[float] = None) -> None:
+        breaker.record(failed, latency_ms)
+        if turn.trial_breaker is breaker:
+            turn.trial_breaker = None
+
+    def remember_reply(self, turn: ChatTurn, reply: str) -> None:
+        """Append the user's message and the reply to the turn's conversation, if it has one."""
+        if turn.conversation is not None and reply:
+            self.conversation_store.append_exchange(turn.conversation, turn.user_message, reply)
+
+    def _inference_config(self, config) -> Dict[str, Any]:
+        params = config.model._parameters
+        return {
+            "temperature": params.get("temperature", 0.7),
+            "maxTokens": params.get("max_tokens", 1000),
+            "topP": params.get("top_p", 0.9)
+        }
+
+    def _format_messages(self, turn: ChatTurn, model_id: str):
+        # Amazon models take Converse content blocks, Claude and others plain strings
+        if "amazon" in model_id.lower():
+            if turn.conversation is not None:
+                return "converse", self.context_builder.build_from_conversation(
+                    turn.conversation, "bedrock", pending=turn.user_message
+                )
+            return "converse", create_bedrock_message(turn.messages, turn.user_message, self.context_builder)
+        if turn.conversation is not None:
+            return "invoke", self.context_builder.build_from_conversation(
+                turn.conversation, "claude", pending=turn.user_message
+            )
+        return "invoke", create_claude_message(turn.messages, turn.user_message, self.context_builder)
+
+    def _use_fallback(self, turn: ChatTurn) -> bool:
+        """Move a turn to the fallback AI Config's model; False if it is already using it."""
+        fallback = self.ld_client.fallback_config
+        if turn.fallback or fallback.model.name == turn.model_id:
+            return False
+        logger.warning("Circuit open for %s, using fallback model %s", turn.model_id, fallback.model.name)
+        turn.fallback = True
+        turn.model_id = fallback.model.name
+        turn.inference_config = self._inference_config(fallback)
+        turn.api_type, turn.model_messages = self._format_messages(turn, turn.model_id)
+        self.fallbacks += 1
+        return True
+
+    def _hedge(self, turn: ChatTurn, deadline: float) -> None:
+        """
+        Race a hedge model against a stream that has not produced its first chunk in time.
+
+        Whichever stream produces a chunk first becomes the turn's stream and
+        the other is cancelled. Nothing happens if the first chunk arrives
+        within CHAT_HEDGE_AFTER_MS, the answer was cached or coalesced, or
+        the hedge model is the turn's model or its circuit is open.
+        """
+        hedge_model_id = self.hedge_model_id or self.ld_client.fallback_config.model.name
+        primary = turn.chunks
+        if hedge_model_id == turn.model_id or not self._called_model(turn):
+            return
+        if primary.wait_for_first_chunk(self.hedge_after_ms / 1000):
+            return
+
+        hedge_breaker = self.breakers.get(hedge_model_id)
+        try:
+            # The hedge's trial permit, if it gets one, is its own, not the turn's
+            hedge_trial = hedge_breaker.before_call()
+        except CircuitOpenError:
+            return
+        api_type, messages = self._format_messages(turn, hedge_model_id)
+        metrics: Dict[str, Any] = {}
+        try:
+            hedge = self.bedrock_client.submit_conversation(
+                model_id=hedge_model_id,
+                messages=messages,
+                system_prompts=turn.system_prompts,
+                inference_config=turn.inference_config,
+                metrics=metrics,
+                use_cache=turn.use_cache
+            )
+        except Exception as e:
+            if hedge_trial:
+                hedge_breaker.release()
+            logger.warning("Could not send hedge request to %s: %s", hedge_model_id, e)
+            return
+        self.hedges += 1
+        turn.hedged = True
+        logger.info("No first chunk from %s after %sms, hedging with %s",
+                    turn.model_id, self.hedge_after_ms, hedge_model_id)
+
+        while time.monotonic() < deadline:
+            if primary.wait_for_first_chunk(HEDGE_POLL_SECONDS):
+                break
+            if not hedge.wait_for_first_chunk(0):
+                continue
+            try:
+                hedge.wait_until_ready(0)
+            except Exception as e:
+                metrics["error"] = str(e)
+            if metrics.get("error"):
+                # The hedge failed before streaming anything; keep waiting on the primary
+                if metrics.get("cache") != "hit" and not metrics.get("coalesced"):
+                    hedge_breaker.record_failure()
+                elif hedge_trial:
+                    hedge_breaker.release()
+                return
+
+            # The hedge streamed first. The primary's first chunk is at least as late as
+            # the wait so far, which is recorded as its latency towards the slow-call rate
+            primary.cancel()
+            self._record(turn, self.breakers.get(turn.model_id), False,
+                         (time.time() - turn.invoke_started) * 1000)
+            self.hedge_wins += 1
+            turn.chunks = hedge
+            turn.metrics = metrics
+            turn.model_id = hedge_model_id
+            turn.api_type = api_type
+            turn.model_messages = messages
+            # track records the hedge's outcome, or releases its permit if it was cached or coalesced
+            turn.trial_breaker = hedge_breaker if hedge_trial else None
+            return
+
+        # The primary won or time ran out: the hedge was cancelled, so its outcome says nothing
+        hedge.cancel()
+        if hedge_trial:
+            hedge_breaker.release()
+
+    def _called_model(self, turn: ChatTurn) -> bool:
+        # Cached and coalesced answers say nothing about the model's health
+        return turn.metrics.get("cache") != "hit" and not turn.metrics.get("coalesced")
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get turn, retry and deadline counters and the circuit breakers' states."""
+        return {
+            "turns": self.turns,
+            "retries": self.retries,
+            "deadline_exceeded": self.deadline_exceeded,
+            "fallbacks": self.fallbacks,
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "hedge_after_ms": self.hedge_after_ms or None,
+            "max_attempts": self.retry_policy.max_attempts,
+            "deadline_seconds": self.retry_policy.deadline,
+            "circuit_breakers": self.breakers.get_stats()
+        }
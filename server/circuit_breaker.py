@@ -0,0 +1,227 @@
+"""
+Per-Model Circuit Breakers
+
+This module stops the chatbot from sending requests to a model that is
+failing or too slow. Each model ID gets a breaker that keeps the outcome
+and latency of its recent calls in a sliding time window. Once the window
+holds enough calls and either the share of failed calls or the share of
+slow calls crosses its threshold, the breaker opens; while it is open,
+requests for that model fail immediately with CircuitOpenError (and the
+chat pipeline moves them to the fallback model) instead of waiting on it.
+After a cool-down one trial request is let through (half-open): if it
+succeeds quickly the breaker closes again, otherwise it re-opens. A trial
+whose outcome is never recorded or released gives up its permit after a
+timeout, so a lost trial cannot keep the circuit half-open for good.
+"""
+
+import logging
+import math
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised when a model's circuit is open and calls to it are being refused."""
+
+    def __init__(self, model_id: str, retry_after: int):
+        super().__init__(f"Circuit open for model {model_id}")
+        self.model_id = model_id
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """Tracks one model's recent error rate and latency and decides whether calls may go through."""
+
+    def __init__(self, model_id: str, window_seconds: float = 60.0, min_calls: int = 10,
+                 error_rate: float = 0.5, slow_call_ms: float = 10000.0, slow_call_rate: float = 0.5,
+                 reset_timeout: float = 30.0, trial_timeout: float = 60.0):
+        """
+        Initialize the breaker.
+
+        Args:
+            model_id: The model this breaker protects
+            window_seconds: How far back calls are counted
+            min_calls: Calls the window must hold before the breaker may open
+            error_rate: Share of failed calls (0-1) that opens the circuit
+            slow_call_ms: Latency above which a call counts as slow
+            slow_call_rate: Share of slow calls (0-1) that opens the circuit
+            reset_timeout: Seconds the circuit stays open before a trial call
+            trial_timeout: Seconds after which an unfinished trial call's permit is given to another call
+        """
+        self.model_id = model_id
+        self.window_seconds = window_seconds
+        self.min_calls = max(1, min_calls)
+        self.error_rate = error_rate
+        self.slow_call_ms = slow_call_ms
+        self.slow_call_rate = slow_call_rate
+        self.reset_timeout = reset_timeout
+        self.trial_timeout = trial_timeout
+        self.state = STATE_CLOSED
+        self.opened_at = 0.0
+        self.trial_in_flight = False
+        self.trial_started = 0.0
+        # (monotonic time, failed, slow) for each call in the window
+        self._calls: Deque[Tuple[float, bool, bool]] = deque()
+        self._failed = 0
+        self._slow = 0
+        self.successes = 0
+        self.failures = 0
+        self.rejected = 0
+        self.times_opened = 0
+        self._lock = threading.Lock()
+
+    def before_call(self) -> bool:
+        """
+        Check that a call may go through.
+
+        Returns:
+            bool: True if the call is the half-open trial; its caller must then record
+            its outcome or release the permit
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with its trial call in flight
+        """
+        with self._lock:
+            if self.state == STATE_CLOSED:
+                return False
+            now = time.monotonic()
+            remaining = self.opened_at + self.reset_timeout - now
+            if self.state == STATE_OPEN and remaining <= 0:
+                self.state = STATE_HALF_OPEN
+            if self.state == STATE_HALF_OPEN and self.trial_in_flight and now - self.trial_started > self.trial_timeout:
+                logger.warning("Trial call for %s did not finish within %ss, allowing another",
+                               self.model_id, self.trial_timeout)
+                self.trial_in_flight = False
+            if self.state == STATE_HALF_OPEN and not self.trial_in_flight:
+                self.trial_in_flight = True
+                self.trial_started = now
+                return True
+            self.rejected += 1
+            raise CircuitOpenError(self.model_id, max(1, math.ceil(remaining)))
+
+    def release(self) -> None:
+        """End a call that was let through without recording an outcome for it."""
+        with self._lock:
+            self.trial_in_flight = False
+
+    def _expire_locked(self, now: float) -> None:
+        while self._calls and self._calls[0][0] <= now - self.window_seconds:
+            _, failed, slow = self._calls.popleft()
+            self._failed -= failed
+            self._slow -= slow
+
+    def _open_locked(self, now: float) -> None:
+        if self.state != STATE_OPEN:
+            self.times_opened += 1
+        self.state = STATE_OPEN
+        self.opened_at = now
+        # Judge the model afresh once the circuit closes again
+        self._calls.clear()
+        self._failed = self._slow = 0
+
+    def record(self, failed: bool, latency_ms: Optional[float] = None) -> None:
+        """
+        Record the outcome of a call and open or close the circuit accordingly.
+
+        Args:
+            failed: Whether the call failed
+            latency_ms: How long the caller waited for the model, if known
+        """
+        slow = latency_ms is not None and latency_ms > self.slow_call_ms
+        now = time.monotonic()
+        with self._lock:
+            if failed:
+                self.failures += 1
+            else:
+                self.successes += 1
+            self.trial_in_flight = False
+
+            if self.state == STATE_HALF_OPEN:
+                if failed or slow:
+                    self._open_locked(now)
+                else:
+                    self.state = STATE_CLOSED
+                return
+
+            self._calls.append((now, failed, slow))
+            self._failed += failed
+            self._slow += slow
+            self._expire_locked(now)
+            calls = len(self._calls)
+            if self.state == STATE_CLOSED and calls >= self.min_calls and (
+                    self._failed / calls >= self.error_rate or self._slow / calls >= self.slow_call_rate):
+                self._open_locked(now)
+
+    def record_success(self, latency_ms: Optional[float] = None) -> None:
+        self.record(False, latency_ms)
+
+    def record_failure(self, latency_ms: Optional[float] = None) -> None:
+        self.record(True, latency_ms)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the breaker's state, window rates and call counters."""
+        with self._lock:
+            self._expire_locked(time.monotonic())
+            calls = len(self._calls)
+            return {
+                "state": self.state,
+                "window_calls": calls,
+                "error_rate": round(self._failed / calls * 100, 2) if calls else 0,
+                "slow_call_rate": round(self._slow / calls * 100, 2) if calls else 0,
+                "successes": self.successes,
+                "failures": self.failures,
+                "rejected": self.rejected,
+                "times_opened": self.times_opened
+            }
+
+
+class CircuitBreakerRegistry:
+    """Circuit breakers by model ID, created on first use with the same settings."""
+
+    def __init__(self, **settings):
+        """
+        Initialize the registry.
+
+        Args:
+            settings: Keyword arguments for each CircuitBreaker (window_seconds, min_calls, ...)
+        """
+        self.settings = settings
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> "CircuitBreakerRegistry":
+        """Create a registry configured from the CIRCUIT_* environment variables."""
+        return cls(
+            window_seconds=float(os.getenv("CIRCUIT_WINDOW_SECONDS", "60")),
+            min_calls=int(os.getenv("CIRCUIT_MIN_CALLS", "10")),
+            error_rate=float(os.getenv("CIRCUIT_ERROR_RATE", "0.5")),
+            slow_call_ms=float(os.getenv("CIRCUIT_SLOW_CALL_MS", "10000")),
+            slow_call_rate=float(os.getenv("CIRCUIT_SLOW_CALL_RATE", "0.5")),
+            reset_timeout=float(os.getenv("CIRCUIT_RESET_SECONDS", "30")),
+            trial_timeout=float(os.getenv("CIRCUIT_TRIAL_TIMEOUT_SECONDS", "60"))
+        )
+
+    def get(self, model_id: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(model_id)
+            if breaker is None:
+                breaker = CircuitBreaker(model_id, **self.settings)
+                self._breakers[model_id] = breaker
+            return breaker
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get every breaker's stats, by model ID."""
+        with self._lock:
+            breakers = list(self._breakers.items())
+        return {model_id: breaker.get_stats() for model_id, breaker in breakers}
@@ -0,0 +1,196 @@
+"""
+Token-Budget Context Windows
+
+This module decides how much chatbot history is sent to the model. Instead
+of a fixed number of messages, it fills an input-token budget from the
+newest message backwards, using a cheap per-message token estimate that
+conversations compute once when a message is added. Older turns that do
+not fit are either dropped or folded into a short extractive summary
+prepended to the first kept user message, so input size (and with it cost
+and latency) stays bounded however long the conversation gets.
+"""
+
+import re
+from typing import Any, Dict, List, Optional, Sequence
+
+# Roughly four characters per token, as in the metrics tracker's estimates
+CHARS_PER_TOKEN = 4
+
+# Tokens added per message for role and formatting
+MESSAGE_OVERHEAD_TOKENS = 4
+
+POLICY_DROP = "drop"
+POLICY_SUMMARIZE = "summarize"
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:"
+
+_FIRST_SENTENCE = re.compile(r"^(.+?[.!?])(\s|$)", re.DOTALL)
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimate the number of tokens a message's text costs, including overhead."""
+    return len(text) // CHARS_PER_TOKEN + MESSAGE_OVERHEAD_TOKENS
+
+
+def format_message(role: str, content: str, fmt: str) -> Dict[str, Any]:
+    """Format a message for "raw"/"claude" ({role, content}) or "bedrock" (content blocks)."""
+    if fmt == "bedrock":
+        return {"role": role, "content": [{"text": content}]}
+    return {"role": role, "content": content}
+
+
+class ContextWindowBuilder:
+    """Selects the history that fits an input-token budget."""
+
+    def __init__(self, input_token_budget: int = 4000, policy: str = POLICY_DROP,
+                 summary_token_budget: int = 200):
+        """
+        Initialize the builder.
+
+        Args:
+            input_token_budget: Estimated tokens of history (including the new prompt) to send
+            policy: "drop" to leave out older turns, "summarize" to fold them into a summary
+            summary_token_budget: Tokens reserved for the summary when older turns are left out
+        """
+        if policy not in (POLICY_DROP, POLICY_SUMMARIZE):
+            raise ValueError(f"Unknown context policy {policy!r}")
+        self.input_token_budget = input_token_budget
+        self.policy = policy
+        self.summary_token_budget = summary_token_budget
+        self.windows = 0
+        self.truncated = 0
+
+    def select(self, roles: Sequence[str], token_counts: Sequence[int]) -> int:
+        """
+        Find where the window starts.
+
+        The newest message is always included; older ones are added while
+        they fit the budget, and the window is then moved forward until it
+        starts with a user message, as the model APIs require.
+
+        Returns:
+            int: Index of the first message in the window
+        """
+        budget = self.input_token_budget
+        if self.policy == POLICY_SUMMARIZE and sum(token_counts) > budget:
+            budget -= self.summary_token_budget
+
+        start = len(token_counts)
+        used = 0
+        while start > 0:
+            cost = token_counts[start - 1]
+            if used + cost > budget and start < len(token_counts):
+                break
+            used += cost
+            start -= 1
+
+        while start < len(roles) - 1 and roles[start] != "user":
+            start += 1
+
+        self.windows += 1
+        if start > 0:
+            self.truncated += 1
+        return start
+
+    def summarize(self, messages: Sequence[Dict[str, Any]]) -> Optional[str]:
+        """
+        Build an extractive summary of left-out messages within the summary budget.
+
+        Takes the first sentence of each message, newest turns first, so
+        the most recent context survives when the budget runs out.
+
+        Returns:
+            str or None: The summary text, or None if there is nothing to summarize
+        """
+        max_chars = self.summary_token_budget * CHARS_PER_TOKEN - len(SUMMARY_PREFIX)
+        lines: List[str] = []
+        used = 0
+        for msg in reversed(messages):
+            content = " ".join(str(msg.get("content", "")).split())
+            if not content:
+                continue
+            match = _FIRST_SENTENCE.match(content)
+            sentence = (match.group(1) if match else content)[:160]
+            line = f"- {msg.get('role', 'user')}: {sentence}"
+            if used + len(line) + 1 > max_chars:
+                break
+            lines.append(line)
+            used += len(line) + 1
+        if not lines:
+            return None
+        return "\n".join([SUMMARY_PREFIX] + lines[::-1])
+
+    def _with_summary(self, window: List[Dict[str, Any]], summary: Optional[str], fmt: str) -> List[Dict[str, Any]]:
+        # The summary is merged into the first (user) message rather than sent as
+        # its own message, so user and assistant turns keep alternating
+        if not summary or not window:
+            return window
+        first = window[0]
+        if fmt == "bedrock":
+            merged = {"role": first["role"], "content": [{"text": summary}] + list(first["content"])}
+        else:
+            merged = {"role": first["role"], "content": f"{summary}\n\n{first['content']}"}
+        return [merged] + window[1:]
+
+    def build(self, history: Sequence[Dict[str, Any]], fmt: str = "raw") -> List[Dict[str, Any]]:
+        """
+        Build the window for {"role", "content"} messages that are not pre-formatted.
+
+        System messages are skipped (system prompts are sent separately) and
+        any role other than "user" is sent as "assistant".
+
+        Args:
+            history: The messages, oldest first, ending with the new prompt
+            fmt: "raw", "claude" or "bedrock"
+
+        Returns:
+            list: The formatted messages to send
+        """
+        messages = [
+            ("user" if msg.get("role") == "user" else "assistant", str(msg.get("content", "")))
+            for msg in history if msg.get("role") != "system"
+        ]
+        start = self.select([role for role, _ in messages], [estimate_tokens(content) for _, content in messages])
+        window = [format_message(role, content, fmt) for role, content in messages[start:]]
+        if self.policy == POLICY_SUMMARIZE and start > 0:
+            summary = self.summarize([{"role": role, "content": content} for role, content in messages[:start]])
+            window = self._with_summary(window, summary, fmt)
+        return window
+
+    def build_from_conversation(self, conversation, fmt: str = "raw",
+                                pending: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Build the window from a stored conversation's pre-formatted messages
+        and cached token estimates.
+
+        Args:
+            conversation: A conversation_store.Conversation
+            fmt: "raw", "claude" or "bedrock"
+            pending: A new user message to send after the stored ones, not stored yet
+
+        Returns:
+            list: The formatted messages to send
+        """
+        with conversation.lock:
+            raw = list(conversation.messages["raw"])
+            formatted = list(conversation.messages[fmt])
+            token_counts = list(conversation.token_counts)
+        if pending is not None:
+            raw.append(format_message("user", pending, "raw"))
+            formatted.append(format_message("user", pending, fmt))
+            token_counts.append(estimate_tokens(pending))
+
+        start = self.select([msg["role"] for msg in raw], token_counts)
+        window = formatted[start:]
+        if self.policy == POLICY_SUMMARIZE and start > 0:
+            window = self._with_summary(window, self.summarize(raw[:start]), fmt)
+        return window
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the budget, policy and how often history had to be cut."""
+        return {
+            "input_token_budget": self.input_token_budget,
+            "policy": self.policy,
+            "windows": self.windows,
+            "truncated": self.truncated
+        }
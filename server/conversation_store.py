@@ -0,0 +1,190 @@
+"""
+Conversation Session Store
+
+This module keeps chatbot conversations on the server, keyed by a
+conversation ID, so clients only send the new message on each turn. Every
+message is formatted once, when it is appended, into the Bedrock (Amazon
+Converse) and Claude message shapes and gets a cached token estimate, so
+requests take their context window (see context_window) from the already
+formatted lists instead of rebuilding it from the whole history.
+
+Conversations are evicted least-recently-used first when the store is over
+its session count or memory budget, and expire after a period without use.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+from context_window import estimate_tokens, format_message
+
+# Message formats kept for each conversation
+FORMATS = ("raw", "bedrock", "claude")
+
+# Rough per-message bookkeeping overhead, added to the text length when estimating memory
+MESSAGE_OVERHEAD_BYTES = 240
+
+
+class Conversation:
+    """One conversation's messages, pre-formatted for each model API."""
+
+    def __init__(self, conversation_id: str, max_messages: int):
+        self.id = conversation_id
+        self.max_messages = max_messages
+        self.messages: Dict[str, List[Dict[str, Any]]] = {fmt: [] for fmt in FORMATS}
+        self.token_counts: List[int] = []
+        self.size_bytes = 0
+        self.last_access = time.monotonic()
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.messages["raw"])
+
+    def _append_locked(self, role: str, content: str) -> int:
+        role = "user" if role == "user" else "assistant"
+        for fmt in FORMATS:
+            self.messages[fmt].append(format_message(role, content, fmt))
+        self.token_counts.append(estimate_tokens(content))
+        delta = len(content) + MESSAGE_OVERHEAD_BYTES
+
+        # Drop the oldest messages beyond the per-conversation limit
+        while len(self.messages["raw"]) > self.max_messages:
+            dropped = self.messages["raw"][0]["content"]
+            for fmt in FORMATS:
+                del self.messages[fmt][0]
+            del self.token_counts[0]
+            delta -= len(dropped) + MESSAGE_OVERHEAD_BYTES
+
+        self.size_bytes += delta
+        return delta
+
+
+class ConversationStore:
+    """Conversations by ID with LRU/TTL eviction and a memory budget."""
+
+    def __init__(self, max_conversations: int = 10000, ttl: float = 1800.0,
+                 max_bytes: int = 64 * 1024 * 1024, max_messages: int = 50):
+        """
+        Initialize the store.
+
+        Args:
+            max_conversations: Maximum number of conversations kept
+            ttl: Seconds a conversation is kept after its last use
+            max_bytes: Approximate memory budget for all conversation text
+            max_messages: Maximum messages kept per conversation; older ones are dropped
+        """
+        self.max_conversations = max_conversations
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.max_messages = max_messages
+
+        self._conversations: "OrderedDict[str, Conversation]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.total_bytes = 0
+        self.created = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, conversation_id: str) -> Optional[Conversation]:
+        """Return the conversation if it exists and has not expired."""
+        now = time.monotonic()
+        with self._lock:
+            conversation = self._conversations.get(conversation_id)
+            if conversation is None:
+                self.misses += 1
+                return None
+            if now - conversation.last_access > self.ttl:
+                self._remove_locked(conversation_id)
+                self.expirations += 1
+                self.misses += 1
+                return None
+            conversation.last_access = now
+            self._conversations.move_to_end(conversation_id)
+            self.hits += 1
+            return conversation
+
+    def create(self, history: Optional[List[Dict[str, Any]]] = None) -> Conversation:
+        """
+        Start a conversation under a new ID, optionally seeded with earlier messages.
+
+        Args:
+            history: Earlier {"role", "content"} messages; system messages are skipped
+
+        Returns:
+            Conversation: The new conversation
+        """
+        conversation = Conversation(uuid.uuid4().hex, self.max_messages)
+        with conversation.lock:
+            for msg in history or []:
+                if msg.get("role") != "system" and msg.get("content"):
+                    conversation._append_locked(msg["role"], str(msg["content"]))
+
+        with self._lock:
+            self._conversations[conversation.id] = conversation
+            self.total_bytes += conversation.size_bytes
+            self.created += 1
+            self._evict_locked()
+        return conversation
+
+    def get_or_create(self, conversation_id: Optional[str],
+                      history: Optional[List[Dict[str, Any]]] = None) -> Conversation:
+        """
+        Return the conversation for an ID, or start a new one seeded with
+        history if the ID is missing, unknown or expired. The caller should
+        use the returned conversation's ID from then on.
+        """
+        conversation = self.get(conversation_id) if conversation_id else None
+        return conversation or self.create(history)
+
+    def append(self, conversation: Conversation, role: str, content: str) -> None:
+        """Append a message to a conversation and enforce the memory budget."""
+        with self._lock:
+            with conversation.lock:
+                delta = conversation._append_locked(role, content)
+            if self._conversations.get(conversation.id) is conversation:
+                self.total_bytes += delta
+                self._evict_locked()
+
+    def append_exchange(self, conversation: Conversation, user_message: str, reply: str) -> None:
+        """
+        Append a user message and the reply to it in one step, so a turn that
+        fails before replying leaves no unanswered user message behind.
+        """
+        with self._lock:
+            with conversation.lock:
+                delta = conversation._append_locked("user", user_message)
+                delta += conversation._append_locked("assistant", reply)
+            if self._conversations.get(conversation.id) is conversation:
+                self.total_bytes += delta
+                self._evict_locked()
+
+    def _remove_locked(self, conversation_id: str) -> None:
+        conversation = self._conversations.pop(conversation_id)
+        self.total_bytes -= conversation.size_bytes
+
+    def _evict_locked(self) -> None:
+        # Keep the most recently used conversation even if it alone exceeds the budget
+        while len(self._conversations) > 1 and (
+                len(self._conversations) > self.max_conversations or self.total_bytes > self.max_bytes):
+            oldest = next(iter(self._conversations))
+            self._remove_locked(oldest)
+            self.evictions += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get conversation counts, memory use and hit/eviction counters."""
+        with self._lock:
+            return {
+                "conversations": len(self._conversations),
+                "max_conversations": self.max_conversations,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "created": self.created,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations
+            }
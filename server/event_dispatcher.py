@@ -0,0 +1,145 @@
+"""
+Background Event Dispatcher
+
+This module moves LaunchDarkly event delivery (page views, service clicks
+and chatbot feedback) off the request path. Handlers queue a call and
+return; a single worker thread drains the queue in batches and makes the
+calls. The queue is bounded, so if delivery falls behind new events are
+dropped and counted rather than slowing requests down, and whatever is
+queued is delivered when the dispatcher is closed at shutdown.
+"""
+
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# (function, args, kwargs) for one queued call
+QueuedCall = Tuple[Callable[..., Any], tuple, dict]
+
+
+class EventDispatcher:
+    """Bounded queue of tracking calls delivered in batches by a worker thread."""
+
+    def __init__(self, max_queue: int = 10000, batch_size: int = 100):
+        """
+        Initialize the dispatcher and start its worker.
+
+        Args:
+            max_queue: Maximum number of queued calls; further calls are dropped
+            batch_size: Maximum number of calls delivered per batch
+        """
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+
+        self._queue: "queue.Queue[Optional[QueuedCall]]" = queue.Queue(maxsize=max_queue)
+        self._lock = threading.Lock()
+        self._closed = False
+        self.dispatched = 0
+        self.delivered = 0
+        self.failed = 0
+        self.dropped = 0
+        self.batches = 0
+
+        self._thread = threading.Thread(target=self._run, name="event-dispatcher", daemon=True)
+        self._thread.start()
+
+    def dispatch(self, fn: Callable[..., Any], *args, **kwargs) -> bool:
+        """
+        Queue fn(*args, **kwargs) for delivery by the worker.
+
+        Returns:
+            bool: False if the call was dropped because the queue is full or closed
+        """
+        with self._lock:
+            if self._closed:
+                self.dropped += 1
+                return False
+            try:
+                self._queue.put_nowait((fn, args, kwargs))
+            except queue.Full:
+                self.dropped += 1
+                logger.warning("Event queue full (%s), dropping %s", self.max_queue, getattr(fn, '__name__', fn))
+                return False
+            self.dispatched += 1
+        return True
+
+    def _deliver(self, batch) -> None:
+        delivered = failed = 0
+        for fn, args, kwargs in batch:
+            try:
+                fn(*args, **kwargs)
+                delivered += 1
+            except Exception as e:
+                failed += 1
+                logger.error("Error delivering event %s: %s", getattr(fn, '__name__', fn), e)
+        with self._lock:
+            self.delivered += delivered
+            self.failed += failed
+            self.batches += 1
+        for _ in batch:
+            self._queue.task_done()
+
+    def _run(self) -> None:
+        while True:
+            item = self._queue.get()
+            batch = []
+            stop = item is None
+            if not stop:
+                batch.append(item)
+            while not stop and len(batch) < self.batch_size:
+                try:
+                    item = self._queue.get_nowait()
+                except queue.Empty:
+                    break
+                if item is None:
+                    stop = True
+                else:
+                    batch.append(item)
+
+            if batch:
+                self._deliver(batch)
+            if stop:
+                self._queue.task_done()
+                return
+
+    def flush(self) -> None:
+        """Block until every queued call has been delivered."""
+        self._queue.join()
+
+    def close(self, timeout: float = 5.0) -> None:
+        """
+        Stop accepting calls and deliver the ones already queued.
+
+        Args:
+            timeout: Maximum seconds to wait for the queue to drain
+        """
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+
+        deadline = time.monotonic() + timeout
+        try:
+            self._queue.put(None, timeout=timeout)
+        except queue.Full:
+            logger.warning("Event dispatcher did not drain within %ss", timeout)
+            return
+        self._thread.join(max(0.0, deadline - time.monotonic()))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get queue depth and delivery, failure and drop counters."""
+        with self._lock:
+            return {
+                "queued": self._queue.qsize(),
+                "max_queue": self.max_queue,
+                "dispatched": self.dispatched,
+                "delivered": self.delivered,
+                "failed": self.failed,
+                "dropped": self.dropped,
+                "batches": self.batches
+            }
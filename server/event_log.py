@@ -0,0 +1,460 @@
+"""
+Durable Append-Only Event Log
+
+This module provides a segmented, append-only log on local disk for the
+analytics events (views, clicks and chatbot feedback) so they survive a
+restart. Records use a compact length-prefixed binary format with the
+timestamp, event type, variation and user in a fixed header, followed by
+any remaining fields as JSON. Reads go through mmap-backed segments, so
+aggregations can walk the headers without building Python dicts.
+
+Writes are buffered and fsync'd in batches by a background thread. The
+active segment is rotated once it reaches a size limit, and sealed
+segments are periodically compacted into one, optionally dropping
+records older than a retention window.
+"""
+
+import json
+import logging
+import mmap
+import os
+import re
+import struct
+import threading
+import time
+import zlib
+from collections import Counter
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Record layout (little-endian):
+#   u32 body length, u32 crc32 of the body,
+#   body = f64 timestamp, u8 type length, u8 variation length, u16 user length,
+#          type bytes, variation bytes, user bytes, extras JSON bytes
+_PREFIX = struct.Struct("<II")
+_HEADER = struct.Struct("<dBBH")
+_HEADER_OFFSET = _PREFIX.size
+_MIN_RECORD = _PREFIX.size + _HEADER.size
+
+_SEGMENT_NAME = re.compile(r"^segment-(\d{8})\.log$")
+_COMPACTED_NAME = re.compile(r"^segment-(\d{8})-(\d{8})\.compacted$")
+
+# Fields stored in the record header; everything else goes into the extras JSON
+_HEADER_FIELDS = ("type", "variation", "userId", "timestamp")
+
+# Largest encoded size of each header field, set by the width of its length in the header
+FIELD_LIMITS = {"type": 0xFF, "variation": 0xFF, "userId": 0xFFFF}
+
+# (timestamp, type, variation, user, extras) as raw bytes
+RawRecord = Tuple[float, bytes, bytes, bytes, bytes]
+
+
+def _encode_field(event: Dict[str, Any], field: str) -> bytes:
+    value = event.get(field)
+    if value is None:
+        return b""
+    encoded = str(value).encode("utf-8")
+    if len(encoded) > FIELD_LIMITS[field]:
+        raise ValueError(f"'{field}' is longer than {FIELD_LIMITS[field]} bytes")
+    return encoded
+
+
+def _decode_field(value: bytes) -> Optional[str]:
+    # Records written before field lengths were validated may end in a split character
+    return value.decode("utf-8", errors="replace") or None
+
+
+def validate_event(event: Dict[str, Any]) -> None:
+    """
+    Check that an event's header fields fit in a log record.
+
+    Args:
+        event: The event fields
+
+    Raises:
+        ValueError: If the type, variation or userId is too long to encode
+    """
+    for field in FIELD_LIMITS:
+        _encode_field(event, field)
+
+
+def encode_record(timestamp: float, event: Dict[str, Any]) -> bytes:
+    """
+    Encode an event as a length-prefixed, checksummed log record.
+
+    Args:
+        timestamp: Unix timestamp of the event
+        event: The event fields
+
+    Returns:
+        bytes: The encoded record
+
+    Raises:
+        ValueError: If a header field is too long to encode (see validate_event)
+    """
+    event_type = _encode_field(event, "type")
+    variation = _encode_field(event, "variation")
+    user = _encode_field(event, "userId")
+    extras = {key: value for key, value in event.items() if key not in _HEADER_FIELDS}
+    extras_bytes = json.dumps(extras, default=str, separators=(",", ":")).encode("utf-8") if extras else b""
+
+    body = b"".join((
+        _HEADER.pack(timestamp, len(event_type), len(variation), len(user)),
+        event_type, variation, user, extras_bytes
+    ))
+    return _PREFIX.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_event(record: RawRecord) -> Tuple[float, Dict[str, Any]]:
+    """
+    Turn a raw record from EventLog.scan back into an event dict.
+
+    Args:
+        record: (timestamp, type, variation, user, extras) as yielded by scan
+
+    Returns:
+        tuple: (Unix timestamp, event dict)
+
+    Raises:
+        ValueError: If the extras are not a JSON object
+    """
+    timestamp, event_type, variation, user, extras = record
+    event = json.loads(bytes(extras).decode("utf-8", errors="replace")) if extras else {}
+    if not isinstance(event, dict):
+        raise ValueError("Record extras are not a JSON object")
+    event["type"] = _decode_field(event_type)
+    event["variation"] = _decode_field(variation)
+    event["userId"] = _decode_field(user)
+    return timestamp, event
+
+
+def _iter_records(buffer, size: int, verify: bool = False) -> Iterator[Tuple[int, RawRecord]]:
+    """Yield (end offset, record) for each complete record in buffer[:size]."""
+    offset = 0
+    while offset + _MIN_RECORD <= size:
+        length, crc = _PREFIX.unpack_from(buffer, offset)
+        end = offset + _PREFIX.size + length
+        if length < _HEADER.size or end > size:
+            return
+        body_start = offset + _PREFIX.size
+        if verify and zlib.crc32(buffer[body_start:end]) != crc:
+            return
+
+        timestamp, type_length, variation_length, user_length = _HEADER.unpack_from(buffer, body_start)
+        position = body_start + _HEADER.size
+        event_type = buffer[position:position + type_length]
+        position += type_length
+        variation = buffer[position:position + variation_length]
+        position += variation_length
+        user = buffer[position:position + user_length]
+        position += user_length
+        extras = buffer[position:end]
+
+        yield end, (timestamp, event_type, variation, user, extras)
+        offset = end
+
+
+class EventLog:
+    """
+    Segmented append-only log of analytics events.
+
+    Segments are files named segment-NNNNNNNN.log in the log directory.
+    Only the last one is written to; the others are sealed and immutable
+    until compaction merges them.
+    """
+
+    def __init__(self, directory: str, segment_max_bytes: int = 64 * 1024 * 1024,
+                 fsync_interval: float = 1.0, compact_after_segments: int = 8,
+                 retention_seconds: Optional[float] = None):
+        """
+        Open (or create) the log and start the background fsync thread.
+
+        Args:
+            directory: Directory holding the segment files
+            segment_max_bytes: Size at which the active segment is rotated
+            fsync_interval: Seconds between batched flush + fsync of pending writes
+            compact_after_segments: Compact once this many sealed segments accumulate
+            retention_seconds: Drop records older than this during compaction, or keep everything
+        """
+        self.directory = directory
+        self.segment_max_bytes = segment_max_bytes
+        self.fsync_interval = fsync_interval
+        self.compact_after_segments = compact_after_segments
+        self.retention_seconds = retention_seconds
+
+        self._lock = threading.RLock()
+        self._dirty = False
+        self._closed = False
+        self.records_written = 0
+        self.fsyncs = 0
+        self.compactions = 0
+
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._segments = self._list_segments()
+        if not self._segments:
+            self._segments = [1]
+        self._open_active()
+
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="event-log-fsync", daemon=True)
+        self._thread.start()
+
+    # Segment bookkeeping
+
+    def _path(self, number: int) -> str:
+        return os.path.join(self.directory, f"segment-{number:08d}.log")
+
+    def _list_segments(self) -> List[int]:
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = _SEGMENT_NAME.match(name)
+            if match:
+                numbers.append(int(match.group(1)))
+        return sorted(numbers)
+
+    def _recover(self) -> None:
+        """Finish or discard a compaction that was interrupted by a crash."""
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                os.remove(path)
+                continue
+            match = _COMPACTED_NAME.match(name)
+            if match:
+                first, last = int(match.group(1)), int(match.group(2))
+                for number in range(first, last + 1):
+                    if os.path.exists(self._path(number)):
+                        os.remove(self._path(number))
+                os.replace(path, self._path(first))
+                logger.info("Completed interrupted compaction of segments %s-%s", first, last)
+
+    def _open_active(self) -> None:
+        path = self._path(self._segments[-1])
+        # Drop a torn record left at the end of the active segment by a crash
+        valid_size = 0
+        if os.path.exists(path) and os.path.getsize(path) > 0:
+            with open(path, "rb") as f:
+                data = f.read()
+            for end, _ in _iter_records(data, len(data), verify=True):
+                valid_size = end
+            if valid_size < len(data):
+                logger.warning("Truncating %s bytes of incomplete records from %s", len(data) - valid_size, path)
+                with open(path, "r+b") as f:
+                    f.truncate(valid_size)
+        self._active = open(path, "ab")
+        self._active_size = valid_size
+
+    def _rotate(self) -> None:
+        # Callers must hold self._lock
+        self._active.flush()
+        os.fsync(self._active.fileno())
+        self._active.close()
+        self._segments.append(self._segments[-1] + 1)
+        self._active = open(self._path(self._segments[-1]), "ab")
+        self._active_size = 0
+        self._dirty = False
+
+    # Writing
+
+    def append(self, timestamp: float, event: Dict[str, Any]) -> None:
+        """Append one event to the log."""
+        self.append_many([(timestamp, event)])
+
+    def append_many(self, records: Iterable[Tuple[float, Dict[str, Any]]]) -> int:
+        """
+        Append (timestamp, event) pairs to the log.
+
+        The data reaches the OS on the next batched flush and disk on the
+        following fsync; call sync() to force both.
+
+        Returns:
+            int: Number of records appended
+        """
+        count = 0
+        with self._lock:
+            if self._closed:
+                raise ValueError("Event log is closed")
+            for timestamp, event in records:
+                record = encode_record(timestamp, event)
+                self._active.write(record)
+                self._active_size += len(record)
+                count += 1
+                if self._active_size >= self.segment_max_bytes:
+                    self._rotate()
+            if count:
+                self._dirty = True
+                self.records_written += count
+        return count
+
+    def sync(self) -> None:
+        """Flush buffered writes and fsync the active segment."""
+        with self._lock:
+            if self._closed or not self._dirty:
+                return
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._dirty = False
+            self.fsyncs += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.fsync_interval):
+            try:
+                self.sync()
+                if len(self._segments) - 1 >= self.compact_after_segments:
+                    self.compact()
+            except Exception as e:
+                logger.error("Error in event log maintenance: %s", e)
+
+    # Reading
+
+    def scan(self, since: Optional[float] = None, until: Optional[float] = None) -> Iterator[RawRecord]:
+        """
+        Iterate over the records in [since, until) through mmap'd segments.
+
+        Yields raw (timestamp, type, variation, user, extras) tuples of bytes
+        and floats; use decode_event to build a dict when one is needed.
+
+        The segment files are opened together under the lock, so a
+        compaction that runs while the scan is iterating removes or replaces
+        them only by name; the scan keeps reading the segments it started
+        with and sees every record exactly once.
+        """
+        files = []
+        with self._lock:
+            if not self._closed:
+                self._active.flush()
+            try:
+                for number in self._segments:
+                    files.append(open(self._path(number), "rb"))
+            except BaseException:
+                for f in files:
+                    f.close()
+                raise
+            active_size = self._active_size
+
+        try:
+            for index, f in enumerate(files):
+                size = os.fstat(f.fileno()).st_size
+                if index == len(files) - 1:
+                    size = min(size, active_size)
+                if size == 0:
+                    continue
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                    for _, record in _iter_records(mapped, size):
+                        timestamp = record[0]
+                        if since is not None and timestamp < since:
+                            continue
+                        if until is not None and timestamp >= until:
+                            continue
+                        yield record
+        finally:
+            for f in files:
+                f.close()
+
+    def count_by_variation(self, since: Optional[float] = None,
+                           until: Optional[float] = None) -> Counter:
+        """
+        Count records per (variation, event type) straight from the segments.
+
+        Returns:
+            Counter: {(variation, type): count} with names decoded once per key
+        """
+        raw_counts: Counter = Counter()
+        for _, event_type, variation, _, _ in self.scan(since, until):
+            raw_counts[(variation, event_type)] += 1
+        return Counter({
+            (_decode_field(variation), _decode_field(event_type)): count
+            for (variation, event_type), count in raw_counts.items()
+        })
+
+    # Compaction
+
+    def compact(self) -> int:
+        """
+        Merge all sealed segments into one, dropping records past retention.
+
+        The merged segment is written to a temporary file, fsync'd and
+        renamed into place, so an interrupted compaction is either finished
+        or discarded the next time the log is opened.
+
+        Returns:
+            int: Number of records dropped by retention
+        """
+        with self._lock:
+            sealed = list(self._segments[:-1])
+        if len(sealed) < 2 and not self.retention_seconds:
+            return 0
+        if not sealed:
+            return 0
+
+        cutoff = time.time() - self.retention_seconds if self.retention_seconds else None
+        first, last = sealed[0], sealed[-1]
+        tmp_path = os.path.join(self.directory, f"segment-{first:08d}-{last:08d}.tmp")
+        compacted_path = os.path.join(self.directory, f"segment-{first:08d}-{last:08d}.compacted")
+
+        kept = dropped = 0
+        with open(tmp_path, "wb") as out:
+            for number in sealed:
+                with open(self._path(number), "rb") as f:
+                    size = os.fstat(f.fileno()).st_size
+                    if size == 0:
+                        continue
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+                        offset = 0
+                        for end, record in _iter_records(mapped, size):
+                            if cutoff is not None and record[0] < cutoff:
+                                dropped += 1
+                            else:
+                                out.write(mapped[offset:end])
+                                kept += 1
+                            offset = end
+            out.flush()
+            os.fsync(out.fileno())
+
+        with self._lock:
+            os.replace(tmp_path, compacted_path)
+            for number in sealed:
+                os.remove(self._path(number))
+            os.replace(compacted_path, self._path(first))
+            self._segments = [first] + [n for n in self._segments if n > last]
+            self.compactions += 1
+
+        logger.info("Compacted segments %s-%s: kept %s records, dropped %s", first, last, kept, dropped)
+        return dropped
+
+    # Lifecycle
+
+    def close(self) -> None:
+        """Stop the fsync thread, sync pending writes and close the active segment."""
+        self._stop.set()
+        if self._thread.is_alive() and threading.current_thread() is not self._thread:
+            self._thread.join()
+        with self._lock:
+            if self._closed:
+                return
+            self._active.flush()
+            os.fsync(self._active.fileno())
+            self._active.close()
+            self._closed = True
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get segment, size and write counters."""
+        with self._lock:
+            sizes = []
+            for number in self._segments:
+                try:
+                    sizes.append(os.path.getsize(self._path(number)))
+                except FileNotFoundError:
+                    pass
+            return {
+                "directory": self.directory,
+                "segments": len(self._segments),
+                "bytes": sum(sizes),
+                "active_segment_bytes": self._active_size,
+                "records_written": self.records_written,
+                "fsyncs": self.fsyncs,
+                "compactions": self.compactions
+            }
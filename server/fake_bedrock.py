@@ -0,0 +1,241 @@
+"""
+Local Bedrock Stand-In
+
+This module provides FakeBedrockRuntime, a drop-in replacement for the
+boto3 bedrock-runtime client that answers converse_stream and
+invoke_model_with_response_stream locally. It streams the same events
+Bedrock does (messageStart/contentBlockDelta/messageStop/metadata for
+Amazon models, Claude Messages API chunk events with invocation metrics
+for the rest), paced by a time to first token and a token rate, so the
+real engine, parse, cache and tracking code can be load-tested and
+benchmarked without AWS.
+
+It is selected with BEDROCK_TRANSPORT=fake (see aws_clients).
+
+Environment variables:
+    FAKE_BEDROCK_TTFT_MS: Time to first token (default 300)
+    FAKE_BEDROCK_TOKENS_PER_SECOND: Output token rate, 0 for no delay (default 50)
+    FAKE_BEDROCK_OUTPUT_TOKENS: Output tokens per answer (default 120)
+    FAKE_BEDROCK_JITTER: Random variation of the above, as a fraction (default 0.2)
+    FAKE_BEDROCK_ERROR_RATE: Share of calls (0-1) that fail before streaming (default 0)
+    FAKE_BEDROCK_STREAM_ERROR_RATE: Share of calls (0-1) that fail mid-stream (default 0)
+    FAKE_BEDROCK_ERROR_CODE: Error code of injected failures (default ThrottlingException)
+    FAKE_BEDROCK_SEED: Seed for repeatable answers, timings and failures (default unset)
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+from typing import Any, Dict, Iterator, List, Optional
+
+from botocore.exceptions import ClientError, EventStreamError
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Words the fake answers are made of, one output token each
+_VOCABULARY = (
+    "the service provider offers a reliable and affordable plan for your home with flexible "
+    "scheduling friendly staff transparent pricing and great reviews from customers in your area "
+    "you can compare options book online and get help whenever you need it"
+).split()
+
+# Characters per token when estimating input tokens, as the context window builder does
+_CHARS_PER_TOKEN = 4
+
+
+def _text_of(content: Any) -> str:
+    # Claude messages carry a string, Amazon (Converse) messages a list of content blocks
+    if isinstance(content, list):
+        return " ".join(str(block.get("text", "")) for block in content if isinstance(block, dict))
+    return str(content or "")
+
+
+class FakeBedrockRuntime:
+    """Answers Bedrock streaming calls locally with configurable latency and failures."""
+
+    def __init__(self, ttft_ms: float = 300.0, tokens_per_second: float = 50.0, output_tokens: int = 120,
+                 jitter: float = 0.2, error_rate: float = 0.0, stream_error_rate: float = 0.0,
+                 error_code: str = "ThrottlingException", seed: Optional[int] = None):
+        """
+        Initialize the stand-in.
+
+        Args:
+            ttft_ms: Time from the call to the first content token
+            tokens_per_second: Output token rate, or 0 to stream without delay
+            output_tokens: Output tokens per answer (capped by the request's max tokens)
+            jitter: Random variation of the time to first token, token gaps and answer length (0-1)
+            error_rate: Share of calls that raise a ClientError before streaming
+            stream_error_rate: Share of calls that raise an EventStreamError halfway through the answer
+            error_code: Error code of injected failures
+            seed: Seed for repeatable answers, timings and failures
+        """
+        self.ttft_ms = ttft_ms
+        self.tokens_per_second = tokens_per_second
+        self.output_tokens = max(1, output_tokens)
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.stream_error_rate = stream_error_rate
+        self.error_code = error_code
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.errors = 0
+        self.stream_errors = 0
+        self.active_streams = 0
+        self.peak_streams = 0
+        self.tokens_streamed = 0
+
+    @classmethod
+    def from_env(cls) -> "FakeBedrockRuntime":
+        """Create a stand-in configured from the FAKE_BEDROCK_* environment variables."""
+        seed = os.getenv("FAKE_BEDROCK_SEED")
+        return cls(
+            ttft_ms=float(os.getenv("FAKE_BEDROCK_TTFT_MS", "300")),
+            tokens_per_second=float(os.getenv("FAKE_BEDROCK_TOKENS_PER_SECOND", "50")),
+            output_tokens=int(os.getenv("FAKE_BEDROCK_OUTPUT_TOKENS", "120")),
+            jitter=float(os.getenv("FAKE_BEDROCK_JITTER", "0.2")),
+            error_rate=float(os.getenv("FAKE_BEDROCK_ERROR_RATE", "0")),
+            stream_error_rate=float(os.getenv("FAKE_BEDROCK_STREAM_ERROR_RATE", "0")),
+            error_code=os.getenv("FAKE_BEDROCK_ERROR_CODE", "ThrottlingException"),
+            seed=int(seed) if seed else None
+        )
+
+    def converse_stream(self, modelId: str, messages: List[Dict[str, Any]], inferenceConfig: Dict[str, Any] = None,
+                        system: List[Dict[str, str]] = None, **kwargs) -> Dict[str, Any]:
+        """Stand-in for bedrock-runtime converse_stream, used for Amazon models."""
+        inference_config = inferenceConfig or {}
+        plan = self._plan("ConverseStream", messages, system, inference_config.get("maxTokens"))
+        return {"stream": self._converse_events(plan)}
+
+    def invoke_model_with_response_stream(self, modelId: str, body: str, **kwargs) -> Dict[str, Any]:
+        """Stand-in for bedrock-runtime invoke_model_with_response_stream, used for Claude models."""
+        request = json.loads(body)
+        system = [{"text": request["system"]}] if request.get("system") else None
+        plan = self._plan("InvokeModelWithResponseStream", request.get("messages", []), system,
+                          request.get("max_tokens"))
+        return {"body": self._claude_events(plan)}
+
+    def _vary(self, value: float) -> float:
+        if not self.jitter:
+            return value
+        return max(0.0, value * self._random.uniform(1 - self.jitter, 1 + self.jitter))
+
+    def _plan(self, operation: str, messages: List[Dict[str, Any]], system: Optional[List[Dict[str, str]]],
+              max_tokens: Optional[int]) -> Dict[str, Any]:
+        # Decide the answer, its pacing and any injected failure up front, under one lock
+        prompt_chars = sum(len(_text_of(message.get("content"))) for message in messages)
+        prompt_chars += sum(len(_text_of(prompt.get("text"))) for prompt in system or [])
+        with self._lock:
+            self.calls += 1
+            if self._random.random() < self.error_rate:
+                self.errors += 1
+                raise ClientError(
+                    {"Error": {"Code": self.error_code, "Message": "Injected by FakeBedrockRuntime"}}, operation
+                )
+            output_tokens = max(1, round(self._vary(self.output_tokens)))
+            if max_tokens:
+                output_tokens = min(output_tokens, int(max_tokens))
+            start = self._random.randrange(len(_VOCABULARY))
+            words = [_VOCABULARY[(start + i) % len(_VOCABULARY)] for i in range(output_tokens)]
+            gaps = [self._vary(1 / self.tokens_per_second) if self.tokens_per_second else 0.0
+                    for _ in range(output_tokens - 1)]
+            fail_at = output_tokens // 2 if self._random.random() < self.stream_error_rate else None
+            return {
+                "operation": operation,
+                "input_tokens": max(1, prompt_chars // _CHARS_PER_TOKEN),
+                "tokens": [("" if i == 0 else " ") + word for i, word in enumerate(words)],
+                "ttft": self._vary(self.ttft_ms) / 1000,
+                "gaps": gaps,
+                "fail_at": fail_at
+            }
+
+    def _tokens(self, plan: Dict[str, Any]) -> Iterator[str]:
+        """Yield the planned tokens at their pace, counting the stream as active meanwhile."""
+        with self._lock:
+            self.active_streams += 1
+            self.peak_streams = max(self.peak_streams, self.active_streams)
+        try:
+            time.sleep(plan["ttft"])
+            for index, token in enumerate(plan["tokens"]):
+                if index == plan["fail_at"]:
+                    with self._lock:
+                        self.stream_errors += 1
+                    raise EventStreamError(
+                        {"Error": {"Code": "modelStreamErrorException", "Message": "Injected by FakeBedrockRuntime"}},
+                        plan["operation"]
+                    )
+                if index:
+                    time.sleep(plan["gaps"][index - 1])
+                with self._lock:
+                    self.tokens_streamed += 1
+                yield token
+        finally:
+            with self._lock:
+                self.active_streams -= 1
+
+    def _converse_events(self, plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        started = time.time()
+        yield {"messageStart": {"role": "assistant"}}
+        for token in self._tokens(plan):
+            yield {"contentBlockDelta": {"delta": {"text": token}, "contentBlockIndex": 0}}
+        yield {"contentBlockStop": {"contentBlockIndex": 0}}
+        yield {"messageStop": {"stopReason": "end_turn"}}
+        output_tokens = len(plan["tokens"])
+        yield {
+            "metadata": {
+                "usage": {
+                    "inputTokens": plan["input_tokens"],
+                    "outputTokens": output_tokens,
+                    "totalTokens": plan["input_tokens"] + output_tokens
+                },
+                "metrics": {"latencyMs": int((time.time() - started) * 1000)}
+            }
+        }
+
+    def _claude_events(self, plan: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        def chunk(payload: Dict[str, Any]) -> Dict[str, Any]:
+            return {"chunk": {"bytes": json.dumps(payload).encode()}}
+
+        started = time.time()
+        first_byte = None
+        yield chunk({
+            "type": "message_start",
+            "message": {"role": "assistant", "usage": {"input_tokens": plan["input_tokens"], "output_tokens": 0}}
+        })
+        yield chunk({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}})
+        for token in self._tokens(plan):
+            if first_byte is None:
+                first_byte = time.time()
+            yield chunk({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": token}})
+        yield chunk({"type": "content_block_stop", "index": 0})
+        output_tokens = len(plan["tokens"])
+        yield chunk({
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn"},
+            "usage": {"output_tokens": output_tokens}
+        })
+        yield chunk({
+            "type": "message_stop",
+            "amazon-bedrock-invocationMetrics": {
+                "inputTokenCount": plan["input_tokens"],
+                "outputTokenCount": output_tokens,
+                "invocationLatency": int((time.time() - started) * 1000),
+                "firstByteLatency": int(((first_byte or time.time()) - started) * 1000)
+            }
+        })
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the call, injected error and streaming counters."""
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "errors": self.errors,
+                "stream_errors": self.stream_errors,
+                "active_streams": self.active_streams,
+                "peak_streams": self.peak_streams,
+                "tokens_streamed": self.tokens_streamed
+            }
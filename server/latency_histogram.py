@@ -0,0 +1,121 @@
+"""
+Log-Bucketed Latency Histograms
+
+This module provides a fixed-size, mergeable histogram for latency values
+in milliseconds. Buckets grow geometrically (eight per doubling, roughly 9%
+relative error), in the style of HDR histograms, so tail percentiles stay
+accurate from sub-millisecond calls up to multi-minute streams while each
+histogram uses a constant amount of memory.
+"""
+
+import math
+from array import array
+from typing import Any, Dict, Iterable, List, Optional
+
+# Number of buckets per power of two; higher means finer resolution
+BUCKETS_PER_DOUBLING = 8
+
+# Largest value tracked precisely (~17 minutes); larger values land in the last bucket
+MAX_TRACKABLE_MS = 2 ** 20
+
+# Bucket 0 holds values below 1 ms, bucket i >= 1 holds [2**((i-1)/8), 2**(i/8))
+NUM_BUCKETS = 1 + int(math.log2(MAX_TRACKABLE_MS) * BUCKETS_PER_DOUBLING) + 1
+
+DEFAULT_PERCENTILES = (50, 90, 99)
+
+
+def bucket_index(value_ms: float) -> int:
+    """Return the index of the bucket that holds value_ms."""
+    if value_ms < 1:
+        return 0
+    return min(NUM_BUCKETS - 1, 1 + int(math.log2(value_ms) * BUCKETS_PER_DOUBLING))
+
+
+def bucket_upper_bound(index: int) -> float:
+    """Return the exclusive upper bound of a bucket in milliseconds."""
+    return 2 ** (index / BUCKETS_PER_DOUBLING)
+
+
+class LatencyHistogram:
+    """A fixed-size latency histogram that can be merged with others."""
+
+    def __init__(self):
+        self.counts = array('Q', [0]) * NUM_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def record(self, value_ms: float) -> None:
+        """Record one latency value in milliseconds."""
+        value_ms = max(0.0, float(value_ms))
+        self.counts[bucket_index(value_ms)] += 1
+        self.count += 1
+        self.total += value_ms
+        if value_ms < self.min:
+            self.min = value_ms
+        if value_ms > self.max:
+            self.max = value_ms
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """Add another histogram's counts into this one and return self."""
+        for i, count in enumerate(other.counts):
+            if count:
+                self.counts[i] += count
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        return self
+
+    @classmethod
+    def merged(cls, histograms: Iterable["LatencyHistogram"]) -> "LatencyHistogram":
+        """Return a new histogram combining all of the given histograms."""
+        result = cls()
+        for histogram in histograms:
+            result.merge(histogram)
+        return result
+
+    def percentile(self, percentile: float) -> Optional[float]:
+        """
+        Estimate a percentile from the bucket counts.
+
+        Args:
+            percentile: Percentile between 0 and 100
+
+        Returns:
+            The upper bound of the bucket holding the percentile, clamped to
+            the observed min/max, or None if nothing has been recorded
+        """
+        if self.count == 0:
+            return None
+
+        rank = max(1, math.ceil(self.count * percentile / 100))
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return round(min(max(bucket_upper_bound(i), self.min), self.max), 3)
+        return round(self.max, 3)
+
+    def percentiles(self, percentiles: Iterable[float] = DEFAULT_PERCENTILES) -> Dict[str, Optional[float]]:
+        """Return a dict like {"p50": ..., "p90": ..., "p99": ...}."""
+        return {f"p{p:g}": self.percentile(p) for p in percentiles}
+
+    def buckets(self) -> List[Dict[str, Any]]:
+        """Return the non-empty buckets as {"le": upper bound in ms, "count": n}."""
+        return [
+            {"le": round(bucket_upper_bound(i), 3), "count": count}
+            for i, count in enumerate(self.counts) if count
+        ]
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summarize the histogram with its percentiles and bucket counts."""
+        return {
+            "count": self.count,
+            "min": round(self.min, 3) if self.count else None,
+            "max": round(self.max, 3) if self.count else None,
+            "mean": round(self.total / self.count, 3) if self.count else None,
+            **self.percentiles(),
+            "buckets": self.buckets()
+        }
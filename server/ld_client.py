@@ -7,17 +7,19 @@ sending feedback, and managing fallback configurations.
 """
 
 import os
-import json
+import hashlib
 import logging
-import traceback
 from typing import Dict, Any, Tuple, Optional
 
 # LaunchDarkly imports
 import ldclient
 from ldclient import Context
 from ldclient.config import Config
+import chevron
 from ldai.client import LDAIClient, AIConfig, ModelConfig, LDMessage, ProviderConfig
-from ldai.tracker import FeedbackKind
+from ldai.tracker import FeedbackKind, LDAIConfigTracker
+
+from ttl_cache import TTLCache
 
 # Set up logging
 logger = logging.getLogger(__name__)
@@ -25,24 +27,119 @@ logger = logging.getLogger(__name__)
 class LaunchDarklyClient:
     """Main LaunchDarkly client wrapper that handles LD and LDAI operations."""
     
-    def __init__(self, server_key: str, ai_config_id: str = "guru-guide-ai"):
+    def __init__(self, server_key: str, ai_config_id: str = "guru-guide-ai",
+                 cache_ttl: float = None, cache_size: int = None, offline: bool = False):
         """
         Initialize the LaunchDarkly client.
         
         Args:
             server_key: LaunchDarkly SDK key
             ai_config_id: The AI configuration ID to use
+            cache_ttl: Seconds an evaluated AI config is reused, defaults to
+                AI_CONFIG_CACHE_TTL_SECONDS (0 disables the cache)
+            cache_size: Maximum number of cached AI configs, defaults to AI_CONFIG_CACHE_SIZE
+            offline: Don't connect to LaunchDarkly; every evaluation returns its default
+                (the fallback AI config)
         """
         # Initialize LD client
-        ldclient.set_config(Config(server_key))
+        ldclient.set_config(Config(server_key, offline=offline))
         self.ld_client = ldclient.get()
         self.ai_client = LDAIClient(self.ld_client)
-        self.ai_config_id = ai_config_id    
+        self.ai_config_id = ai_config_id
+        
+        # The fallback never changes, so build it once instead of per evaluation
+        self.fallback_config = self.get_fallback_config()
+        
+        # Cache of evaluated (variation, tracker) pairs per context; templates are rendered per call
+        if cache_ttl is None:
+            cache_ttl = float(os.getenv("AI_CONFIG_CACHE_TTL_SECONDS", "60"))
+        if cache_size is None:
+            cache_size = int(os.getenv("AI_CONFIG_CACHE_SIZE", "1024"))
+        self.config_cache = TTLCache(maxsize=cache_size, ttl=cache_ttl) if cache_ttl > 0 else None
+        
+        # Drop cached configs as soon as the AI config flag changes
+        self.ld_client.flag_tracker.add_listener(self._on_flag_change)
+    
+    def _on_flag_change(self, flag_change) -> None:
+        """Invalidate cached AI configs when the AI config flag is updated."""
+        if flag_change.key == self.ai_config_id and self.config_cache is not None:
+            self.config_cache.clear()
+            logger.info("AI config '%s' changed; cleared cached configs", self.ai_config_id)
+    
+    def _cache_key(self, user_context: Context) -> Tuple[str, str]:
+        """
+        Build the cache key for an evaluation.
+        
+        The key combines the context key and a fingerprint of the context's
+        attributes (targeting rules may use any of them). Template variables
+        are not part of it: the cache holds the variation before its message
+        templates are rendered, and they are rendered on every call.
+        """
+        context_fingerprint = hashlib.blake2b(
+            user_context.to_json_string().encode(), digest_size=16
+        ).hexdigest()
+        return (user_context.fully_qualified_key, context_fingerprint)
+    
+    def _evaluate(self, user_context: Context) -> Tuple[Dict[str, Any], LDAIConfigTracker]:
+        """Evaluate the AI config flag, as LDAIClient.config does, without rendering the messages."""
+        variation = self.ld_client.variation(self.ai_config_id, user_context, self.fallback_config.to_dict())
+        meta = variation.get('_ldMeta', {})
+        tracker = LDAIConfigTracker(
+            self.ld_client,
+            meta.get('variationKey', ''),
+            self.ai_config_id,
+            int(meta.get('version', 1)),
+            user_context
+        )
+        return variation, tracker
+    
+    def _build_config(self, variation: Dict[str, Any], user_context: Context,
+                      variables: Dict[str, Any]) -> AIConfig:
+        """Build the AIConfig for an evaluated variation, rendering its message templates."""
+        all_variables = dict(variables or {})
+        all_variables['ldctx'] = user_context.to_dict()
+        
+        messages = None
+        if isinstance(variation.get('messages'), list) and all(
+            isinstance(entry, dict) for entry in variation['messages']
+        ):
+            messages = [
+                LDMessage(role=entry['role'], content=chevron.render(entry['content'], all_variables))
+                for entry in variation['messages']
+            ]
+        
+        provider = None
+        if isinstance(variation.get('provider'), dict):
+            provider = ProviderConfig(variation['provider'].get('name', ''))
+        
+        model = None
+        if isinstance(variation.get('model'), dict):
+            model = ModelConfig(
+                name=variation['model']['name'],
+                parameters=variation['model'].get('parameters'),
+                custom=variation['model'].get('custom')
+            )
+        
+        return AIConfig(
+            enabled=bool(variation.get('_ldMeta', {}).get('enabled', False)),
+            model=model,
+            messages=messages,
+            provider=provider
+        )
+    
+    def get_cache_stats(self) -> Optional[Dict[str, Any]]:
+        """Return hit/miss counters for the AI config cache, or None if disabled."""
+        return self.config_cache.get_stats() if self.config_cache is not None else None
     
     def get_ai_config(self, user_context: Context, variables: Dict[str, Any]) -> Tuple[AIConfig, Any]:
         """
         Get the AI configuration for a specific user context with enhanced logging.
         
+        Evaluations are cached per context for AI_CONFIG_CACHE_TTL_SECONDS;
+        the message templates are still rendered with this call's variables.
+        A cache hit sends no evaluation event to LaunchDarkly, so each context
+        is counted at most once per TTL in the AI config's evaluation data.
+        
         Args:
             user_context: LaunchDarkly user context
             variables: Variables to pass to the AI configuration including conversation history
@@ -51,51 +148,55 @@ class LaunchDarklyClient:
             Tuple containing the AI config and a tracker object
         """
         try:
-            # Log the request for AI config
-            logger.info(f"Requesting AI config for user: {user_context.key}")
-            logger.info(f"Variables passed to AI config: {json.dumps(variables, default=str)}")
-            
-            # Create a fallback configuration for when the LaunchDarkly service is unavailable
-            fallback_value = self.get_fallback_config()
+            cache_key = None
+            evaluation = None
+            if self.config_cache is not None:
+                cache_key = self._cache_key(user_context)
+                evaluation = self.config_cache.get(cache_key)
+                if evaluation is not None:
+                    logger.debug("Using cached AI config for user: %s", user_context.key)
             
-            # Get the configuration and tracker
-            config, tracker = self.ai_client.config(
-                self.ai_config_id, 
-                user_context, 
-                fallback_value, 
-                variables
-            )
-            logger.info("AI Config received from LaunchDarkly")
-            logger.info(f"AI Config enabled: {config.enabled}")
-            
-            # Log model details
-            self.print_box("MODEL DETAILS", {
-                "name": config.model.name,
-                "parameters": config.model._parameters
-            })
+            if evaluation is None:
+                # Log the request for AI config
+                logger.debug("Requesting AI config for user: %s", user_context.key)
+                
+                # Evaluate the flag, falling back when LaunchDarkly is unavailable
+                evaluation = self._evaluate(user_context)
+                if cache_key is not None:
+                    self.config_cache.set(cache_key, evaluation)
             
-            # Log all messages in the config
-            message_logs = []
-            if config.messages:
-                for i, msg in enumerate(config.messages):
-                    message_logs.append({
-                        "index": i,
-                        "role": msg.role,
-                        "content": msg.content[:100] + "..." if len(msg.content) > 100 else msg.content
-                    })
-            self.print_box("CONFIG MESSAGES", message_logs)
+            variation, tracker = evaluation
+            config = self._build_config(variation, user_context, variables)
+            logger.info("AI Config received from LaunchDarkly (enabled: %s)", config.enabled)
             
-            # Log the full system prompt for verification
-            system_messages = [msg.content for msg in config.messages if msg.role == "system"]
-            if system_messages:
-                self.print_box("SYSTEM PROMPT (FULL)", system_messages[0])
+            # Log model details, messages and system prompt only when debugging
+            if logger.isEnabledFor(logging.DEBUG):
+                self.print_box("MODEL DETAILS", {
+                    "name": config.model.name,
+                    "parameters": config.model._parameters
+                })
+                
+                # Log all messages in the config
+                message_logs = []
+                if config.messages:
+                    for i, msg in enumerate(config.messages):
+                        message_logs.append({
+                            "index": i,
+                            "role": msg.role,
+                            "content": msg.content[:100] + "..." if len(msg.content) > 100 else msg.content
+                        })
+                self.print_box("CONFIG MESSAGES", message_logs)
+                
+                # Log the full system prompt for verification
+                system_messages = [msg.content for msg in config.messages or [] if msg.role == "system"]
+                if system_messages:
+                    self.print_box("SYSTEM PROMPT (FULL)", system_messages[0])
             
             return config, tracker
         except Exception as e:
-            logger.error(f"Error getting AI config: {e}")
-            logger.error(f"Traceback: {traceback.format_exc()}")
+            logger.error("Error getting AI config: %s", e, exc_info=True)
             logger.warning("Using fallback configuration")
-            return self.get_fallback_config(), None
+            return self.fallback_config, None
     
     def get_fallback_config(self) -> AIConfig:
         """Return a fallback configuration for when LaunchDarkly is unavailable."""
@@ -128,12 +229,15 @@ class LaunchDarklyClient:
                 tracker.track_feedback({"kind": FeedbackKind.Positive})
             else:
                 tracker.track_feedback({"kind": FeedbackKind.Negative})
-            logger.info(f"Feedback sent: {'positive' if is_positive else 'negative'}")
+            logger.info("Feedback sent: %s", "positive" if is_positive else "negative")
         else:
             logger.warning("Cannot send feedback: tracker is None")
     
     def print_box(self, title, content):
-        """Print content in a styled box for terminal output."""
+        """Log content in a styled box at DEBUG level; does nothing unless DEBUG is enabled."""
+        if not logger.isEnabledFor(logging.DEBUG):
+            return
+        
         import shutil
         
         # Get terminal width
@@ -145,7 +249,7 @@ class LaunchDarklyClient:
         content_str_lines = [str(item) for item in content_lines]
         
         # Calculate initial width based on content and title
-        width = min(max(len(title), max(len(line) for line in content_str_lines)) + 4, terminal_width)
+        width = min(max(len(title), max((len(line) for line in content_str_lines), default=0)) + 4, terminal_width)
         
         # Wrap long content lines to fit terminal
         wrapped_lines = []
@@ -157,15 +261,16 @@ class LaunchDarklyClient:
             else:
                 wrapped_lines.append(line)
     
-        # Print the box
-        print('┌' + '─' * (width - 2) + '┐')
-        print(f'│ {title[:max_content_width].ljust(width - 4)} │')
-        print('├' + '─' * (width - 2) + '┤')
+        # Log the box as a single record
+        box = ['┌' + '─' * (width - 2) + '┐']
+        box.append(f'│ {title[:max_content_width].ljust(width - 4)} │')
+        box.append('├' + '─' * (width - 2) + '┤')
         
         for line in wrapped_lines:
-            print(f'│ {line[:max_content_width].ljust(width - 4)} │')
+            box.append(f'│ {line[:max_content_width].ljust(width - 4)} │')
         
-        print('└' + '─' * (width - 2) + '┘')
+        box.append('└' + '─' * (width - 2) + '┘')
+        logger.debug("\n".join(box))
     
     def close(self):
         """Close the LaunchDarkly client."""
@@ -0,0 +1,477 @@
+"""
+Load Generator
+
+This module simulates many concurrent users of the app and reports how
+each endpoint holds up. Every simulated session follows the React
+client's flow: log in (or stay anonymous), list providers, open a
+provider's services, select a service, then chat with the assistant for a
+few turns, rating some of the answers. Sessions run on a thread pool with
+a think time between steps, and every request's latency and outcome is
+recorded per endpoint.
+
+Requests go to a running server (--url), or in-process to the Flask app
+through app.test_client() (--in-process) with the same offline
+LaunchDarkly and fake Bedrock stand-ins as bench.py, plus a fake model
+latency so chat turns take realistic time.
+
+Instead of the synthetic flow, a JSONL trace (one request per line, see
+load_trace) can be replayed with its original timing, sped up or slowed
+down. --record writes the requests of a synthetic run in the same format.
+
+Usage:
+    python loadgen.py --url http://localhost:5003 --concurrency 200 --sessions 1000
+    python loadgen.py --in-process --concurrency 50 --duration 60 --think-time 0.5
+    python loadgen.py --in-process --sessions 20 --record trace.jsonl
+    python loadgen.py --url http://localhost:5003 --replay trace.jsonl --speed 2
+"""
+
+import argparse
+import http.client
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import urlencode, urlsplit
+
+from latency_histogram import LatencyHistogram
+
+# Questions sessions ask the assistant, picked at random
+QUESTIONS = [
+    "Which yoga classes are good for beginners?",
+    "What should I bring to my first massage appointment?",
+    "Do you have any classes in the evening?",
+    "How long is a personal training session?",
+    "Can you recommend something for stress relief?",
+    "What is the difference between Vinyasa and Hatha yoga?",
+    "Are there discounts for booking several sessions?",
+    "Which service would help with back pain?"
+]
+
+# Users the mock user store knows; sessions that log in pick one
+LOGIN_EMAILS = ["alex@example.com", "jamie@example.com", "taylor@example.com", "jordan@example.com"]
+
+# Stand-in settings for --in-process runs, applied before the app is imported unless already set
+IN_PROCESS_ENV = {
+    "FAKE_BEDROCK_TTFT_MS": "300",
+    "FAKE_BEDROCK_TOKENS_PER_SECOND": "200",
+    "FAKE_BEDROCK_JITTER": "0.3"
+}
+
+# Path segments that identify a resource rather than an endpoint
+_ID_SEGMENT = re.compile(r"^(?:[0-9]+|[0-9a-f]{8}-[0-9a-f-]{27}|user[0-9]+|[a-z]+-[a-z]+-[0-9]+)$")
+
+
+def endpoint_name(method: str, path: str) -> str:
+    """Name a request by its method and path, with IDs and the query string left out."""
+    path = path.split("?", 1)[0]
+    segments = ["<id>" if _ID_SEGMENT.match(segment) else segment for segment in path.split("/")]
+    return f"{method} {'/'.join(segments)}"
+
+
+class EndpointStats:
+    """Request count, errors and latency histogram of one endpoint."""
+
+    def __init__(self):
+        self.requests = 0
+        self.errors = 0
+        self.status_codes: Dict[str, int] = {}
+        self.latency = LatencyHistogram()
+
+    def to_dict(self, elapsed: float) -> Dict[str, Any]:
+        return {
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests * 100, 2) if self.requests else 0,
+            "throughput_per_sec": round(self.requests / elapsed, 2) if elapsed else 0,
+            "latency_ms": self.latency.percentiles((50, 90, 95, 99)),
+            "status_codes": dict(self.status_codes)
+        }
+
+
+class LoadStats:
+    """Per-endpoint stats shared by every session thread."""
+
+    def __init__(self):
+        self.endpoints: Dict[str, EndpointStats] = {}
+        self.sessions = 0
+        self.failed_sessions = 0
+        self.started = time.monotonic()
+        self.finished: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def record(self, name: str, status: Optional[int], latency_ms: float) -> None:
+        """Record a request; a status of None means it raised before getting a response."""
+        with self._lock:
+            stats = self.endpoints.get(name)
+            if stats is None:
+                stats = self.endpoints[name] = EndpointStats()
+            stats.requests += 1
+            code = str(status) if status is not None else "exception"
+            stats.status_codes[code] = stats.status_codes.get(code, 0) + 1
+            if status is None or status >= 400:
+                stats.errors += 1
+            stats.latency.record(latency_ms)
+
+    def session_done(self, ok: bool) -> None:
+        with self._lock:
+            self.sessions += 1
+            if not ok:
+                self.failed_sessions += 1
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Summarize the run, overall and per endpoint."""
+        elapsed = (self.finished or time.monotonic()) - self.started
+        with self._lock:
+            endpoints = {name: stats.to_dict(elapsed) for name, stats in sorted(self.endpoints.items())}
+            requests = sum(stats.requests for stats in self.endpoints.values())
+            errors = sum(stats.errors for stats in self.endpoints.values())
+            latency = LatencyHistogram.merged(stats.latency for stats in self.endpoints.values())
+        return {
+            "elapsed_seconds": round(elapsed, 2),
+            "sessions": self.sessions,
+            "failed_sessions": self.failed_sessions,
+            "requests": requests,
+            "errors": errors,
+            "error_rate": round(errors / requests * 100, 2) if requests else 0,
+            "throughput_per_sec": round(requests / elapsed, 2) if elapsed else 0,
+            "latency_ms": latency.percentiles((50, 90, 95, 99)),
+            "endpoints": endpoints
+        }
+
+
+class HttpTarget:
+    """Sends requests to a running server, over one keep-alive connection per thread."""
+
+    def __init__(self, base_url: str, timeout: float = 60.0):
+        parts = urlsplit(base_url)
+        self.scheme = parts.scheme or "http"
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip("/")
+        self.timeout = timeout
+        self._local = threading.local()
+
+    def _connection(self) -> http.client.HTTPConnection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection_class = http.client.HTTPSConnection if self.scheme == "https" else http.client.HTTPConnection
+            connection = self._local.connection = connection_class(self.netloc, timeout=self.timeout)
+        return connection
+
+    def request(self, method: str, path: str, body: Any = None) -> Tuple[int, Any]:
+        """Send a request and return (status code, parsed JSON body or None)."""
+        headers = {"Accept": "application/json"}
+        payload = None
+        if body is not None:
+            payload = json.dumps(body)
+            headers["Content-Type"] = "application/json"
+        connection = self._connection()
+        try:
+            connection.request(method, self.prefix + path, body=payload, headers=headers)
+            response = connection.getresponse()
+            data = response.read()
+        except (OSError, http.client.HTTPException):
+            # Drop the connection so the next request opens a fresh one
+            connection.close()
+            self._local.connection = None
+            raise
+        try:
+            return response.status, json.loads(data) if data else None
+        except ValueError:
+            return response.status, None
+
+
+class InProcessTarget:
+    """Sends requests to the Flask app in this process through its test client."""
+
+    def __init__(self):
+        from bench import load_app
+        for key, value in IN_PROCESS_ENV.items():
+            os.environ.setdefault(key, value)
+        self.app = load_app().app
+
+    def request(self, method: str, path: str, body: Any = None) -> Tuple[int, Any]:
+        """Send a request and return (status code, parsed JSON body or None)."""
+        response = self.app.test_client().open(path, method=method, json=body)
+        return response.status_code, response.get_json(silent=True)
+
+
+class Session:
+    """One simulated user going through the client's flow."""
+
+    def __init__(self, target, stats: LoadStats, options: argparse.Namespace, rng: random.Random,
+                 recorder: Optional["TraceRecorder"] = None):
+        self.target = target
+        self.stats = stats
+        self.options = options
+        self.rng = rng
+        self.recorder = recorder
+        self.id = uuid.uuid4().hex
+        # Anonymous users get a UUID, as the client's userIdentity does
+        self.user_id = str(uuid.uuid4())
+
+    def think(self) -> None:
+        if self.options.think_time > 0:
+            time.sleep(self.rng.uniform(0.5, 1.5) * self.options.think_time)
+
+    def call(self, method: str, path: str, body: Any = None, params: Optional[Dict[str, Any]] = None) -> Any:
+        """
+        Send a request and record it.
+
+        Raises:
+            RuntimeError: If the response is an error, which ends the session
+        """
+        if params:
+            path = f"{path}?{urlencode(params)}"
+        if self.recorder:
+            self.recorder.write(self.id, method, path, body)
+        started = time.monotonic()
+        try:
+            status, data = self.target.request(method, path, body)
+        except Exception:
+            self.stats.record(endpoint_name(method, path), None, (time.monotonic() - started) * 1000)
+            raise
+        self.stats.record(endpoint_name(method, path), status, (time.monotonic() - started) * 1000)
+        if status >= 400:
+            raise RuntimeError(f"{method} {path} returned {status}")
+        return data or {}
+
+    def run(self) -> None:
+        """Go through the flow once: login, providers, services, select, chat with feedback."""
+        if self.rng.random() >= self.options.anonymous_share:
+            login = self.call("POST", "/api/user/login", {"username": self.rng.choice(LOGIN_EMAILS), "password": "x"})
+            self.user_id = login.get("userId", self.user_id)
+            self.think()
+
+        providers = self.call("GET", "/api/providers", params={"userId": self.user_id}).get("providers") or []
+        self.think()
+        provider_id = self.rng.choice(providers)["id"] if providers else "wellness-center-1"
+
+        services = self.call("GET", f"/api/services/{provider_id}", params={"userId": self.user_id}).get("services") or {}
+        self.think()
+        categories = [category for category, items in services.items() if items]
+        if categories:
+            category = self.rng.choice(categories)
+            self.call("POST", "/api/service/select", {
+                "userId": self.user_id,
+                "providerId": provider_id,
+                "serviceName": self.rng.choice(services[category])["name"],
+                "serviceCategory": category
+            })
+            self.think()
+
+        if self.rng.random() >= self.options.chat_share:
+            return
+        conversation_id = None
+        for _ in range(self.options.chat_turns):
+            reply = self.call("POST", "/api/chatbot/message", {
+                "userId": self.user_id,
+                "message": self.rng.choice(QUESTIONS),
+                "conversationId": conversation_id
+            })
+            conversation_id = reply.get("conversationId") or conversation_id
+            self.think()
+            if reply.get("messageId") and self.rng.random() < self.options.feedback_rate:
+                self.call("POST", "/api/chatbot/feedback", {
+                    "userId": self.user_id,
+                    "messageId": reply["messageId"],
+                    "isPositive": self.rng.random() < 0.8
+                })
+                self.think()
+
+
+class TraceRecorder:
+    """Writes every request of a run as a JSONL trace that --replay can read back."""
+
+    def __init__(self, path: str):
+        self._file = open(path, "w")
+        self._started = time.monotonic()
+        self._lock = threading.Lock()
+
+    def write(self, session: str, method: str, path: str, body: Any) -> None:
+        line = json.dumps({
+            "t": round(time.monotonic() - self._started, 4),
+            "session": session,
+            "method": method,
+            "path": path,
+            "body": body
+        })
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def close(self) -> None:
+        self._file.close()
+
+
+def load_trace(path: str) -> List[List[Dict[str, Any]]]:
+    """
+    Read a JSONL trace of requests, grouped into sessions.
+
+    Each line is an object with "method" and "path" (including any query
+    string), and optionally "body" (JSON request body), "t" (seconds since
+    the start of the trace) and "session" (requests of one session are
+    sent one after another, in order). Lines without a session are sent
+    on their own.
+
+    Returns:
+        list: The sessions, each a list of requests ordered by time
+    """
+    sessions: Dict[str, List[Dict[str, Any]]] = {}
+    with open(path) as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            if "method" not in entry or "path" not in entry:
+                raise ValueError(f"{path}:{number}: every request needs a method and a path")
+            sessions.setdefault(str(entry.get("session", f"line-{number}")), []).append(entry)
+    for entries in sessions.values():
+        entries.sort(key=lambda entry: entry.get("t", 0))
+    return sorted(sessions.values(), key=lambda entries: entries[0].get("t", 0))
+
+
+def replay_session(target, stats: LoadStats, entries: List[Dict[str, Any]], started: float, speed: float) -> None:
+    """Send a traced session's requests at their original offsets divided by speed."""
+    ok = True
+    for entry in entries:
+        delay = started + entry.get("t", 0) / speed - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        name = entry.get("name") or endpoint_name(entry["method"], entry["path"])
+        request_started = time.monotonic()
+        try:
+            status, _ = target.request(entry["method"], entry["path"], entry.get("body"))
+        except Exception:
+            status = None
+        stats.record(name, status, (time.monotonic() - request_started) * 1000)
+        ok = ok and status is not None and status < 400
+    stats.session_done(ok)
+
+
+def run_sessions(target, options: argparse.Namespace, recorder: Optional[TraceRecorder] = None) -> LoadStats:
+    """Run synthetic sessions on the pool until --sessions have run or --duration has passed."""
+    stats = LoadStats()
+    deadline = stats.started + options.duration if options.duration else None
+    counter = iter(range(options.sessions)) if options.sessions else None
+    counter_lock = threading.Lock()
+
+    def next_session() -> bool:
+        if deadline is not None and time.monotonic() >= deadline:
+            return False
+        if counter is None:
+            return True
+        with counter_lock:
+            return next(counter, None) is not None
+
+    def worker(index: int) -> None:
+        rng = random.Random(None if options.seed is None else options.seed + index)
+        # Spread session starts over the ramp-up instead of starting every thread at once
+        if options.ramp_up > 0:
+            time.sleep(options.ramp_up * index / options.concurrency)
+        while next_session():
+            session = Session(target, stats, options, rng, recorder)
+            try:
+                session.run()
+                stats.session_done(True)
+            except Exception:
+                stats.session_done(False)
+
+    with ThreadPoolExecutor(max_workers=options.concurrency, thread_name_prefix="loadgen") as pool:
+        for future in [pool.submit(worker, index) for index in range(options.concurrency)]:
+            future.result()
+    stats.finished = time.monotonic()
+    return stats
+
+
+def run_replay(target, options: argparse.Namespace) -> LoadStats:
+    """Replay a trace's sessions on the pool."""
+    sessions = load_trace(options.replay)
+    stats = LoadStats()
+    started = stats.started
+    if sessions:
+        # Time offsets are relative to the trace's first request
+        origin = sessions[0][0].get("t", 0)
+        for entries in sessions:
+            for entry in entries:
+                entry["t"] = entry.get("t", origin) - origin
+    with ThreadPoolExecutor(max_workers=options.concurrency, thread_name_prefix="loadgen") as pool:
+        futures = [pool.submit(replay_session, target, stats, entries, started, options.speed) for entries in sessions]
+        for future in futures:
+            future.result()
+    stats.finished = time.monotonic()
+    return stats
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"{report['sessions']} sessions ({report['failed_sessions']} failed), {report['requests']} requests "
+          f"in {report['elapsed_seconds']}s: {report['throughput_per_sec']} req/s, "
+          f"{report['error_rate']}% errors")
+    print(f"{'endpoint':<34}{'requests':>9}{'req/s':>9}{'errors':>8}{'p50 ms':>9}{'p90 ms':>9}{'p99 ms':>9}")
+    for name, endpoint in report["endpoints"].items():
+        latency = endpoint["latency_ms"]
+        print(f"{name:<34}{endpoint['requests']:>9}{endpoint['throughput_per_sec']:>9}"
+              f"{endpoint['error_rate']:>7}%{latency['p50'] or 0:>9.1f}{latency['p90'] or 0:>9.1f}{latency['p99'] or 0:>9.1f}")
+
+
+def parse_args(argv: Optional[Iterable[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Simulate concurrent users of the app and report per-endpoint stats.")
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument("--url", help="Base URL of a running server, e.g. http://localhost:5003")
+    target.add_argument("--in-process", action="store_true",
+                        help="Drive the Flask app in this process with offline LaunchDarkly and fake Bedrock")
+    parser.add_argument("--concurrency", type=int, default=50, help="Concurrent sessions (default 50)")
+    parser.add_argument("--sessions", type=int, default=0,
+                        help="Sessions to run in total (default: the concurrency, unless --duration is set)")
+    parser.add_argument("--duration", type=float, default=0, help="Seconds to keep starting sessions")
+    parser.add_argument("--ramp-up", type=float, default=0, help="Seconds over which sessions start (default 0)")
+    parser.add_argument("--think-time", type=float, default=1.0,
+                        help="Mean seconds between a session's steps, varied by +/-50%% (default 1)")
+    parser.add_argument("--chat-turns", type=int, default=3, help="Chat messages per session (default 3)")
+    parser.add_argument("--chat-share", type=float, default=1.0, help="Share of sessions that chat (default 1)")
+    parser.add_argument("--feedback-rate", type=float, default=0.5,
+                        help="Share of chat answers that get feedback (default 0.5)")
+    parser.add_argument("--anonymous-share", type=float, default=0.3,
+                        help="Share of sessions that don't log in (default 0.3)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="HTTP timeout in seconds (default 60)")
+    parser.add_argument("--seed", type=int, help="Seed for repeatable session choices")
+    parser.add_argument("--record", help="Write the requests of the run to this JSONL trace")
+    parser.add_argument("--replay", help="Replay this JSONL trace instead of the synthetic flow")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed factor (default 1, 2 = twice as fast)")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON instead of a table")
+    options = parser.parse_args(argv)
+    if not options.sessions and not options.duration:
+        options.sessions = options.concurrency
+    if options.speed <= 0:
+        parser.error("--speed must be positive")
+    return options
+
+
+def main(argv: Optional[Iterable[str]] = None) -> int:
+    options = parse_args(argv)
+    target = InProcessTarget() if options.in_process else HttpTarget(options.url, options.timeout)
+
+    if options.replay:
+        stats = run_replay(target, options)
+    else:
+        recorder = TraceRecorder(options.record) if options.record else None
+        try:
+            stats = run_sessions(target, options, recorder)
+        finally:
+            if recorder:
+                recorder.close()
+
+    report = stats.to_dict()
+    if options.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+    return 1 if report["errors"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,129 @@
+"""
+Logging Configuration
+
+This module sets up logging for the server. Levels can be set globally and
+per subsystem (logger name), output is either plain text or one JSON object
+per line, and every record carries the ID of the request it was logged for.
+It also provides helpers that keep logging cheap on hot paths: LazyJson
+defers serialization until a record is actually emitted, and sample_chunk
+limits per-chunk stream logs to every Nth chunk.
+
+Environment variables:
+    LOG_LEVEL: Root level, e.g. INFO (default) or WARNING
+    LOG_LEVELS: Per-subsystem levels, e.g. "bedrock_client=DEBUG,ld_client=WARNING"
+    LOG_FORMAT: "text" (default) or "json"
+    LOG_CHUNK_SAMPLE_EVERY: Log every Nth stream chunk at DEBUG (default 50)
+"""
+
+import contextvars
+import json
+import logging
+import os
+import sys
+import uuid
+from datetime import datetime, timezone
+from typing import Any, Dict
+
+from flask import request
+
+# ID of the request being handled; copied into worker threads with contextvars
+request_id_var: "contextvars.ContextVar[str]" = contextvars.ContextVar("request_id", default="-")
+
+REQUEST_ID_HEADER = "X-Request-ID"
+
+TEXT_FORMAT = "%(asctime)s %(levelname)s [%(name)s] [%(request_id)s] %(message)s"
+
+_chunk_sample_every = 50
+
+
+class RequestIdFilter(logging.Filter):
+    """Adds the current request ID to every record as record.request_id."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = request_id_var.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """Formats each record as a single-line JSON object."""
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "time": datetime.fromtimestamp(record.created, timezone.utc).isoformat(),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "message": record.getMessage()
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class LazyJson:
+    """Serializes a value to JSON only when the log record is formatted."""
+
+    __slots__ = ("value", "kwargs")
+
+    def __init__(self, value: Any, **kwargs):
+        self.value = value
+        self.kwargs = kwargs
+
+    def __str__(self) -> str:
+        return json.dumps(self.value, default=str, **self.kwargs)
+
+
+def sample_chunk(index: int) -> bool:
+    """Return True for the stream chunks that should be logged (the first and every Nth)."""
+    return index % _chunk_sample_every == 0
+
+
+def parse_levels(spec: str) -> Dict[str, str]:
+    """Parse "name=LEVEL,name=LEVEL" into {name: LEVEL}."""
+    levels = {}
+    for item in (spec or "").split(","):
+        name, _, level = item.partition("=")
+        if name.strip() and level.strip():
+            levels[name.strip()] = level.strip().upper()
+    return levels
+
+
+def configure_logging() -> None:
+    """Install the server's log handler and levels from the environment."""
+    global _chunk_sample_every
+    _chunk_sample_every = max(1, int(os.getenv("LOG_CHUNK_SAMPLE_EVERY", "50")))
+
+    handler = logging.StreamHandler(sys.stdout)
+    handler.addFilter(RequestIdFilter())
+    if os.getenv("LOG_FORMAT", "text").lower() == "json":
+        handler.setFormatter(JsonFormatter())
+    else:
+        handler.setFormatter(logging.Formatter(TEXT_FORMAT))
+
+    root = logging.getLogger()
+    for existing in [h for h in root.handlers if getattr(h, "_server_handler", False)]:
+        root.removeHandler(existing)
+    handler._server_handler = True
+    root.addHandler(handler)
+    root.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+
+    for name, level in parse_levels(os.getenv("LOG_LEVELS", "")).items():
+        logging.getLogger(name).setLevel(level)
+
+
+def init_request_ids(app) -> None:
+    """
+    Assign each request an ID for its log records.
+
+    The ID is taken from the X-Request-ID header when the client sends one,
+    otherwise generated, and echoed back in the response header.
+    """
+    @app.before_request
+    def assign_request_id():
+        request_id = request.headers.get(REQUEST_ID_HEADER, "")[:128]
+        request_id_var.set(request_id or uuid.uuid4().hex)
+
+    @app.after_request
+    def add_request_id_header(response):
+        response.headers[REQUEST_ID_HEADER] = request_id_var.get()
+        return response
@@ -1,5 +1,11 @@
+import os
+import math
 import time
 import json
+import logging
+import threading
+from array import array
+from contextlib import contextmanager
 from datetime import datetime
 from typing import Dict, Any, Callable, Optional, List
 
@@ -9,6 +15,184 @@ from ldclient import Context
 from ldclient.config import Config
 from ldai.client import LDAIClient, AIConfig, ModelConfig, LDMessage, ProviderConfig
 
+from latency_histogram import LatencyHistogram
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+# API types recorded per sample, stored as small integer codes
+API_TYPES = ["invoke", "converse"]
+
+STATUS_ERROR = 0
+STATUS_SUCCESS = 1
+
+
+class MetricsRingBuffer:
+    """
+    A fixed-capacity, column-oriented ring buffer of recent model calls.
+    
+    Each column is a typed array preallocated to the buffer capacity, so
+    memory stays constant however many samples are recorded. Once the
+    buffer is full the oldest sample is overwritten.
+    """
+    
+    def __init__(self, capacity=1000):
+        self.capacity = capacity
+        self.timestamps = array('d', [0.0]) * capacity
+        self.latency_ms = array('d', [0.0]) * capacity
+        self.input_tokens = array('q', [0]) * capacity
+        self.output_tokens = array('q', [0]) * capacity
+        self.request_sizes = array('q', [0]) * capacity
+        self.response_sizes = array('q', [0]) * capacity
+        self.statuses = array('b', [0]) * capacity
+        self.api_types = array('b', [0]) * capacity
+        self.model_codes = array('H', [0]) * capacity
+        # NaN marks samples without a time-to-first-token (non-streaming calls)
+        self.ttft_ms = array('d', [math.nan]) * capacity
+        # Error messages are rare, so they are kept in a sparse slot -> message map
+        self.errors = {}
+        # Model IDs are interned; the table only grows with distinct model IDs
+        self.model_ids = []
+        self._model_index = {}
+        self.next_index = 0
+        self.size = 0
+    
+    def _model_code(self, model_id):
+        code = self._model_index.get(model_id)
+        if code is None:
+            code = len(self.model_ids)
+            self.model_ids.append(model_id)
+            self._model_index[model_id] = code
+        return code
+    
+    def append(self, model_id, api_type, timestamp, latency_ms, request_size, input_tokens,
+               status, response_size=0, output_tokens=0, error=None, time_to_first_token_ms=None):
+        """
+        Record one sample, overwriting the oldest one when the buffer is full.
+        
+        Args:
+            model_id (str): The model that was called
+            api_type (str): One of API_TYPES
+            timestamp (float): Request start as a Unix timestamp
+            latency_ms (float): Request latency in milliseconds
+            request_size (int): Request body size in bytes
+            input_tokens (int): Estimated input tokens
+            status (int): STATUS_SUCCESS or STATUS_ERROR
+            response_size (int): Response body size in bytes
+            output_tokens (int): Estimated output tokens
+            error (str, optional): Error message for failed calls
+            time_to_first_token_ms (float, optional): Time to first token for streaming calls
+        """
+        i = self.next_index
+        self.timestamps[i] = timestamp
+        self.latency_ms[i] = latency_ms
+        self.input_tokens[i] = input_tokens
+        self.output_tokens[i] = output_tokens
+        self.request_sizes[i] = request_size
+        self.response_sizes[i] = response_size
+        self.statuses[i] = status
+        self.api_types[i] = API_TYPES.index(api_type)
+        self.model_codes[i] = self._model_code(model_id)
+        self.ttft_ms[i] = math.nan if time_to_first_token_ms is None else time_to_first_token_ms
+        if error is not None:
+            self.errors[i] = error
+        else:
+            self.errors.pop(i, None)
+        
+        self.next_index = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+    
+    def indices(self):
+        """Return the slot indices of the stored samples, oldest first."""
+        start = (self.next_index - self.size) % self.capacity
+        return [(start + offset) % self.capacity for offset in range(self.size)]
+    
+    def to_dict(self, i):
+        """
+        Rebuild the dict representation of the sample stored in slot i.
+        
+        Args:
+            i (int): Slot index
+            
+        Returns:
+            dict: The sample in the format returned by BedrockMetricsTracker.get_metrics
+        """
+        sample = {
+            "model_id": self.model_ids[self.model_codes[i]],
+            "api_type": API_TYPES[self.api_types[i]],
+            "request_timestamp": datetime.utcfromtimestamp(self.timestamps[i]).isoformat(),
+            "request_size_bytes": self.request_sizes[i],
+            "input_token_estimate": self.input_tokens[i],
+            "status": "success" if self.statuses[i] == STATUS_SUCCESS else "error",
+            "latency_ms": int(self.latency_ms[i]),
+            "response_timestamp": datetime.utcfromtimestamp(
+                self.timestamps[i] + self.latency_ms[i] / 1000
+            ).isoformat(),
+        }
+        if not math.isnan(self.ttft_ms[i]):
+            sample["time_to_first_token_ms"] = round(self.ttft_ms[i], 2)
+        if self.statuses[i] == STATUS_SUCCESS:
+            sample["response_size_bytes"] = self.response_sizes[i]
+            sample["output_token_estimate"] = self.output_tokens[i]
+        else:
+            sample["error"] = self.errors.get(i, "")
+        return sample
+
+
+class RequestTimer:
+    """
+    Wall-clock timer that splits a model request into phases.
+    
+    Phases are measured with perf_counter_ns, either with the phase()
+    context manager or with mark(), which closes a phase that started at
+    the previous mark (or when the timer was created):
+    
+        timer = RequestTimer()
+        request_body = build_request()
+        timer.mark("build")
+        with timer.phase("network"):
+            response = client.invoke_model(...)
+        tracker.track_bedrock_invoke_metrics(..., timer=timer)  # times "parse"
+        content = extract_text(response_body)
+        timer.mark("post_process")
+        tracker.track_phases(model_id, "invoke", timer)
+    """
+    
+    def __init__(self):
+        self.start_time = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self._last_ns = self.start_ns
+        self.phases_ns = {}
+    
+    def _add(self, name, duration_ns):
+        self.phases_ns[name] = self.phases_ns.get(name, 0) + duration_ns
+    
+    def mark(self, name):
+        """Record the time since the previous mark or phase as phase `name`."""
+        now = time.perf_counter_ns()
+        self._add(name, now - self._last_ns)
+        self._last_ns = now
+    
+    @contextmanager
+    def phase(self, name):
+        """Time the enclosed block as phase `name`."""
+        start = time.perf_counter_ns()
+        try:
+            yield
+        finally:
+            now = time.perf_counter_ns()
+            self._add(name, now - start)
+            self._last_ns = now
+    
+    def elapsed_ms(self):
+        """Milliseconds since the timer was created."""
+        return (time.perf_counter_ns() - self.start_ns) / 1e6
+    
+    def phases_ms(self):
+        """Duration of each recorded phase in milliseconds, in recording order."""
+        return {name: duration_ns / 1e6 for name, duration_ns in self.phases_ns.items()}
+
 
 class BedrockMetricsTracker:
     """
@@ -16,144 +200,264 @@ class BedrockMetricsTracker:
     This helps monitor performance, latency, and other metrics for AI model usage.
     
     Metrics are sent to LaunchDarkly using the LaunchDarkly AI SDK.
+    
+    Recent samples are kept in a fixed-size ring buffer and the summary is
+    computed from running totals, so memory use and the cost of
+    get_summary_metrics stay constant for the lifetime of the process.
     """
     
-    def __init__(self, ld_client=None):
-        self.metrics = []
+    def __init__(self, ld_client=None, capacity=None):
+        """
+        Args:
+            ld_client: LaunchDarkly client, kept for backward compatibility
+            capacity (int, optional): Number of recent samples to keep,
+                defaults to the METRICS_RING_CAPACITY environment variable
+        """
         self.ld_client = ld_client
+        if capacity is None:
+            capacity = int(os.getenv("METRICS_RING_CAPACITY", "1000"))
+        self.samples = MetricsRingBuffer(capacity)
+        self._lock = threading.Lock()
+        
+        # Running totals over every sample ever recorded
+        self.total_requests = 0
+        self.successful_requests = 0
+        self.total_latency_ms = 0.0
+        self.total_input_tokens = 0
+        self.total_output_tokens = 0
+        
+        # Latency and time-to-first-token histograms, overall and per (model_id, api_type)
+        self.latency_histogram = LatencyHistogram()
+        self.ttft_histogram = LatencyHistogram()
+        self.latency_histograms = {}
+        self.ttft_histograms = {}
+        
+        # Per-phase histograms from RequestTimer: phase -> overall and per (model_id, api_type)
+        self.phase_histogram = {}
+        self.phase_histograms = {}
+        
+        # Response cache lookups, and the tokens cached answers saved
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.cache_saved_input_tokens = 0
+        self.cache_saved_output_tokens = 0
+        
+        # Requests that shared an identical in-flight request's stream
+        self.coalesced_requests = 0
+    
+    @property
+    def metrics(self):
+        """Recent samples as dicts, for code that read the old metrics list."""
+        return self.get_metrics()
     
-    def track_bedrock_invoke_metrics(self, model_id, request_body, response, user_context=None):
+    def _record(self, model_id, api_type, timestamp, latency_ms, request_size, input_tokens,
+                status, response_size=0, output_tokens=0, error=None, time_to_first_token_ms=None):
+        """Append a sample to the ring buffer and update the running totals and histograms."""
+        with self._lock:
+            self.samples.append(
+                model_id, api_type, timestamp, latency_ms, request_size, input_tokens,
+                status, response_size=response_size, output_tokens=output_tokens, error=error,
+                time_to_first_token_ms=time_to_first_token_ms
+            )
+            
+            key = (model_id, api_type)
+            self.latency_histogram.record(latency_ms)
+            self.latency_histograms.setdefault(key, LatencyHistogram()).record(latency_ms)
+            if time_to_first_token_ms is not None:
+                self.ttft_histogram.record(time_to_first_token_ms)
+                self.ttft_histograms.setdefault(key, LatencyHistogram()).record(time_to_first_token_ms)
+            
+            self.total_requests += 1
+            self.total_latency_ms += latency_ms
+            self.total_input_tokens += input_tokens
+            if status == STATUS_SUCCESS:
+                self.successful_requests += 1
+                self.total_output_tokens += output_tokens
+    
+    def track_bedrock_invoke_metrics(self, model_id, request_body, response, user_context=None, *, timer):
         """
-        Track metrics for a Bedrock invoke_model call.
+        Track metrics for a non-streaming Bedrock invoke_model call.
+        
+        The chatbot streams its calls and records them with
+        track_stream_metrics; this is for callers of the plain invoke API.
         
         Args:
             model_id (str): The ID of the model being invoked
             request_body (dict): The request body sent to the model
             response: The response from the model API call
             user_context (dict, optional): The LaunchDarkly user context for tracking
+            timer (RequestTimer): Timer started before the request was built, so
+                the recorded latency covers the whole call and not just parsing
         Returns:
             The response from the model
         """
-        start_time = time.time()
-        start_datetime = datetime.utcnow().isoformat()
-        end_time = time.time()
-        
         # Record request metrics
-        request_metrics = {
-            "model_id": model_id,
-            "request_timestamp": start_datetime,
-            "request_size_bytes": len(json.dumps(request_body)),
-            "input_token_estimate": self._estimate_tokens(request_body),
-        }
+        request_size = len(json.dumps(request_body))
+        input_tokens = self._estimate_tokens(request_body)
         
         try:
             # Parse the response - handle different response formats
-            if 'body' in response and hasattr(response['body'], 'read'):
-                response_body = json.loads(response['body'].read())
-            elif 'body' in response and isinstance(response['body'], str):
-                response_body = json.loads(response['body'])
-            else:
-                # If the response is already parsed
-                response_body = response
+            with timer.phase("parse"):
+                if 'body' in response and hasattr(response['body'], 'read'):
+                    response_body = json.loads(response['body'].read())
+                elif 'body' in response and isinstance(response['body'], str):
+                    response_body = json.loads(response['body'])
+                else:
+                    # If the response is already parsed
+                    response_body = response
             
             # Record response metrics
-            metrics = {
-                **request_metrics,
-                "status": "success",
-                "latency_ms": int((end_time - start_time) * 1000),
-                "response_timestamp": datetime.utcnow().isoformat(),
-                "response_size_bytes": len(json.dumps(response_body)),
-                "output_token_estimate": self._estimate_output_tokens(response_body, model_id),
-            }
-            
-            self.metrics.append(metrics)
-            print(f"Tracked metrics for {model_id}: Latency {metrics['latency_ms']}ms")
-            
-            # Note: LaunchDarkly AI SDK integration is now handled directly in app.py
-            # This local metrics tracker is kept for backward compatibility
+            latency_ms = timer.elapsed_ms()
+            self._record(
+                model_id, "invoke", timer.start_time, latency_ms, request_size, input_tokens,
+                STATUS_SUCCESS,
+                response_size=len(json.dumps(response_body)),
+                output_tokens=self._estimate_output_tokens(response_body, model_id)
+            )
+            logger.info("Tracked metrics for %s: Latency %.1fms", model_id, latency_ms)
             
             return response_body
             
         except Exception as e:
             # Record error metrics
-            metrics = {
-                **request_metrics,
-                "status": "error",
-                "error": str(e),
-                "latency_ms": int((end_time - start_time) * 1000),
-                "response_timestamp": datetime.utcnow().isoformat(),
-            }
-            
-            self.metrics.append(metrics)
-            print(f"Error tracking metrics for {model_id}: {str(e)}")
+            self._record(
+                model_id, "invoke", timer.start_time, timer.elapsed_ms(),
+                request_size, input_tokens, STATUS_ERROR, error=str(e)
+            )
+            logger.error("Error tracking metrics for %s: %s", model_id, e)
             raise e
     
-    def track_bedrock_converse_metrics(self, model_id, request_body, response, user_context=None):
+    def track_bedrock_converse_metrics(self, model_id, request_body, response, user_context=None, *, timer):
         """
-        Track metrics for a Bedrock converse call.
+        Track metrics for a non-streaming Bedrock converse call.
+        
+        Streamed converse_stream calls are recorded with track_stream_metrics.
         
         Args:
             model_id (str): The ID of the model being used
             request_body (dict): The full request body sent to the model
             response: The response from the model API call
             user_context (dict, optional): The LaunchDarkly user context for tracking
+            timer (RequestTimer): Timer started before the request was built, so
+                the recorded latency covers the whole call and not just parsing
         Returns:
             The response from the model
         """
-        start_time = time.time()
-        start_datetime = datetime.utcnow().isoformat()
-        end_time = time.time()
-        
         # Record request metrics
-        request_metrics = {
-            "model_id": model_id,
-            "request_timestamp": start_datetime,
-            "request_size_bytes": len(json.dumps(request_body)),
-            "input_token_estimate": self._estimate_tokens(request_body),
-            "api_type": "converse"
-        }
+        request_size = len(json.dumps(request_body))
+        input_tokens = self._estimate_tokens(request_body)
         
         try:
             # Parse the response - handle different response formats
-            if 'body' in response and hasattr(response['body'], 'read'):
-                response_body = json.loads(response['body'].read())
-            elif 'body' in response and isinstance(response['body'], str):
-                response_body = json.loads(response['body'])
-            else:
-                # If the response is already parsed
-                response_body = response
+            with timer.phase("parse"):
+                if 'body' in response and hasattr(response['body'], 'read'):
+                    response_body = json.loads(response['body'].read())
+                elif 'body' in response and isinstance(response['body'], str):
+                    response_body = json.loads(response['body'])
+                else:
+                    # If the response is already parsed
+                    response_body = response
             
             # Record response metrics
-            metrics = {
-                **request_metrics,
-                "status": "success",
-                "latency_ms": int((end_time - start_time) * 1000),
-                "response_timestamp": datetime.utcnow().isoformat(),
-                "response_size_bytes": len(json.dumps(response_body)),
-                "output_token_estimate": self._estimate_output_tokens_converse(response_body),
-            }
-            
-            self.metrics.append(metrics)
-            print(f"Tracked metrics for {model_id} (converse): Latency {metrics['latency_ms']}ms")
-            
-            # Note: LaunchDarkly AI SDK integration is now handled directly in app.py
-            # This local metrics tracker is kept for backward compatibility
+            latency_ms = timer.elapsed_ms()
+            self._record(
+                model_id, "converse", timer.start_time, latency_ms, request_size, input_tokens,
+                STATUS_SUCCESS,
+                response_size=len(json.dumps(response_body)),
+                output_tokens=self._estimate_output_tokens_converse(response_body)
+            )
+            logger.info("Tracked metrics for %s (converse): Latency %.1fms", model_id, latency_ms)
             
             return response_body
             
         except Exception as e:
             # Record error metrics
-            metrics = {
-                **request_metrics,
-                "status": "error",
-                "error": str(e),
-                "latency_ms": int((end_time - start_time) * 1000),
-                "response_timestamp": datetime.utcnow().isoformat(),
-            }
-            
-            self.metrics.append(metrics)
-            print(f"Error tracking metrics for {model_id} (converse): {str(e)}")
+            self._record(
+                model_id, "converse", timer.start_time, timer.elapsed_ms(),
+                request_size, input_tokens, STATUS_ERROR, error=str(e)
+            )
+            logger.error("Error tracking metrics for %s (converse): %s", model_id, e)
             raise e
+    
+    def track_phases(self, model_id, api_type, timer):
+        """
+        Record the per-phase durations of a request measured with a RequestTimer.
+        
+        Call this once the request is fully handled, so post-processing after
+        the track_bedrock_*_metrics call is included. A "total" phase covering
+        the whole timer is recorded alongside the individual phases.
+        
+        Args:
+            model_id (str): The ID of the model being used
+            api_type (str): "converse" or "invoke"
+            timer (RequestTimer): The timer used for the request
+        """
+        phases = timer.phases_ms()
+        phases["total"] = timer.elapsed_ms()
+        key = (model_id, api_type)
+        with self._lock:
+            for name, duration_ms in phases.items():
+                self.phase_histogram.setdefault(name, LatencyHistogram()).record(duration_ms)
+                self.phase_histograms.setdefault(name, {}).setdefault(key, LatencyHistogram()).record(duration_ms)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Request phases for %s: %s", model_id,
+                         ", ".join(f"{name}={ms:.1f}ms" for name, ms in phases.items()))
+    
+    def track_stream_metrics(self, model_id, api_type, start_time, latency_ms, stream_metrics,
+                             messages=None, response_length=0):
+        """
+        Track metrics for a streamed converse_stream/invoke_model_with_response_stream call.
+        
+        Token counts come from the usage reported in the stream when available,
+        otherwise they are estimated like the non-streaming calls.
+        
+        Answers replayed from the response cache (stream_metrics["cache"] is
+        "hit") did not call the model, so they only count towards the cache
+        hit rate and saved tokens, not the model call metrics. The same goes
+        for requests coalesced onto an identical in-flight request
+        (stream_metrics["coalesced"]), which are only counted.
+        
+        Args:
+            model_id (str): The ID of the model being used
+            api_type (str): "converse" or "invoke"
+            start_time (float): Unix timestamp when the request started
+            latency_ms (float): Wall-clock time until the stream was fully consumed
+            stream_metrics (dict): Metrics collected by BedrockClient.parse_stream
+            messages (list, optional): The messages sent to the model
+            response_length (int): Number of characters streamed back
+        """
+        request_body = {"messages": messages or []}
+        usage = stream_metrics.get("usage") or {}
+        error = stream_metrics.get("error")
+        
+        cache = stream_metrics.get("cache")
+        if cache is not None:
+            with self._lock:
+                if cache == "hit":
+                    self.cache_hits += 1
+                    self.cache_saved_input_tokens += usage.get("inputTokens", 0)
+                    self.cache_saved_output_tokens += usage.get("outputTokens", 0)
+                else:
+                    self.cache_misses += 1
+            if cache == "hit":
+                return
+        
+        if stream_metrics.get("coalesced"):
+            with self._lock:
+                self.coalesced_requests += 1
+            return
+        
+        self._record(
+            model_id, api_type, start_time, latency_ms,
+            len(self._extract_text_from_converse_request(request_body)),
+            usage.get("inputTokens", self._estimate_tokens(request_body)),
+            STATUS_ERROR if error else STATUS_SUCCESS,
+            response_size=response_length,
+            output_tokens=usage.get("outputTokens", max(1, response_length // 4)),
+            error=error,
+            time_to_first_token_ms=stream_metrics.get("metrics", {}).get("timeToFirstToken")
+        )
+    
     def _extract_text_from_request(self, request_body: Dict[str, Any]) -> str:
         """
         Extract text from a request body for Claude or other models.
@@ -356,41 +660,86 @@ class BedrockMetricsTracker:
         
     def get_metrics(self):
         """
-        Get all metrics tracked so far.
+        Get the most recent metrics tracked so far, oldest first.
+        
+        Only the last `capacity` samples are kept; the summary metrics
+        still cover every call since the process started.
         
         Returns:
-            list: All metrics tracked
+            list: Recent metrics tracked
         """
-        return self.metrics
+        with self._lock:
+            return [self.samples.to_dict(i) for i in self.samples.indices()]
     
     def get_summary_metrics(self):
         """
         Get summary metrics (average latency, total tokens, etc.)
         
+        Computed from running totals, so the cost does not depend on how
+        many calls have been tracked.
+        
         Returns:
             dict: Summary metrics
         """
-        if not self.metrics:
+        with self._lock:
+            cache_lookups = self.cache_hits + self.cache_misses
+            response_cache = {
+                "hits": self.cache_hits,
+                "misses": self.cache_misses,
+                "hit_rate": round(self.cache_hits / cache_lookups * 100, 2) if cache_lookups else 0,
+                "saved_input_tokens": self.cache_saved_input_tokens,
+                "saved_output_tokens": self.cache_saved_output_tokens
+            }
+            
+            total_requests = self.total_requests
+            if total_requests == 0:
+                return {
+                    "total_requests": 0,
+                    "avg_latency_ms": 0,
+                    "total_input_tokens": 0,
+                    "total_output_tokens": 0,
+                    "success_rate": 0,
+                    "latency_ms": self.latency_histogram.percentiles(),
+                    "time_to_first_token_ms": self.ttft_histogram.percentiles(),
+                    "phases_ms": {},
+                    "response_cache": response_cache,
+                    "coalesced_requests": self.coalesced_requests
+                }
+            
             return {
-                "total_requests": 0,
-                "avg_latency_ms": 0,
-                "total_input_tokens": 0,
-                "total_output_tokens": 0,
-                "success_rate": 0
+                "total_requests": total_requests,
+                "avg_latency_ms": round(self.total_latency_ms / total_requests, 2),
+                "total_input_tokens": self.total_input_tokens,
+                "total_output_tokens": self.total_output_tokens,
+                "success_rate": round(self.successful_requests / total_requests * 100, 2),
+                "latency_ms": self.latency_histogram.percentiles(),
+                "time_to_first_token_ms": self.ttft_histogram.percentiles(),
+                "phases_ms": {
+                    name: {"mean": round(histogram.total / histogram.count, 3), **histogram.percentiles()}
+                    for name, histogram in self.phase_histogram.items()
+                },
+                "response_cache": response_cache,
+                "coalesced_requests": self.coalesced_requests
             }
+    
+    def get_histograms(self):
+        """
+        Get latency and time-to-first-token histograms per model and API type.
         
-        total_requests = len(self.metrics)
-        successful_requests = sum(1 for m in self.metrics if m.get("status") == "success")
-        
-        # Calculate averages and totals
-        avg_latency = sum(m.get("latency_ms", 0) for m in self.metrics) / total_requests
-        total_input_tokens = sum(m.get("input_token_estimate", 0) for m in self.metrics)
-        total_output_tokens = sum(m.get("output_token_estimate", 0) for m in self.metrics if m.get("status") == "success")
+        Returns:
+            dict: {"latency_ms": {model_id: {api_type: histogram}}, "time_to_first_token_ms": {...},
+                "phases_ms": {phase: {model_id: {api_type: histogram}}}}, where each histogram
+                has its count, percentiles and non-empty bucket counts
+        """
+        def by_model(histograms):
+            result = {}
+            for (model_id, api_type), histogram in histograms.items():
+                result.setdefault(model_id, {})[api_type] = histogram.to_dict()
+            return result
         
-        return {
-            "total_requests": total_requests,
-            "avg_latency_ms": round(avg_latency, 2),
-            "total_input_tokens": total_input_tokens,
-            "total_output_tokens": total_output_tokens,
-            "success_rate": round(successful_requests / total_requests * 100, 2) if total_requests > 0 else 0
-        }
+        with self._lock:
+            return {
+                "latency_ms": by_model(self.latency_histograms),
+                "time_to_first_token_ms": by_model(self.ttft_histograms),
+                "phases_ms": {name: by_model(histograms) for name, histograms in self.phase_histograms.items()}
+            }
@@ -0,0 +1,205 @@
+"""
+Bedrock Response Cache
+
+This module caches complete model answers in front of
+BedrockClient.stream_conversation. Requests are keyed on the model ID, the
+normalized system prompt, every normalized message of the conversation
+and the inference parameters, so a repeated question (in practice the
+first question of a conversation) is answered without calling the model
+again, while answers never cross between different conversations. The
+raw stream events of a successful answer are recorded while it streams,
+and a hit replays them through the same parse_stream path, so callers get
+the same chunks, usage and done events either way; the replayed usage is
+what the metrics tracker reports as tokens saved by the cache.
+
+Entries are evicted least-recently-used first and expire after a TTL.
+
+Environment variables:
+    RESPONSE_CACHE_ENABLED: "false" to turn the cache off (default "true")
+    RESPONSE_CACHE_SIZE: Maximum number of cached answers (default 1000)
+    RESPONSE_CACHE_TTL_SECONDS: Seconds an answer stays cached (default 3600)
+"""
+
+import hashlib
+import json
+import logging
+import os
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+from ttl_cache import TTLCache
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+# Punctuation and whitespace that do not change a question's meaning
+_TRAILING_PUNCTUATION = " \t\n.!?"
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text for cache keys: casefolded, single spaces, no trailing punctuation."""
+    return " ".join(text.casefold().split()).rstrip(_TRAILING_PUNCTUATION)
+
+
+def _message_text(message: Dict[str, Any]) -> str:
+    # Claude messages carry a string, Amazon (Converse) messages a list of content blocks
+    content = message.get("content", "")
+    if isinstance(content, list):
+        return " ".join(str(block.get("text", "")) for block in content if isinstance(block, dict))
+    return str(content)
+
+
+def request_key(model_id: str, system_prompts: List[Dict[str, str]],
+                messages: List[Dict[str, Any]], inference_config: Dict[str, Any],
+                additional_model_fields: Optional[Dict[str, Any]] = None) -> str:
+    """
+    Build a key identifying a Bedrock request.
+
+    Args:
+        model_id: The model ID
+        system_prompts: The system prompts as {"text": ...} dicts
+        messages: The formatted messages (Claude or Amazon format)
+        inference_config: The inference parameters, after numeric conversion
+        additional_model_fields: Additional model fields, if any
+
+    Returns:
+        str: A hex digest of the normalized request
+    """
+    system = normalize_text(" ".join(
+        str(prompt.get("text", "")) if isinstance(prompt, dict) else str(prompt)
+        for prompt in system_prompts or []
+    ))
+    normalized = [[message.get("role", "user"), normalize_text(_message_text(message))] for message in messages]
+    material = json.dumps(
+        [model_id, system, normalized, inference_config, additional_model_fields or {}],
+        sort_keys=True, default=str, separators=(",", ":")
+    )
+    return hashlib.blake2b(material.encode("utf-8"), digest_size=16).hexdigest()
+
+
+class CachedResponse:
+    """The recorded stream events of one answer."""
+
+    __slots__ = ("events",)
+
+    def __init__(self, events: List[Dict[str, Any]]):
+        self.events = events
+
+
+class ReplayStream:
+    """
+    Serves a cached answer with the interface of an EngineStream.
+
+    Replaying takes no model slot, so the chunks are produced on the
+    request thread instead of an engine worker.
+    """
+
+    def __init__(self, chunks: Iterator[str]):
+        self._chunks = chunks
+        self._cancelled = False
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancelled
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        return True
+
+    def wait_for_first_chunk(self, timeout: Optional[float] = None) -> bool:
+        return True
+
+    def cancel(self) -> None:
+        self._cancelled = True
+
+    def __iter__(self) -> Iterator[str]:
+        try:
+            for chunk in self._chunks:
+                if self._cancelled:
+                    break
+                yield chunk
+        finally:
+            close = getattr(self._chunks, "close", None)
+            if close:
+                close()
+            self.cancel()
+
+
+class ResponseCache:
+    """LRU/TTL cache of recorded Bedrock answers, keyed on the normalized request."""
+
+    def __init__(self, maxsize: int = 1000, ttl: float = 3600.0, enabled: bool = True):
+        """
+        Initialize the cache.
+
+        Args:
+            maxsize: Maximum number of cached answers
+            ttl: Seconds an answer stays cached
+            enabled: Whether answers are looked up and stored at all
+        """
+        self.enabled = enabled
+        self._entries = TTLCache(maxsize=maxsize, ttl=ttl)
+        self.stored = 0
+
+    @classmethod
+    def from_env(cls) -> "ResponseCache":
+        """Create a cache configured from the RESPONSE_CACHE_* environment variables."""
+        return cls(
+            maxsize=int(os.getenv("RESPONSE_CACHE_SIZE", "1000")),
+            ttl=float(os.getenv("RESPONSE_CACHE_TTL_SECONDS", "3600")),
+            enabled=os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+        )
+
+    def make_key(self, model_id: str, system_prompts: List[Dict[str, str]],
+                 messages: List[Dict[str, Any]], inference_config: Dict[str, Any],
+                 additional_model_fields: Optional[Dict[str, Any]] = None) -> str:
+        """Build the cache key for a request from its whole conversation (see request_key)."""
+        return request_key(model_id, system_prompts, messages, inference_config, additional_model_fields)
+
+    def get(self, key: str) -> Optional[CachedResponse]:
+        """Return the cached answer for a key, or None."""
+        return self._entries.get(key)
+
+    def record(self, key: str, events: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Pass a live stream's events through, caching them once the stream completes.
+
+        Streams that raise or are abandoned before the end are not cached.
+
+        Args:
+            key: The request's cache key
+            events: The raw Bedrock stream events
+
+        Yields:
+            The same events
+        """
+        recorded = []
+        for event in events:
+            recorded.append(event)
+            yield event
+        self._entries.set(key, CachedResponse(recorded))
+        self.stored += 1
+        logger.debug("Cached response %s (%s events)", key, len(recorded))
+
+    def replay(self, cached: CachedResponse, parse: Callable[[Iterator[Dict[str, Any]]], Iterator[str]]) -> ReplayStream:
+        """
+        Replay a cached answer through the stream parser.
+
+        Args:
+            cached: The cached answer
+            parse: Turns raw events into chunks, e.g. a bound BedrockClient.parse_stream
+
+        Returns:
+            ReplayStream yielding the same chunks as the original answer
+        """
+        return ReplayStream(parse(iter(cached.events)))
+
+    def clear(self) -> None:
+        """Drop every cached answer."""
+        self._entries.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the cache size, hit rate and eviction counters."""
+        return {
+            "enabled": self.enabled,
+            "stored": self.stored,
+            **self._entries.get_stats()
+        }
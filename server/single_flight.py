@@ -0,0 +1,216 @@
+"""
+Single-Flight Request Coalescing
+
+This module lets identical Bedrock requests that arrive while one is
+already streaming share that stream instead of each calling the model.
+The first request (the leader) runs on the execution engine as usual and
+publishes every raw stream event to its flight; requests with the same key
+(followers) attach to the flight, get the events published so far and then
+the rest as they arrive, and parse them with their own parse_stream, so
+each caller still gets its own chunks, metrics and response.
+
+If the leader's client goes away mid-stream while followers are attached,
+the leader keeps reading the model's stream for them. The drain runs on the
+leader's execution engine worker, which still holds the model's slot, and
+never on a request thread (see close_with). Errors raised by the model are
+passed on to every follower.
+
+Environment variables:
+    BEDROCK_SINGLE_FLIGHT_ENABLED: "false" to turn coalescing off (default "true")
+"""
+
+import logging
+import os
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from response_cache import ReplayStream
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+
+def close_with(chunks: Iterator[str], source: Iterator[Dict[str, Any]]) -> Iterator[str]:
+    """
+    Pass the leader's parsed chunks through, closing the raw source as soon as
+    the chunks are closed.
+
+    The engine closes a producer's iterator on its worker thread when the
+    consumer goes away, so closing the source here starts an abandoned
+    leader's drain right there instead of whenever (and on whichever thread)
+    the source happens to be garbage collected.
+    """
+    try:
+        return (yield from chunks)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close:
+            close()
+        source.close()
+
+
+class Flight:
+    """The events of one in-progress stream, shared by its leader and followers."""
+
+    def __init__(self, key: str):
+        self.key = key
+        self.events: List[Dict[str, Any]] = []
+        self.done = False
+        self.error: Optional[Exception] = None
+        self.followers = 0
+        self._cond = threading.Condition()
+
+    def publish(self, event: Dict[str, Any]) -> None:
+        with self._cond:
+            self.events.append(event)
+            self._cond.notify_all()
+
+    def finish(self, error: Optional[Exception] = None) -> None:
+        with self._cond:
+            if self.done:
+                return
+            self.done = True
+            self.error = error
+            self._cond.notify_all()
+
+    def wait_started(self, timeout: Optional[float] = None) -> bool:
+        """Block until the first event is published or the flight has finished."""
+        with self._cond:
+            return bool(self._cond.wait_for(lambda: self.events or self.done, timeout))
+
+    def subscribe(self) -> Iterator[Dict[str, Any]]:
+        """
+        Iterate over every event of the flight, from the first one.
+
+        Raises:
+            Exception: The error the stream failed with, after its last event
+        """
+        index = 0
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: index < len(self.events) or self.done)
+                batch = self.events[index:]
+                finished = self.done
+            index += len(batch)
+            for event in batch:
+                yield event
+            if finished:
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class FlightStream(ReplayStream):
+    """Follower side of a flight, with the interface of an EngineStream."""
+
+    def __init__(self, flight: Flight, parse: Callable[[Iterator[Dict[str, Any]]], Iterator[str]]):
+        super().__init__(parse(flight.subscribe()))
+        self._flight = flight
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until the leader's stream has started, re-raising errors from starting it."""
+        started = self._flight.wait_started(timeout)
+        if self._flight.error is not None and not self._flight.events:
+            raise self._flight.error
+        return started
+
+    def wait_for_first_chunk(self, timeout: Optional[float] = None) -> bool:
+        return self._flight.wait_started(timeout)
+
+
+class SingleFlight:
+    """In-progress flights by request key."""
+
+    def __init__(self, enabled: bool = True):
+        """
+        Initialize the coalescing layer.
+
+        Args:
+            enabled: Whether identical concurrent requests share a stream
+        """
+        self.enabled = enabled
+        self._flights: Dict[str, Flight] = {}
+        self._lock = threading.Lock()
+        self.leaders = 0
+        self.followers = 0
+        self.drained = 0
+
+    @classmethod
+    def from_env(cls) -> "SingleFlight":
+        """Create the coalescing layer configured from the environment."""
+        return cls(enabled=os.getenv("BEDROCK_SINGLE_FLIGHT_ENABLED", "true").lower() == "true")
+
+    def join(self, key: str) -> Tuple[Flight, bool]:
+        """
+        Attach to the flight for a key, or start one.
+
+        Returns:
+            tuple: (flight, True if the caller is the leader and must run the stream)
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            if flight is not None:
+                flight.followers += 1
+                self.followers += 1
+                return flight, False
+            flight = Flight(key)
+            self._flights[key] = flight
+            self.leaders += 1
+            return flight, True
+
+    def _forget(self, flight: Flight) -> int:
+        # Returns the number of followers, which cannot change once the flight is forgotten
+        with self._lock:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            return flight.followers
+
+    def fail(self, flight: Flight, error: Exception) -> None:
+        """Finish a flight whose stream could not be started or failed."""
+        self._forget(flight)
+        flight.finish(error)
+
+    def lead(self, flight: Flight, events: Iterator[Dict[str, Any]]) -> Iterator[Dict[str, Any]]:
+        """
+        Pass the leader's raw stream events through, publishing them to the flight.
+
+        Args:
+            flight: The flight returned by join for the leader
+            events: The raw Bedrock stream events
+
+        Yields:
+            The same events
+        """
+        completed = False
+        try:
+            for event in events:
+                flight.publish(event)
+                yield event
+            completed = True
+        except Exception as e:
+            self.fail(flight, e)
+            raise
+        finally:
+            if not flight.done:
+                followers = self._forget(flight)
+                if not completed and followers:
+                    # The leader's consumer went away; finish the stream for the followers
+                    self.drained += 1
+                    logger.info("Leader of flight %s abandoned, streaming on for %s followers", flight.key, followers)
+                    try:
+                        for event in events:
+                            flight.publish(event)
+                    except Exception as e:
+                        flight.finish(e)
+                flight.finish()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Get the number of in-progress flights and how many requests were coalesced."""
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "in_flight": len(self._flights),
+                "leaders": self.leaders,
+                "followers": self.followers,
+                "drained": self.drained
+            }
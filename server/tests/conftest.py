@@ -0,0 +1,124 @@
+"""
+Shared fixtures for the server tests.
+
+Model calls go to the local FakeBedrockRuntime (see fake_bedrock), one per
+model ID, and LaunchDarkly runs offline, so the tests need neither AWS nor
+network access.
+"""
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ldclient import Context  # noqa: E402
+
+from bedrock_client import BedrockClient  # noqa: E402
+from bedrock_engine import BedrockExecutionEngine  # noqa: E402
+from chat_pipeline import ChatPipeline, ChatTurn, RetryPolicy  # noqa: E402
+from circuit_breaker import CircuitBreakerRegistry  # noqa: E402
+from context_window import ContextWindowBuilder  # noqa: E402
+from conversation_store import ConversationStore  # noqa: E402
+from fake_bedrock import FakeBedrockRuntime  # noqa: E402
+from ld_client import LaunchDarklyClient  # noqa: E402
+from metrics_tracker import BedrockMetricsTracker  # noqa: E402
+from response_cache import ResponseCache  # noqa: E402
+from single_flight import SingleFlight  # noqa: E402
+
+PRIMARY_MODEL = "amazon.nova-lite-v1:0"
+FALLBACK_MODEL = "anthropic.claude-3-sonnet-20240229-v1:0"
+
+
+def fake_runtime(**settings) -> FakeBedrockRuntime:
+    """A fake Bedrock with fast, repeatable answers unless settings say otherwise."""
+    options = {"ttft_ms": 0, "tokens_per_second": 0, "output_tokens": 5, "jitter": 0, "seed": 1}
+    options.update(settings)
+    return FakeBedrockRuntime(**options)
+
+
+class ModelRouter:
+    """Transport that sends each model's calls to its own FakeBedrockRuntime."""
+
+    def __init__(self, default: FakeBedrockRuntime):
+        self.default = default
+        self.models = {}
+
+    def runtime(self, model_id: str) -> FakeBedrockRuntime:
+        return self.models.get(model_id, self.default)
+
+    def converse_stream(self, modelId: str, **kwargs):
+        return self.runtime(modelId).converse_stream(modelId=modelId, **kwargs)
+
+    def invoke_model_with_response_stream(self, modelId: str, **kwargs):
+        return self.runtime(modelId).invoke_model_with_response_stream(modelId=modelId, **kwargs)
+
+
+@pytest.fixture
+def engine():
+    engine = BedrockExecutionEngine(max_concurrency_per_model=8, max_queue_depth=8, max_workers=16)
+    yield engine
+    engine.shutdown(wait=True)
+
+
+@pytest.fixture
+def transport():
+    return ModelRouter(fake_runtime())
+
+
+@pytest.fixture
+def bedrock(transport, engine):
+    return BedrockClient(
+        region_name="us-east-1",
+        engine=engine,
+        response_cache=ResponseCache(enabled=False),
+        single_flight=SingleFlight(enabled=False),
+        transport=transport
+    )
+
+
+@pytest.fixture(scope="session")
+def ld():
+    client = LaunchDarklyClient("test-sdk-key", offline=True, cache_ttl=0)
+    yield client
+    client.close()
+
+
+@pytest.fixture
+def ai_config_model(ld, monkeypatch):
+    """Serve an AI config for the given model instead of the offline fallback."""
+    original = ld.ld_client.variation
+
+    def use(model_id: str) -> None:
+        value = ld.fallback_config.to_dict()
+        value["model"] = dict(value["model"], name=model_id)
+        value["_ldMeta"] = dict(value.get("_ldMeta", {}), enabled=True)
+
+        def variation(key, context, default):
+            return value if key == ld.ai_config_id else original(key, context, default)
+        monkeypatch.setattr(ld.ld_client, "variation", variation)
+
+    return use
+
+
+@pytest.fixture
+def pipeline(ld, bedrock):
+    return ChatPipeline(
+        ld, bedrock, ConversationStore(), ContextWindowBuilder(), BedrockMetricsTracker(),
+        create_context=lambda user_id: Context.builder(user_id).build(),
+        retry_policy=RetryPolicy(max_attempts=1, deadline=5.0),
+        breakers=CircuitBreakerRegistry(min_calls=3, error_rate=0.5, reset_timeout=30.0),
+        hedge_after_ms=0
+    )
+
+
+def run_turn(pipeline: ChatPipeline, message: str, user_id: str = "user-1") -> ChatTurn:
+    """Run one chatbot turn through every stage, as the buffered endpoint does."""
+    turn = ChatTurn(user_id, [], message=message)
+    pipeline.context(turn)
+    pipeline.prepare(turn)
+    for _ in pipeline.parse(turn):
+        pass
+    pipeline.track(turn)
+    return turn
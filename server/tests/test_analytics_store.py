@@ -0,0 +1,76 @@
+import pytest
+
+from analytics_store import AnalyticsStore, StringTable, parse_timestamp
+
+
+def view(variation, user="user-1", **fields):
+    return {"type": "view", "variation": variation, "userId": user, **fields}
+
+
+def click(variation, user="user-1", **fields):
+    return {"type": "click", "variation": variation, "userId": user, **fields}
+
+
+def test_results_come_from_the_running_counters():
+    store = AnalyticsStore()
+    store.append_many([view("variation_1")] * 4 + [click("variation_1")] + [view("variation_2")])
+
+    results = store.results()
+    assert results["variation_1"] == {"clicks": 1, "views": 4, "ctr": 25.0}
+    assert results["variation_2"] == {"clicks": 0, "views": 1, "ctr": 0}
+    assert results["variation_3"] == {"clicks": 0, "views": 0, "ctr": 0}
+    assert store.count("view") == 5
+    assert store.count("purchase") == 0
+
+
+def test_time_windows_count_only_the_events_inside_them():
+    store = AnalyticsStore(chunk_size=4)
+    for second in range(12):
+        store.append(view("variation_1"), timestamp=1000.0 + second)
+
+    assert len(store.chunks) == 3
+    assert store.count("view", "variation_1", since=1002, until=1010) == 8
+    assert store.results(since=1011)["variation_1"]["views"] == 1
+
+
+def test_events_keep_their_extra_fields():
+    store = AnalyticsStore()
+    store.append(click("variation_3", serviceId=7), timestamp=50.0)
+
+    assert list(store.events()) == [
+        {"type": "click", "variation": "variation_3", "userId": "user-1", "serviceId": 7, "timestamp": 50.0}
+    ]
+
+
+def test_client_timestamps_are_kept_within_the_clock_skew():
+    store = AnalyticsStore(max_clock_skew=60)
+    received = 1_000_000.0
+    store.append_many([
+        view("variation_1", timestamp=received - 30),
+        view("variation_1", timestamp="1970-01-12T13:46:10Z"),
+        view("variation_1", timestamp=received + 3600),
+        view("variation_1", timestamp="yesterday"),
+        view("variation_1")
+    ], timestamp=received)
+
+    assert [event["timestamp"] - received for event in store.events()] == [-30, -30, 60, 0, 0]
+
+
+@pytest.mark.parametrize("value, expected", [
+    (12.5, 12.5), ("12.5", 12.5), ("1970-01-01T00:01:00", 60.0), ("1970-01-01T01:00:00+01:00", 0.0),
+    (None, None), (True, None), ("nan", None), ({"at": 1}, None)
+])
+def test_parse_timestamp(value, expected):
+    assert parse_timestamp(value) == expected
+
+
+def test_full_string_table_rejects_the_whole_batch():
+    store = AnalyticsStore()
+    store.users = StringTable(max_size=3)
+
+    with pytest.raises(ValueError):
+        store.append_many([view("variation_1", user=f"user-{n}") for n in range(3)])
+    assert len(store) == 0
+
+    store.append_many([view("variation_1", user=f"user-{n}") for n in range(2)])
+    assert store.count("view") == 2
@@ -0,0 +1,63 @@
+import threading
+
+import pytest
+
+from analytics_store import AnalyticsStore, AnalyticsWriter
+
+
+@pytest.fixture
+def store():
+    return AnalyticsStore()
+
+
+def view(user):
+    return {"type": "view", "variation": "variation_1", "userId": user}
+
+
+def test_queued_batches_are_merged_into_few_writes(store):
+    writer = AnalyticsWriter(store, batch_size=1000, flush_interval=0.2)
+    for n in range(10):
+        assert writer.submit([view(f"user-{n}")] * 10)
+    writer.flush()
+
+    stats = writer.get_stats()
+    assert store.count("view") == stats["written"] == 100
+    assert stats["writes"] < 10
+    assert stats["pending"] == 0
+    writer.close()
+
+
+def test_submissions_beyond_the_pending_limit_are_refused(store):
+    release = threading.Event()
+    append_batches = store.append_batches
+    store.append_batches = lambda batches: release.wait(5) and append_batches(batches)
+    writer = AnalyticsWriter(store, max_pending=10, flush_interval=0)
+
+    assert writer.submit([view("a")] * 8)
+    assert not writer.submit([view("b")] * 3)
+    assert writer.submit([view("c")] * 2)
+
+    release.set()
+    writer.close()
+    stats = writer.get_stats()
+    assert (stats["accepted"], stats["rejected"], stats["written"]) == (10, 3, 10)
+
+
+def test_a_bad_batch_does_not_drop_the_batches_merged_with_it(store):
+    writer = AnalyticsWriter(store, flush_interval=0.2)
+    writer.submit([view("a")])
+    writer.submit([{"type": "view", "userId": "u" * 0x10000}])
+    writer.submit([view("b")])
+    writer.flush()
+
+    assert store.count("view") == 2
+    writer.close()
+
+
+def test_close_writes_what_is_queued_and_refuses_more(store):
+    writer = AnalyticsWriter(store, flush_interval=1.0)
+    writer.submit([view("a")] * 5)
+    writer.close()
+
+    assert store.count("view") == 5
+    assert not writer.submit([view("b")])
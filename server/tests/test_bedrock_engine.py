@@ -0,0 +1,95 @@
+import threading
+import time
+
+import pytest
+
+from bedrock_engine import BedrockExecutionEngine, EngineSaturatedError
+
+
+@pytest.fixture
+def small_engine():
+    engine = BedrockExecutionEngine(max_concurrency_per_model=1, max_queue_depth=1, queue_timeout=0.2, max_workers=4)
+    yield engine
+    engine.shutdown(wait=True)
+
+
+def blocking_producer(started: threading.Event, release: threading.Event):
+    def produce():
+        started.set()
+        release.wait(5)
+        return iter(["done"])
+    return produce
+
+
+def test_chunks_reach_the_consumer(small_engine):
+    stream = small_engine.submit("model", lambda: iter(["a", "b", "c"]))
+
+    assert stream.wait_until_ready(1.0)
+    assert list(stream) == ["a", "b", "c"]
+
+
+def test_errors_starting_the_call_are_raised_to_the_caller(small_engine):
+    def produce():
+        raise RuntimeError("access denied")
+
+    stream = small_engine.submit("model", produce)
+    with pytest.raises(RuntimeError, match="access denied"):
+        stream.wait_until_ready(1.0)
+
+
+def test_requests_queue_for_a_slot_and_are_shed_once_the_queue_is_full(small_engine):
+    started, release = threading.Event(), threading.Event()
+    first = small_engine.submit("model", blocking_producer(started, release))
+    assert started.wait(1.0)
+
+    waiter = {}
+    queued = threading.Thread(target=lambda: waiter.update(stream=small_engine.submit("model", lambda: iter(["x"]))))
+    queued.start()
+    while small_engine.get_stats()["queue_depth"] == 0:
+        time.sleep(0.001)
+
+    # The slot is busy and the one queue place is taken
+    with pytest.raises(EngineSaturatedError) as error:
+        small_engine.submit("model", lambda: iter([]))
+    assert error.value.retry_after >= 1
+    # Other models have their own slots
+    assert list(small_engine.submit("other", lambda: iter(["y"]))) == ["y"]
+
+    release.set()
+    queued.join(1.0)
+    assert list(first) == ["done"]
+    assert list(waiter["stream"]) == ["x"]
+    stats = small_engine.get_stats()["models"]["model"]
+    assert (stats["admitted"], stats["rejected"], stats["active"]) == (2, 1, 0)
+
+
+def test_queued_request_times_out(small_engine):
+    started, release = threading.Event(), threading.Event()
+    small_engine.submit("model", blocking_producer(started, release))
+    assert started.wait(1.0)
+
+    with pytest.raises(EngineSaturatedError):
+        small_engine.submit("model", lambda: iter([]))
+    release.set()
+
+
+def test_abandoning_the_stream_stops_the_producer(small_engine):
+    closed = threading.Event()
+
+    def produce():
+        def chunks():
+            try:
+                while True:
+                    yield "chunk"
+            finally:
+                closed.set()
+        return chunks()
+
+    stream = small_engine.submit("model", produce)
+    chunks = iter(stream)
+    next(chunks)
+    chunks.close()
+
+    assert closed.wait(2.0)
+    # The slot is free again
+    assert list(small_engine.submit("model", lambda: iter(["next"]))) == ["next"]
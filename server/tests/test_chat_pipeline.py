@@ -0,0 +1,77 @@
+import pytest
+from botocore.exceptions import ClientError
+from conftest import FALLBACK_MODEL, PRIMARY_MODEL, fake_runtime, run_turn
+
+from circuit_breaker import STATE_OPEN
+
+
+def test_turn_streams_the_fake_models_answer(pipeline, ai_config_model):
+    ai_config_model(PRIMARY_MODEL)
+    turn = run_turn(pipeline, "Which yoga class suits beginners?")
+
+    assert turn.error is None
+    assert turn.model_id == PRIMARY_MODEL
+    assert len(turn.reply.split()) == 5
+    assert pipeline.breakers.get(PRIMARY_MODEL).get_stats()["successes"] == 1
+
+
+def test_open_circuit_fails_fast_to_the_fallback_model(pipeline, transport, ai_config_model):
+    ai_config_model(PRIMARY_MODEL)
+    failing = transport.models[PRIMARY_MODEL] = fake_runtime(error_rate=1.0, error_code="ValidationException")
+
+    for i in range(3):
+        with pytest.raises(ClientError):
+            run_turn(pipeline, f"question {i}")
+    assert pipeline.breakers.get(PRIMARY_MODEL).state == STATE_OPEN
+    calls = failing.calls
+
+    turn = run_turn(pipeline, "question after the circuit opened")
+    assert turn.error is None
+    assert turn.model_id == FALLBACK_MODEL
+    assert turn.fallback
+    # The open circuit refused the call without reaching the failing model
+    assert failing.calls == calls
+    assert pipeline.fallbacks == 1
+
+
+def test_hedge_fires_when_the_first_token_is_late_and_the_faster_stream_wins(pipeline, transport, ai_config_model):
+    ai_config_model(PRIMARY_MODEL)
+    transport.models[PRIMARY_MODEL] = fake_runtime(ttft_ms=1000)
+    hedge = transport.models[FALLBACK_MODEL] = fake_runtime(ttft_ms=10)
+    pipeline.hedge_after_ms = 50
+
+    turn = run_turn(pipeline, "hedge me")
+
+    assert turn.error is None
+    assert turn.model_id == FALLBACK_MODEL
+    assert turn.reply
+    assert hedge.calls == 1
+    assert (pipeline.hedges, pipeline.hedge_wins) == (1, 1)
+    # The losing primary's wait counts against it as a slow call, not a failure
+    assert pipeline.breakers.get(PRIMARY_MODEL).get_stats()["failures"] == 0
+
+
+def test_primary_keeps_the_turn_when_it_answers_before_the_hedge(pipeline, transport, ai_config_model):
+    ai_config_model(PRIMARY_MODEL)
+    transport.models[PRIMARY_MODEL] = fake_runtime(ttft_ms=150)
+    transport.models[FALLBACK_MODEL] = fake_runtime(ttft_ms=2000)
+    pipeline.hedge_after_ms = 50
+
+    turn = run_turn(pipeline, "no hedge needed")
+
+    assert turn.error is None
+    assert turn.model_id == PRIMARY_MODEL
+    assert (pipeline.hedges, pipeline.hedge_wins) == (1, 0)
+    assert not pipeline.breakers.get(FALLBACK_MODEL).trial_in_flight
+
+
+def test_no_hedge_when_the_first_token_is_on_time(pipeline, transport, ai_config_model):
+    ai_config_model(PRIMARY_MODEL)
+    hedge = transport.models[FALLBACK_MODEL] = fake_runtime()
+    pipeline.hedge_after_ms = 500
+
+    turn = run_turn(pipeline, "fast answer")
+
+    assert turn.model_id == PRIMARY_MODEL
+    assert pipeline.hedges == 0
+    assert hedge.calls == 0
@@ -0,0 +1,84 @@
+import time
+
+import pytest
+
+from circuit_breaker import STATE_CLOSED, STATE_HALF_OPEN, STATE_OPEN, CircuitBreaker, CircuitOpenError
+
+
+def test_opens_on_error_rate_once_the_window_has_enough_calls():
+    breaker = CircuitBreaker("model", min_calls=4, error_rate=0.5)
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_failure()
+    assert breaker.state == STATE_CLOSED
+
+    breaker.record_success()
+    assert breaker.state == STATE_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_opens_on_slow_call_rate():
+    breaker = CircuitBreaker("model", min_calls=3, slow_call_ms=100, slow_call_rate=0.6)
+    breaker.record_success(latency_ms=500)
+    breaker.record_success(latency_ms=10)
+    assert breaker.state == STATE_CLOSED
+
+    breaker.record_success(latency_ms=500)
+    assert breaker.state == STATE_OPEN
+
+
+def test_calls_outside_the_window_are_forgotten():
+    breaker = CircuitBreaker("model", window_seconds=0.05, min_calls=2, error_rate=0.5)
+    breaker.record_failure()
+    time.sleep(0.06)
+    breaker.record_success()
+    assert breaker.state == STATE_CLOSED
+    assert breaker.get_stats()["window_calls"] == 1
+
+
+def test_half_open_trial_closes_the_circuit_on_success():
+    breaker = CircuitBreaker("model", min_calls=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+
+    assert breaker.before_call() is True
+    assert breaker.state == STATE_HALF_OPEN
+    # Only one trial at a time
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    breaker.record_success(latency_ms=10)
+    assert breaker.state == STATE_CLOSED
+    assert breaker.before_call() is False
+
+
+def test_failed_or_slow_trial_reopens_the_circuit():
+    breaker = CircuitBreaker("model", min_calls=1, slow_call_ms=100, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.before_call() is True
+    breaker.record_success(latency_ms=500)
+    assert breaker.state == STATE_OPEN
+    assert breaker.times_opened == 2
+
+
+def test_released_trial_lets_the_next_call_try():
+    breaker = CircuitBreaker("model", min_calls=1, reset_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.before_call() is True
+    breaker.release()
+    assert breaker.before_call() is True
+
+
+def test_lost_trial_permit_expires():
+    breaker = CircuitBreaker("model", min_calls=1, reset_timeout=0.05, trial_timeout=0.05)
+    breaker.record_failure()
+    time.sleep(0.06)
+    assert breaker.before_call() is True
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+    time.sleep(0.06)
+    assert breaker.before_call() is True
@@ -0,0 +1,66 @@
+import threading
+
+from event_dispatcher import EventDispatcher
+
+
+def noop():
+    pass
+
+
+def test_calls_are_delivered_in_batches_off_the_caller_thread():
+    calls = []
+    dispatcher = EventDispatcher(batch_size=10)
+    for n in range(25):
+        assert dispatcher.dispatch(lambda n=n: calls.append((n, threading.current_thread().name)))
+    dispatcher.flush()
+
+    assert [n for n, _ in calls] == list(range(25))
+    assert {thread for _, thread in calls} == {"event-dispatcher"}
+    stats = dispatcher.get_stats()
+    assert (stats["dispatched"], stats["delivered"], stats["queued"]) == (25, 25, 0)
+    assert stats["batches"] >= 3
+    dispatcher.close()
+
+
+def test_failed_call_is_counted_and_does_not_stop_the_batch():
+    calls = []
+    dispatcher = EventDispatcher()
+
+    def fail():
+        raise RuntimeError("LaunchDarkly unavailable")
+
+    dispatcher.dispatch(fail)
+    dispatcher.dispatch(calls.append, "after")
+    dispatcher.flush()
+
+    assert calls == ["after"]
+    stats = dispatcher.get_stats()
+    assert (stats["delivered"], stats["failed"]) == (1, 1)
+    dispatcher.close()
+
+
+def test_calls_are_dropped_when_the_queue_is_full():
+    release = threading.Event()
+    dispatcher = EventDispatcher(max_queue=2)
+    started = threading.Event()
+    dispatcher.dispatch(lambda: started.set() or release.wait(5))
+    assert started.wait(1.0)
+
+    assert dispatcher.dispatch(noop)
+    assert dispatcher.dispatch(noop)
+    assert not dispatcher.dispatch(noop)
+    assert dispatcher.get_stats()["dropped"] == 1
+    release.set()
+    dispatcher.close()
+
+
+def test_close_delivers_what_is_queued_and_refuses_more():
+    calls = []
+    dispatcher = EventDispatcher()
+    for n in range(5):
+        dispatcher.dispatch(calls.append, n)
+    dispatcher.close()
+
+    assert calls == list(range(5))
+    assert not dispatcher.dispatch(calls.append, 5)
+    assert dispatcher.get_stats()["dropped"] == 1
@@ -0,0 +1,124 @@
+import os
+import time
+
+import pytest
+
+from analytics_store import AnalyticsStore
+from event_log import EventLog, decode_event, encode_record
+
+
+@pytest.fixture
+def open_log(tmp_path):
+    logs = []
+
+    def open_log(**settings):
+        # No background maintenance; the tests sync and compact explicitly
+        settings.setdefault("fsync_interval", 3600)
+        log = EventLog(str(tmp_path), **settings)
+        logs.append(log)
+        return log
+
+    yield open_log
+    for log in logs:
+        log.close()
+
+
+def event(n, event_type="view"):
+    return {"type": event_type, "variation": f"variation_{n % 3}", "userId": f"user-{n}", "serviceId": n}
+
+
+def segment_files(log):
+    return sorted(name for name in os.listdir(log.directory) if name.endswith(".log"))
+
+
+def test_overlong_header_fields_are_rejected(open_log):
+    log = open_log()
+    with pytest.raises(ValueError):
+        log.append(1.0, {"type": "view", "userId": "u" * 0x10000})
+    assert list(log.scan()) == []
+
+
+def test_events_survive_a_restart(open_log):
+    log = open_log()
+    log.append_many((float(n), event(n)) for n in range(10))
+    log.close()
+
+    reopened = open_log()
+    assert [decode_event(record) for record in reopened.scan()] == [(float(n), event(n)) for n in range(10)]
+    assert [record[0] for record in reopened.scan(since=3, until=6)] == [3.0, 4.0, 5.0]
+
+
+def test_torn_record_at_the_end_is_dropped_on_open(open_log):
+    log = open_log()
+    log.append_many((float(n), event(n)) for n in range(3))
+    log.close()
+    with open(os.path.join(log.directory, segment_files(log)[-1]), "ab") as f:
+        f.write(encode_record(3.0, event(3))[:-4])
+
+    reopened = open_log()
+    assert len(list(reopened.scan())) == 3
+    reopened.append(4.0, event(4))
+    assert [record[0] for record in reopened.scan()] == [0.0, 1.0, 2.0, 4.0]
+
+
+def test_compaction_merges_sealed_segments(open_log):
+    log = open_log(segment_max_bytes=200)
+    log.append_many((float(n), event(n)) for n in range(20))
+    before = list(log.scan())
+    assert len(segment_files(log)) > 3
+
+    assert log.compact() == 0
+    assert len(segment_files(log)) == 2
+    assert list(log.scan()) == before
+    assert log.count_by_variation()[("variation_0", "view")] == 7
+
+
+def test_compaction_drops_records_past_retention(open_log):
+    log = open_log(segment_max_bytes=200, retention_seconds=60)
+    log.append_many((float(n), event(n)) for n in range(10))
+    log.append_many((time.time(), event(n)) for n in range(10))
+    log._rotate()
+
+    assert log.compact() == 10
+    assert len(list(log.scan())) == 10
+
+
+def test_scan_keeps_every_record_when_compaction_runs_mid_scan(open_log):
+    log = open_log(segment_max_bytes=200)
+    log.append_many((float(n), event(n)) for n in range(20))
+
+    scan = log.scan()
+    seen = [next(scan)[0]]
+    log.compact()
+    seen.extend(record[0] for record in scan)
+
+    assert seen == [float(n) for n in range(20)]
+
+
+def test_interrupted_compaction_is_completed_on_open(open_log):
+    log = open_log(segment_max_bytes=200)
+    log.append_many((float(n), event(n)) for n in range(20))
+    log.close()
+    sealed = segment_files(log)[:-1]
+    first, last = int(sealed[0][8:16]), int(sealed[-1][8:16])
+    # A crash after the merged segment was renamed into place but before the old ones were removed
+    with open(os.path.join(log.directory, f"segment-{first:08d}-{last:08d}.compacted"), "wb") as out:
+        for name in sealed:
+            with open(os.path.join(log.directory, name), "rb") as f:
+                out.write(f.read())
+
+    reopened = open_log()
+    assert len(segment_files(reopened)) == 2
+    assert [record[0] for record in reopened.scan()] == [float(n) for n in range(20)]
+
+
+def test_store_replays_the_log_on_startup(open_log):
+    log = open_log()
+    store = AnalyticsStore(log=log)
+    store.append_many([event(n) for n in range(6)] + [event(n, "click") for n in range(3)], timestamp=100.0)
+    store.close()
+
+    replayed = AnalyticsStore(log=open_log())
+    assert replayed.replayed == 9
+    assert replayed.count("view", "variation_0") == 2
+    assert replayed.count("click") == 3
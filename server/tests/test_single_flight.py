@@ -0,0 +1,132 @@
+import pytest
+from conftest import PRIMARY_MODEL, fake_runtime
+
+from single_flight import Flight, FlightStream, SingleFlight
+
+EVENTS = [{"n": i} for i in range(5)]
+
+
+def test_followers_attach_to_the_leaders_flight():
+    flights = SingleFlight()
+    flight, leader = flights.join("key")
+    other, follower_leads = flights.join("key")
+
+    assert leader and not follower_leads
+    assert other is flight
+    assert flights.join("other key")[1]
+
+    subscription = flight.subscribe()
+    assert list(flights.lead(flight, iter(EVENTS))) == EVENTS
+    assert list(subscription) == EVENTS
+    stats = flights.get_stats()
+    assert (stats["leaders"], stats["followers"], stats["in_flight"]) == (2, 1, 1)
+
+
+def test_finished_flight_is_not_joined_again():
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    list(flights.lead(flight, iter(EVENTS)))
+
+    assert flights.join("key")[1]
+
+
+def test_abandoned_leader_drains_the_stream_for_its_followers():
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    flights.join("key")
+
+    led = flights.lead(flight, iter(EVENTS))
+    assert next(led) == EVENTS[0]
+    led.close()
+
+    assert flight.done and flight.error is None
+    assert list(flight.subscribe()) == EVENTS
+    assert flights.drained == 1
+
+
+def test_abandoned_leader_without_followers_stops_reading():
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    source = iter(EVENTS)
+
+    led = flights.lead(flight, source)
+    next(led)
+    led.close()
+
+    assert flights.drained == 0
+    assert next(source) == EVENTS[1]
+
+
+def test_stream_error_reaches_every_follower():
+    def failing():
+        yield EVENTS[0]
+        raise RuntimeError("stream broke")
+
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    with pytest.raises(RuntimeError):
+        list(flights.lead(flight, failing()))
+
+    received = []
+    with pytest.raises(RuntimeError, match="stream broke"):
+        for event in flight.subscribe():
+            received.append(event)
+    assert received == EVENTS[:1]
+
+
+def test_follower_sees_the_error_of_a_leader_that_never_started():
+    flights = SingleFlight()
+    flight, _ = flights.join("key")
+    follower = FlightStream(flight, lambda events: (str(event["n"]) for event in events))
+
+    flights.fail(flight, RuntimeError("access denied"))
+
+    with pytest.raises(RuntimeError, match="access denied"):
+        follower.wait_until_ready(1.0)
+
+
+def test_wait_started_times_out_on_an_idle_flight():
+    assert not Flight("key").wait_started(0.01)
+
+
+@pytest.fixture
+def coalescing(bedrock, transport):
+    bedrock.single_flight = SingleFlight()
+    # Slow enough that the second request arrives while the first is streaming
+    transport.models[PRIMARY_MODEL] = fake_runtime(ttft_ms=100, tokens_per_second=200, output_tokens=20)
+    return bedrock
+
+
+def submit(client, metrics=None):
+    return client.submit_conversation(
+        model_id=PRIMARY_MODEL,
+        messages=[{"role": "user", "content": [{"text": "What should I eat before a run?"}]}],
+        system_prompts=[],
+        inference_config={"maxTokens": 100},
+        metrics=metrics
+    )
+
+
+def test_identical_requests_share_one_model_call(coalescing, transport):
+    follower_metrics = {}
+    leader = submit(coalescing)
+    follower = submit(coalescing, follower_metrics)
+
+    assert isinstance(follower, FlightStream)
+    assert "".join(follower) == "".join(leader)
+    assert follower_metrics["coalesced"] is True
+    assert transport.models[PRIMARY_MODEL].calls == 1
+
+
+def test_followers_get_the_full_answer_when_the_leader_disconnects(coalescing, transport):
+    leader = submit(coalescing)
+    follower = submit(coalescing)
+
+    chunks = iter(leader)
+    next(chunks)
+    # What a disconnecting SSE client does to the leader's stream
+    chunks.close()
+
+    assert len("".join(follower).split()) == 20
+    assert coalescing.single_flight.drained == 1
+    assert transport.models[PRIMARY_MODEL].calls == 1
@@ -0,0 +1,196 @@
+"""
+User Repository
+
+This module provides the user lookups behind login, registration, profile
+and recommendation endpoints. Users are indexed by ID and by email, so
+every lookup is a single hash (or SQLite index) probe instead of a scan
+over all users, and new user IDs come from an allocator that is safe to
+call from concurrent requests.
+
+The default repository keeps users in memory. When DATABASE_URL points at
+a SQLite database (sqlite:///wellness_hub.db), users are persisted there
+instead. Both are seeded with the demo users from mock_data.
+"""
+
+import json
+import logging
+import sqlite3
+import threading
+from typing import Any, Dict, Optional
+
+from mock_data import MOCK_USERS
+
+# Set up logging
+logger = logging.getLogger(__name__)
+
+ID_PREFIX = "user"
+
+
+def normalize_email(email: Optional[str]) -> str:
+    """Return the form of an email address used as the index key."""
+    return (email or "").strip().lower()
+
+
+def _id_number(user_id: str) -> int:
+    """Return the numeric suffix of an allocated ID like "user12", or 0."""
+    suffix = user_id[len(ID_PREFIX):] if user_id.startswith(ID_PREFIX) else ""
+    return int(suffix) if suffix.isdigit() else 0
+
+
+class UserRepository:
+    """In-memory user store with an email index and an ID allocator."""
+
+    def __init__(self, seed_users: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Initialize the repository.
+
+        Args:
+            seed_users: Users to load at startup, keyed by ID (defaults to MOCK_USERS)
+        """
+        self._users: Dict[str, Dict[str, Any]] = {}
+        self._email_index: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        self._last_id = 0
+
+        for user_id, user in (MOCK_USERS if seed_users is None else seed_users).items():
+            self._add_locked(user_id, user)
+
+    def _add_locked(self, user_id: str, user: Dict[str, Any]) -> None:
+        self._users[user_id] = user
+        email = normalize_email(user.get("email"))
+        if email:
+            # The earliest user with an email keeps it, as the old login scan did
+            self._email_index.setdefault(email, user_id)
+        self._last_id = max(self._last_id, _id_number(user_id))
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return the user with this ID, or None."""
+        return self._users.get(user_id)
+
+    def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Return the user registered with this email, or None."""
+        user_id = self._email_index.get(normalize_email(email))
+        return self._users.get(user_id) if user_id else None
+
+    def create(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a new user under a freshly allocated ID.
+
+        Args:
+            user: The user fields, without an ID
+
+        Returns:
+            dict: The stored user including its "id"
+        """
+        with self._lock:
+            self._last_id += 1
+            user_id = f"{ID_PREFIX}{self._last_id}"
+            user = {"id": user_id, **user}
+            self._add_locked(user_id, user)
+        return user
+
+    def __contains__(self, user_id: str) -> bool:
+        return user_id in self._users
+
+    def __len__(self) -> int:
+        return len(self._users)
+
+
+class SQLiteUserRepository:
+    """User store persisted in SQLite, with the same interface as UserRepository."""
+
+    def __init__(self, path: str, seed_users: Optional[Dict[str, Dict[str, Any]]] = None):
+        """
+        Open the database, creating the schema and seed users if needed.
+
+        Args:
+            path: Path of the SQLite database file
+            seed_users: Users to insert if missing, keyed by ID (defaults to MOCK_USERS)
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS users ("
+                "seq INTEGER PRIMARY KEY AUTOINCREMENT, "
+                "id TEXT UNIQUE, "
+                "email TEXT, "
+                "data TEXT NOT NULL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS users_email ON users (email, seq)")
+            for user_id, user in (MOCK_USERS if seed_users is None else seed_users).items():
+                self._conn.execute(
+                    "INSERT OR IGNORE INTO users (seq, id, email, data) VALUES (?, ?, ?, ?)",
+                    (_id_number(user_id) or None, user_id, normalize_email(user.get("email")), json.dumps(user))
+                )
+        logger.info("Using SQLite user store at %s", path)
+
+    def _fetch_one(self, query: str, params: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, user_id: str) -> Optional[Dict[str, Any]]:
+        """Return the user with this ID, or None."""
+        return self._fetch_one("SELECT data FROM users WHERE id = ?", (user_id,))
+
+    def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """Return the earliest user registered with this email, or None."""
+        email = normalize_email(email)
+        if not email:
+            return None
+        return self._fetch_one("SELECT data FROM users WHERE email = ? ORDER BY seq LIMIT 1", (email,))
+
+    def create(self, user: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Store a new user; its ID comes from the table's autoincrement sequence.
+
+        Args:
+            user: The user fields, without an ID
+
+        Returns:
+            dict: The stored user including its "id"
+        """
+        with self._lock, self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO users (email, data) VALUES (?, ?)",
+                (normalize_email(user.get("email")), "{}")
+            )
+            user_id = f"{ID_PREFIX}{cursor.lastrowid}"
+            user = {"id": user_id, **user}
+            self._conn.execute(
+                "UPDATE users SET id = ?, data = ? WHERE seq = ?",
+                (user_id, json.dumps(user), cursor.lastrowid)
+            )
+        return user
+
+    def __contains__(self, user_id: str) -> bool:
+        with self._lock:
+            return self._conn.execute("SELECT 1 FROM users WHERE id = ?", (user_id,)).fetchone() is not None
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM users").fetchone()[0]
+
+    def close(self) -> None:
+        """Close the database connection."""
+        with self._lock:
+            self._conn.close()
+
+
+def create_user_repository(database_url: Optional[str] = None):
+    """
+    Create the user repository for a DATABASE_URL.
+
+    Args:
+        database_url: A sqlite:///path URL, or None/empty for the in-memory store
+
+    Returns:
+        UserRepository or SQLiteUserRepository
+    """
+    if not database_url:
+        return UserRepository()
+    if not database_url.startswith("sqlite:///"):
+        raise ValueError(f"Unsupported DATABASE_URL {database_url!r}; only sqlite:/// URLs are supported")
+    return SQLiteUserRepository(database_url[len("sqlite:///"):])